@@ -0,0 +1,173 @@
+import json
+import os
+import pickle
+import shutil
+from datetime import datetime
+
+import pandas as pd
+
+import step_metrics
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # without pyarrow, intermediates fall back to pickles (still exact, but not columnar)
+    pa = None
+
+
+# Intermediate files handed over between the pipeline steps.
+# A table is stored as one Parquet file, a set of named tables (e.g. the "nodes" and "edges" sheets) as a directory
+# with one Parquet file per table. dtypes are preserved; object columns that Arrow would not read back as such
+# (e.g. geoIDs mixing numbers and "world", or numbers and None) are stored as pickled values, listed in the file's
+# metadata.
+# .xlsx paths are read and written as Excel: the manually curated inputs and the deliverables stay in Excel.
+
+ARTIFACT_EXTENSION = ".parquet" if pa is not None else ".pkl"
+EXPORT_EXTENSIONS = [".xlsx", ".gexf", ".graphml"] # exports written next to an artifact, copied along with it
+PICKLED_COLUMNS_METADATA_KEY = b"pickled_columns"
+
+
+def artifact_file_name(file_name):
+    """
+    "1.3_ENGdata_geonamesExtracted.xlsx" -> "1.3_ENGdata_geonamesExtracted.parquet"
+    """
+    root, _ = os.path.splitext(file_name)
+    return f"{root}{ARTIFACT_EXTENSION}"
+
+
+def add_timestamp_to_filename(file_path):
+    root, ext = os.path.splitext(file_path)
+    return f"{root}_{datetime.now().strftime("%Y%m%d%H%M%S")}{ext}"
+
+
+def write_table(df, file_path):
+    if file_path.endswith(".xlsx"):
+        df.to_excel(file_path, index=False)
+    elif file_path.endswith(".pkl"):
+        df.reset_index(drop=True).to_pickle(file_path)
+    else:
+        pickled_columns = []
+        arrow_safe_df = df.reset_index(drop=True)
+        for col in df.columns[df.dtypes == object]:
+            # only text columns read back as object columns: numbers with None would come back as float64,
+            # booleans without None as bool... so any other object column is pickled
+            try:
+                arrow_safe = pa.types.is_string(pa.array(df[col], from_pandas=True).type)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                arrow_safe = False
+            if not arrow_safe:
+                arrow_safe_df[col] = df[col].map(pickle.dumps).to_numpy()
+                pickled_columns.append(col)
+        table = pa.Table.from_pandas(arrow_safe_df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[PICKLED_COLUMNS_METADATA_KEY] = json.dumps(pickled_columns).encode("utf-8")
+        pq.write_table(table.replace_schema_metadata(metadata), file_path)
+
+
+def read_table(file_path):
+    if file_path.endswith(".xlsx"):
+        return pd.read_excel(file_path, sheet_name=0)
+    if file_path.endswith(".pkl"):
+        return pd.read_pickle(file_path)
+    table = pq.read_table(file_path)
+    pickled_columns = json.loads((table.schema.metadata or {}).get(PICKLED_COLUMNS_METADATA_KEY, b"[]"))
+    df = table.to_pandas()
+    for col in pickled_columns:
+        df[col] = pd.Series([pickle.loads(value) for value in df[col]], index=df.index, dtype=object)
+    return df
+
+
+def write_artifact(data, file_path):
+    """
+    Args:
+        data: a DataFrame, or a dict table name -> DataFrame (written as sheets for .xlsx, as a directory otherwise)
+        file_path: .parquet/.pkl artifact, or .xlsx
+    """
+    if not isinstance(data, dict):
+        write_table(data, file_path)
+    elif file_path.endswith(".xlsx"):
+        with pd.ExcelWriter(file_path, engine="openpyxl") as writer:
+            for table_name, df in data.items():
+                df.to_excel(writer, sheet_name=table_name, index=False)
+    else:
+        _, ext = os.path.splitext(file_path)
+        os.makedirs(file_path, exist_ok=True)
+        for table_name, df in data.items():
+            write_table(df, os.path.join(file_path, f"{table_name}{ext}"))
+
+
+def read_artifact(file_path, table_name=None):
+    """
+    Args:
+        file_path: artifact written by write_artifact, or any Excel file
+        table_name: table (sheet) to read from a multi-table artifact, default: the single table / first sheet
+
+    Returns: pandas.DataFrame
+    """
+    if file_path.endswith(".xlsx"):
+        df = pd.read_excel(file_path, sheet_name=table_name if table_name is not None else 0)
+    elif table_name is None:
+        df = read_table(file_path)
+    else:
+        _, ext = os.path.splitext(file_path)
+        file_path = os.path.join(file_path, f"{table_name}{ext}")
+        df = read_table(file_path)
+    step_metrics.count("bytes_read", step_metrics.path_size(file_path))
+    step_metrics.count("rows_in", len(df))
+    return df
+
+
+def load_table(source, table_name=None):
+    """
+    Lets the step functions take either a path or the in-memory result of the previous step.
+
+    Args:
+        source: artifact or Excel path, a DataFrame, or a dict table name -> DataFrame
+        table_name: table (sheet) of a multi-table source
+
+    Returns: pandas.DataFrame (a copy for in-memory sources, which may be shared with other steps)
+    """
+    if isinstance(source, dict):
+        source = source[table_name]
+    if isinstance(source, pd.DataFrame):
+        step_metrics.count("rows_in", len(source))
+        return source.copy()
+    return read_artifact(source, table_name)
+
+
+def save_artifact(file_path, data, export_excel=False):
+    """
+    Writes data to a timestamped version of file_path, like save_df_to_file() does for Excel files.
+
+    Args:
+        file_path: artifact path, the timestamp is added to the file name
+        data: a DataFrame or a dict table name -> DataFrame
+        export_excel: also write the same data to a timestamped .xlsx, for human review or as a deliverable
+
+    Returns: path to the timestamped artifact
+    """
+    timestamped_file_path = add_timestamp_to_filename(file_path)
+    write_artifact(data, timestamped_file_path)
+    if export_excel and not timestamped_file_path.endswith(".xlsx"):
+        root, _ = os.path.splitext(timestamped_file_path)
+        write_artifact(data, f"{root}.xlsx")
+        print(f"Excel export saved to {root}.xlsx")
+    return timestamped_file_path
+
+
+def copy_artifact(source_path, destination_path):
+    """
+    shutil.copy for artifacts, which can be directories. Also copies the exports next to it (Excel, GEXF...), if any.
+    """
+    if os.path.isdir(source_path):
+        if os.path.isdir(destination_path):
+            shutil.rmtree(destination_path)
+        shutil.copytree(source_path, destination_path)
+    else:
+        shutil.copy(source_path, destination_path)
+
+    source_root, source_ext = os.path.splitext(source_path)
+    destination_root, _ = os.path.splitext(destination_path)
+    for ext in EXPORT_EXTENSIONS:
+        if source_ext != ext and os.path.exists(f"{source_root}{ext}"):
+            shutil.copy(f"{source_root}{ext}", f"{destination_root}{ext}")
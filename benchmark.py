@@ -0,0 +1,266 @@
+"""
+Benchmark harness for the data pipeline
+
+Generates synthetic route spreadsheets with the schema of the real data (mergeID, include, locN location as stated,
+locN geoID, locN node role, Medical Products, incident date, Publication Date...) at a configurable scale,
+runs every stage on them and times it:
+clean_categories, process_all_locations (GeoNames answered by a synthetic offline index, no API calls),
+run_exploratory_analysis, transform2network, encode_network, create_adjacency_matrix,
+adjacency_matrices_from_network and the network_metrics KPP functions.
+
+The timings are saved to a baseline JSON file; later runs are compared against it and the stages that got slower
+than the tolerance are flagged, so that regressions (and how the code scales) are visible.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault("MPLBACKEND", "Agg")  # the wordclouds are rendered off-screen
+
+import numpy as np
+import pandas as pd
+
+import geo2features
+from data2network import encode_network, transform2network
+from data_cleanup import clean_categories
+from edges2matrix import adjacency_matrices_from_network, create_adjacency_matrix
+from exploratory_analysis import run_exploratory_analysis
+from geo2features import process_all_locations
+from network_metrics import graph_from_network, kpp_neg, kpp_pos
+
+SYNTHETIC_GEOID_BASE = 1_000_000  # place geoID = base + country * 1000 + place
+SYNTHETIC_COUNTRY_GEOID_BASE = 9_000_000
+SYNTHETIC_CONTINENTS = ["Africa", "Asia", "Europe", "North America", "Oceania", "South America"]
+NODE_ROLES = ["origin", "intermediary", "manufacturing", "destination", "assembly"]
+WORDING_USED = ["fake", "counterfeit", "falsified", "substandard", "illegal", "unlicensed"]
+# spelling variants of the same products, some of them mapped to one term by the synthetic cleanup dictionary
+MEDICAL_PRODUCTS = ["Viagra", "viagra ", "Sildenafil", "sildenafil", "Cialis", "tadalafil", "Paracetamol",
+                    "paracetamol ", "antibiotics", "Antibiotics", "amoxicillin", "Amoxicilin", "insulin", "COVID-19 vaccine",
+                    "covid vaccine", "hydroxychloroquine", "Ivermectin", "ivermectin", "tramadol", "Tramadol",
+                    "botox", "Botox", "slimming pills", "anabolic steroids", "steroids", "malaria tablets",
+                    "artemether", "codeine syrup", "cough syrup", "vitamins"]
+CLEANUP_DICTIONARY = {"viagra": "sildenafil", "cialis": "tadalafil", "amoxicilin": "amoxicillin",
+                      "covid vaccine": "COVID-19 vaccine", "steroids": "anabolic steroids"}
+
+
+def synthetic_country_name(country):
+    return f"Country {country:03d}"
+
+
+def make_synthetic_routes(n_routes, n_countries=200, places_per_country=50, seed=0):
+    """
+    Random routes with the columns of "1.1_ENGdata_geoID.xlsx".
+    Countries are drawn from a long-tailed distribution (a few hubs, many rare countries), as in the real data;
+    routes have 2 to 4 locations, a few of them "world", and articles hold 1 to 3 routes (mergeID "<article>-<route>").
+
+    Args:
+        n_routes: number of rows
+        n_countries: number of distinct countries the geoIDs belong to
+        places_per_country: number of distinct geoIDs per country
+        seed: seed of the random generator, the same arguments always give the same data
+
+    Returns: pandas.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+
+    articles = pd.Series(np.sort(rng.integers(0, max(1, n_routes // 2), n_routes)))
+    route_numbers = articles.groupby(articles).cumcount() + 1
+    df = pd.DataFrame({"mergeID": articles.astype(str) + "-" + route_numbers.astype(str),
+                       "include": (rng.random(n_routes) > 0.1).astype(int)})
+
+    country_weights = 1 / np.arange(1, n_countries + 1)
+    route_lengths = rng.integers(2, 5, n_routes)
+    for k in range(1, 5):
+        countries = rng.choice(n_countries, n_routes, p=country_weights / country_weights.sum())
+        places = rng.integers(0, places_per_country, n_routes)
+        geo_ids = pd.Series(SYNTHETIC_GEOID_BASE + countries * 1000 + places, dtype=object)
+        geo_ids[rng.random(n_routes) < 0.02] = "world"
+        has_loc = route_lengths >= k
+        df[f"loc{k} location as stated"] = ("place " + pd.Series(places).astype(str)).where(has_loc, None)
+        df[f"loc{k} geoID"] = geo_ids.where(has_loc, None)
+        df[f"loc{k} node role"] = pd.Series(rng.choice(NODE_ROLES, n_routes)).where(has_loc, None)
+
+    products = pd.Series(rng.choice(MEDICAL_PRODUCTS, n_routes))
+    n_products = rng.integers(1, 4, n_routes)
+    for extra in [2, 3]:
+        products = products.where(n_products < extra, products + ";" + rng.choice(MEDICAL_PRODUCTS, n_routes))
+    df["Medical Products"] = products.where(rng.random(n_routes) > 0.05, None)
+
+    days = pd.to_timedelta(rng.integers(0, 5 * 365, n_routes), unit="D")
+    df["incident date"] = (pd.Timestamp("2018-01-01") + days).where(rng.random(n_routes) > 0.1, pd.NaT)
+    df["Publication Date"] = pd.Timestamp("2018-01-01") + days + pd.to_timedelta(rng.integers(0, 60, n_routes), unit="D")
+    df["medicine quality"] = rng.choice(["falsified", "indistinguishable"], n_routes)
+    df["number of individuals"] = rng.integers(1, 20, n_routes)
+    df["wording used"] = rng.choice(WORDING_USED, n_routes)
+    df["route stopped at"] = pd.Series(rng.choice(["", "loc2", "loc2;loc3", "customs"], n_routes)).replace("", None)
+    df["discovery location"] = pd.Series(rng.choice(["", "loc1", "loc2", "loc3"], n_routes)).replace("", None)
+    return df
+
+
+class SyntheticGeonamesIndex:
+    """
+    Stand-in for GeonamesOfflineIndex answering for the geoIDs of make_synthetic_routes():
+    Earth > continent > country > ADM1 > place, without any file or network access.
+    """
+
+    def hierarchy(self, geo_id):
+        country, place = divmod(int(geo_id) - SYNTHETIC_GEOID_BASE, 1000)
+        if country < 0:
+            return []
+        country_code = f"X{country:03d}"
+
+        def element(name, element_geo_id, lat, lng, code=""):
+            return {"toponymName": name, "name": name, "lat": str(lat), "lng": str(lng), "countryCode": code,
+                    "geonameId": str(element_geo_id)}
+
+        return [element("Earth", 6295630, 0, 0),
+                element(SYNTHETIC_CONTINENTS[country % len(SYNTHETIC_CONTINENTS)], 6255140 + country % 6, 10, 20),
+                element(synthetic_country_name(country), SYNTHETIC_COUNTRY_GEOID_BASE + country,
+                        round(-60 + country * 0.6, 4), round(-180 + country * 1.7, 4), country_code),
+                element(f"Region {country:03d}-{place % 5}", 8_000_000 + country * 10 + place % 5, 1, 2, country_code),
+                element(f"Place {place}", geo_id, 3, 4, country_code)]
+
+
+def time_stage(timings, stage, func, *args, quiet=True, **kwargs):
+    """
+    Calls func(*args, **kwargs), stores its wall time in timings[stage] and returns its result.
+    quiet mutes the stage's own prints, so that the timings do not depend on the terminal.
+    """
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w", encoding="utf-8"))))
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage] = round(time.perf_counter() - start, 3)
+    print(f"⏱️ {stage}: {timings[stage]:.3f}s")
+    return result
+
+
+def run_benchmark(n_routes, n_countries=200, places_per_country=50, kpp_k=1, seed=0, quiet=True):
+    """
+    Runs every stage once on a synthetic dataset, in a temporary directory (the GeoNames cache starts empty).
+
+    Args:
+        n_routes, n_countries, places_per_country, seed: see make_synthetic_routes()
+        kpp_k: size of the KPP node sets; kpp_neg tries every combination of kpp_k nodes, keep it small
+        quiet: mute the prints of the stages
+
+    Returns: dict stage -> wall time in seconds
+    """
+    print(f"🔄 Benchmark: {n_routes} routes, {n_countries} countries...")
+    routes_df = make_synthetic_routes(n_routes, n_countries, places_per_country, seed)
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        cleanup_dictionary_file_path = os.path.join(work_dir, "aux_cleanup_dictionary.xlsx")
+        pd.DataFrame({"key": list(CLEANUP_DICTIONARY), "value": list(CLEANUP_DICTIONARY.values())}).to_excel(
+            cleanup_dictionary_file_path, index=False)
+        cleaned_df, _ = time_stage(timings, "clean_categories", clean_categories,
+                                   routes_df, cleanup_dictionary_file_path, None, quiet=quiet)
+
+        geo2features.GEONAMES_OFFLINE_INDEX = SyntheticGeonamesIndex()
+        try:
+            enriched_df, _ = time_stage(timings, "process_all_locations", process_all_locations,
+                                        cleaned_df, os.path.join(work_dir, "aux_geonames_ID_dictionary.xlsx"), None,
+                                        quiet=quiet)
+        finally:
+            geo2features.GEONAMES_OFFLINE_INDEX = None
+
+        time_stage(timings, "run_exploratory_analysis", run_exploratory_analysis,
+                   enriched_df, work_dir, cleaned_df, "1.4_exploratory_analysis.xlsx", show_plots=False, quiet=quiet)
+        (nodes_df, edges_df), _ = time_stage(timings, "transform2network", transform2network,
+                                             enriched_df, work_dir, None, quiet=quiet)
+
+    network = time_stage(timings, "encode_network", encode_network, nodes_df, edges_df, quiet=quiet)
+    # one synthetic node per country: the country names are unique and can stand for the clockwise order
+    time_stage(timings, "create_adjacency_matrix", create_adjacency_matrix,
+               edges_df, nodes_df.set_index("ID")["country_name"], nodes_df["country_name"].tolist(), quiet=quiet)
+    time_stage(timings, "adjacency_matrices", adjacency_matrices_from_network,
+               network, nodes_df["country_name"].tolist(), quiet=quiet)
+
+    graph = graph_from_network(network)
+    time_stage(timings, "kpp_neg", kpp_neg, graph, kpp_k, quiet=quiet)
+    time_stage(timings, "kpp_pos", kpp_pos, graph, kpp_k, quiet=quiet)
+    return timings
+
+
+def run_benchmarks(scales, n_countries=200, places_per_country=50, kpp_k=1, seed=0, quiet=True):
+    """
+    Returns: the results of run_benchmark() for each number of routes in scales, with the environment they ran in
+    """
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "runs": {str(n_routes): {"n_routes": n_routes, "n_countries": n_countries, "kpp_k": kpp_k,
+                                 "stages": run_benchmark(n_routes, n_countries, places_per_country, kpp_k, seed, quiet)}
+                 for n_routes in scales},
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance=1.25):
+    """
+    Prints the timings of each stage next to the baseline's (same number of routes).
+
+    Args:
+        results, baseline: as returned by run_benchmarks()
+        tolerance: a stage slower than tolerance x its baseline time counts as a regression
+
+    Returns: list of (n_routes, stage, baseline seconds, current seconds) regressions
+    """
+    regressions = []
+    for scale, run in results["runs"].items():
+        baseline_run = baseline.get("runs", {}).get(scale)
+        if baseline_run is None:
+            print(f"❓ No baseline for {scale} routes.")
+            continue
+        print(f"📊 {scale} routes (baseline of {baseline.get('created')}):")
+        for stage, seconds in run["stages"].items():
+            baseline_seconds = baseline_run["stages"].get(stage)
+            if baseline_seconds is None:
+                print(f"   {stage:<26} {seconds:>9.3f}s   (no baseline)")
+                continue
+            ratio = seconds / baseline_seconds if baseline_seconds > 0 else float("inf")
+            flag = "⚠️ slower" if ratio > tolerance else ("✅ faster" if ratio < 1 / tolerance else "")
+            print(f"   {stage:<26} {seconds:>9.3f}s   baseline {baseline_seconds:>9.3f}s   x{ratio:.2f} {flag}")
+            if ratio > tolerance:
+                regressions.append((int(scale), stage, baseline_seconds, seconds))
+    return regressions
+
+
+def load_baseline(baseline_file_path):
+    if not os.path.exists(baseline_file_path):
+        return None
+    with open(baseline_file_path, encoding="utf-8") as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(baseline_file_path, results):
+    with open(baseline_file_path, "w", encoding="utf-8") as baseline_file:
+        json.dump(results, baseline_file, indent=1)
+    print(f"💾 Benchmark baseline saved to {baseline_file_path}")
+
+
+if __name__ == "__main__":
+    # numbers of routes to benchmark (the real data has a few thousand)
+    scales = [10_000, 100_000]
+    n_countries = 200
+    kpp_k = 1
+    baseline_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+    update_baseline = False # save this run as the new baseline (also done when there is no baseline yet)
+
+    results = run_benchmarks(scales, n_countries=n_countries, kpp_k=kpp_k)
+    baseline = load_baseline(baseline_file_path)
+    regressions = compare_with_baseline(results, baseline) if baseline is not None else []
+    if baseline is None or update_baseline:
+        save_baseline(baseline_file_path, results)
+    if regressions:
+        print(f"⚠️ {len(regressions)} stage(s) slower than the baseline.")
+        sys.exit(1)
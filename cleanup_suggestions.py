@@ -0,0 +1,144 @@
+import os
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from artifacts import load_table
+from data_cleanup import CLEANUP_COLUMNS, split_terms
+
+
+# Suggests new entries for "aux_cleanup_dictionary.xlsx".
+# The dictionary only catches exact (lower case) matches, so new spelling variants ("Amoxicilina", "viagra 100mg")
+# go through uncleaned. All distinct terms of the cleaned columns are indexed by their character trigrams
+# (an inverted index trigram -> terms), so that the closest known terms of every unmatched term are found by only
+# looking at the terms sharing trigrams with it, instead of comparing all pairs of terms.
+# The suggestions are written to a review sheet: accepted rows can be pasted into the cleanup dictionary as they are.
+
+TOP_K_SUGGESTIONS = 3
+MIN_SIMILARITY = 0.4
+
+
+def match_key(term):
+    """
+    Lower case, accents removed (multi-language corpus: "Amoxicilina" ~ "amoxicilína"), spaces collapsed
+    """
+    decomposed = unicodedata.normalize("NFKD", term.lower())
+    return " ".join("".join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Inverted index trigram -> ids of the indexed texts, ranking candidates by the Jaccard similarity
+    of their trigram sets (|shared| / |union|).
+    """
+
+    def __init__(self, texts):
+        self.texts = list(texts)
+        self.trigram_counts = np.array([len(trigrams(text)) for text in self.texts])
+        postings = defaultdict(list)
+        for text_id, text in enumerate(self.texts):
+            for trigram in trigrams(text):
+                postings[trigram].append(text_id)
+        self.postings = {trigram: np.array(text_ids) for trigram, text_ids in postings.items()}
+
+    def query(self, text, k=TOP_K_SUGGESTIONS, min_similarity=MIN_SIMILARITY):
+        """
+        Returns: list of (indexed text, similarity) pairs, most similar first (ties in indexing order), at most k
+        """
+        query_trigrams = trigrams(text)
+        matched = [self.postings[t] for t in query_trigrams if t in self.postings]
+        if not matched:
+            return []
+        # shared trigram counts of the texts in the matched postings only (not a pass over all the indexed texts)
+        candidates, shared = np.unique(np.concatenate(matched), return_counts=True)
+        similarity = shared / (len(query_trigrams) + self.trigram_counts[candidates] - shared)
+        kept = similarity >= min_similarity
+        candidates, similarity = candidates[kept], similarity[kept]
+        top = np.lexsort((candidates, -similarity))[:k]
+        return [(self.texts[candidates[i]], round(float(similarity[i]), 3)) for i in top]
+
+
+def suggest_cleanup_entries(data_file_path, cleanup_dictionary_path, output_file_path=None, columns=CLEANUP_COLUMNS,
+                            k=TOP_K_SUGGESTIONS, min_similarity=MIN_SIMILARITY):
+    """
+    Proposes dictionary entries (key -> value) for the terms the cleanup dictionary does not match.
+
+    The candidates are the canonical values of the dictionary and the other distinct terms of the data;
+    a candidate term that is itself a dictionary key is proposed as its value. A term is only proposed as the
+    canonical form of a rarer one, so that variants are pointed towards the most common spelling; of two equally
+    frequent terms (typically two one-off typos), the first in alphabetical order is proposed for the other.
+
+    Args:
+        data_file_path: routes data (path or DataFrame), e.g. 1.1
+        cleanup_dictionary_path: Excel file with the "key" and "value" columns (may not exist yet)
+        output_file_path: review sheet (Excel) to write, None to only return it
+        columns: ";"-separated columns whose terms are checked
+        k: suggestions per unmatched term
+        min_similarity: lowest trigram similarity (0 to 1) of a suggestion
+
+    Returns: DataFrame with one row per suggestion: key, occurrences, rank, value, similarity, matched term
+    """
+    df = load_table(data_file_path)
+    cleanup_dict = {}
+    if os.path.exists(cleanup_dictionary_path):
+        cleanup_dict = pd.read_excel(cleanup_dictionary_path, sheet_name=0).set_index("key")["value"].to_dict()
+
+    terms = pd.concat([split_terms(df[col]) for col in columns if col in df.columns])
+    terms = terms[terms.ne("")].str.lower()
+    occurrences = terms.value_counts().to_dict()
+    canonical_values = {str(value).lower() for value in cleanup_dict.values()}
+    unmatched = [term for term in occurrences if term not in cleanup_dict and term not in canonical_values]
+    print(f"🔍 {len(occurrences)} distinct terms, {len(unmatched)} not in the cleanup dictionary")
+
+    # index every distinct term and canonical value once, by its accent-free match key; when several share a key,
+    # it stands for the canonical value, else the dictionary key, else the most frequent term
+    def preference(candidate):
+        return candidate in canonical_values, candidate in cleanup_dict, occurrences.get(candidate, 0)
+
+    candidate_by_match_key = {}
+    for candidate in sorted(set(occurrences) | canonical_values):
+        candidate_key = match_key(candidate)
+        if candidate_key not in candidate_by_match_key \
+                or preference(candidate) > preference(candidate_by_match_key[candidate_key]):
+            candidate_by_match_key[candidate_key] = candidate
+    index = TrigramIndex(candidate_by_match_key)
+
+    suggestions = []
+    for term in unmatched:
+        rank = 0
+        # a few extra candidates, as the term itself and the less frequent ones are left out below
+        for candidate_key, similarity in index.query(match_key(term), k=3 * k + 1, min_similarity=min_similarity):
+            candidate = candidate_by_match_key[candidate_key]
+            value = cleanup_dict.get(candidate, candidate)
+            # (occurrences, reverse alphabetical order) of a plain term must be higher than the term's
+            if candidate == term or (candidate not in canonical_values and candidate not in cleanup_dict
+                                     and (occurrences.get(candidate, 0), term) <= (occurrences[term], candidate)):
+                continue
+            rank += 1
+            suggestions.append({"key": term, "occurrences": int(occurrences[term]), "rank": rank, "value": value,
+                                "similarity": similarity, "matched term": candidate})
+            if rank == k:
+                break
+
+    suggestions_df = pd.DataFrame(suggestions, columns=["key", "occurrences", "rank", "value", "similarity",
+                                                        "matched term"])
+    print(f"💡 {suggestions_df['key'].nunique()} terms with suggestions")
+    if output_file_path:
+        suggestions_df.to_excel(output_file_path, index=False)
+        print(f"Cleanup dictionary suggestions saved to {output_file_path}")
+    return suggestions_df
+
+
+if __name__ == "__main__":
+    # working directory
+    wdir = 'C:/Users/aolliaro/OneDrive - Nexus365/DPhil data and analysis/phd_analysis_data'
+    suggest_cleanup_entries(os.path.join(wdir, "1.1_ENGdata_geoID.xlsx"),
+                            os.path.join(wdir, "aux_cleanup_dictionary.xlsx"),
+                            os.path.join(wdir, "aux_cleanup_dictionary_suggestions.xlsx"))
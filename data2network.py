@@ -1,6 +1,12 @@
+import hashlib
 import os
+
+import numpy as np
 import pandas as pd
-from datetime import datetime
+
+from artifacts import load_table, read_artifact, save_artifact, write_artifact
+from data_cleanup import TERM_SEPARATOR, split_terms
+from edge_timeline import add_gephi_intervals
 
 
 # transform data to two files suitable for Gephi.
@@ -10,224 +16,476 @@ from datetime import datetime
 # the edges table is a list of connections between locations with attributes such as time interval
 #     time interval according to https://gephi.org/users/supported-graph-formats/spreadsheet/
 
-def add_timestamp_to_filename(file_path):
-    root, ext = os.path.splitext(file_path)
-    return f"{root}_{datetime.now().strftime("%Y%m%d%H%M%S")}{ext}"
+LOCS = ["loc1", "loc2", "loc3", "loc4"]
+# route columns "<loc> <suffix>" -> column of the long stop table
+STOP_COLUMNS = {"geoname_country": "name", "geoname_country_geoId": "geo_id", "geoname_country_lat": "lat",
+                "geoname_country_lon": "lon", "geoname_countryCode": "countryCode"}
+# route columns copied to its edges
+EDGE_ROUTE_COLUMNS = ["mergeID", "Medical Products", "medicine quality", "incident date"]
+EDGE_COLUMNS = ["ID", "Source", "Target", "Label", "Medical Products", "medicine quality", "incident date"]
+# every route column its nodes and edges are built from: a route is rebuilt when one of them changes
+NETWORK_ROUTE_COLUMNS = EDGE_ROUTE_COLUMNS + [f"{loc} {suffix}" for loc in LOCS for suffix in STOP_COLUMNS]
+NETWORK_BUILD_TABLES = ["version", "routes", "stops", "segments"]
+# edge attributes repeated across many edges (a few countries and product lists)
+EDGE_CATEGORICAL_COLUMNS = ["Label", "Medical Products", "medicine quality"]
+
+
+def normalise_node_id(geo_id):
+    """
+    Node ID of a country geoID: 2658434.0 / "2658434" -> "2658434", None for empty cells and "world"
+    """
+    if pd.isna(geo_id) or str(geo_id).strip() == "" or str(geo_id).strip().lower() == "world":
+        return None
+    if str(geo_id).strip().isdigit() or str(geo_id).replace(".", "", 1).isdigit():
+        return str(int(float(geo_id)))
+    return str(geo_id).strip()
+
+
+def text_or_none(series):
+    """
+    str() of every value, None for the missing ones
+    """
+    return series.astype(object).astype(str).where(series.notna(), None)
+
+
+def melt_stops(routes_df):
+    """
+    Wide to long: one row per route stop with a country (loc1 to loc4), loc-major (all loc1 stops first).
+    Each distinct geoID is normalised once, by factorizing the column.
+
+    Args:
+        routes_df: routes (1.3) with the "<loc> geoname_country..." columns
+
+    Returns: DataFrame with columns route (row position in routes_df), loc (0 to 3), node_id, name, lat, lon, countryCode
+    """
+    stops = []
+    for loc_number, loc in enumerate(LOCS):
+        loc_stops = routes_df.reindex(columns=[f"{loc} {suffix}" for suffix in STOP_COLUMNS])
+        loc_stops.columns = list(STOP_COLUMNS.values())
+        loc_stops.insert(0, "loc", loc_number)
+        loc_stops.insert(0, "route", np.arange(len(routes_df)))
+        stops.append(loc_stops.astype({col: object for col in STOP_COLUMNS.values()}))
+    stops_df = pd.concat(stops, ignore_index=True)
+
+    codes, unique_geo_ids = pd.factorize(stops_df["geo_id"])
+    node_ids = np.array([normalise_node_id(geo_id) for geo_id in unique_geo_ids] + [None], dtype=object)
+    stops_df["node_id"] = node_ids[codes]  # code -1 (missing geoID) picks the trailing None
+    return stops_df[stops_df["node_id"].notna()].drop(columns="geo_id").reset_index(drop=True)
+
+
+def nodes_from_stops(stops_df):
+    """
+    Nodes table of the stops, which must be loc-major (see melt_stops): the first occurrence of a node wins
+    """
+    stops_df = stops_df.drop_duplicates(subset=["node_id"])
+
+    # built from lists, so that the column dtypes are inferred from the values
+    nodes_df = pd.DataFrame({
+        "ID": stops_df["node_id"].tolist(),
+        "lat": stops_df["lat"].tolist(),
+        "lon": stops_df["lon"].tolist(),
+        "country_name": text_or_none(stops_df["name"]).tolist(),
+        "country_geoId": stops_df["node_id"].tolist(),
+        "countryCode": stops_df["countryCode"].tolist(),
+    })
+    return nodes_df
 
 
-def construct_nodes(indexed_df):
+def route_segments(stops_df, routes_df):
+    """
+    One row per edge, between consecutive valid stops of each route, before the dtype inference of the edges table
+    (object columns, missing values are None).
+
+    Args:
+        stops_df: stops of the routes (see melt_stops), whose route column is a row position in routes_df
+        routes_df: routes (1.3), for the mergeID, Medical Products, medicine quality and incident date of each route
+
+    Returns: DataFrame with the EDGE_COLUMNS and route, in route order
+    """
+    stops_df = stops_df.sort_values(["route", "loc"], kind="stable")
+    stops_df["name"] = text_or_none(stops_df["name"])
+    by_route = stops_df.groupby("route", sort=False)
+    stops_df["segment"] = by_route.cumcount() + 1
+    stops_df[["target", "target_name"]] = by_route[["node_id", "name"]].shift(-1)
+    segments_df = stops_df[stops_df["target"].notna()]
+
+    route = segments_df["route"].to_numpy()
+    route_attributes = routes_df.reindex(columns=EDGE_ROUTE_COLUMNS).iloc[route]
+    incident_date = route_attributes["incident date"].astype(object)
+
+    source_name, target_name = segments_df["name"], segments_df["target_name"]
+    labels = source_name.fillna("None") + " -> " + target_name.fillna("None")
+    has_name = (source_name.notna() & source_name.ne("")) | (target_name.notna() & target_name.ne(""))
+
+    return pd.DataFrame({
+        # looks like 12345-X_Y (X is the route number and Y is the segment in that route)
+        "ID": route_attributes["mergeID"].astype(str).to_numpy() + "_" + segments_df["segment"].astype(str).to_numpy(),
+        "Source": segments_df["node_id"].to_numpy(),
+        "Target": segments_df["target"].to_numpy(),
+        "Label": labels.where(has_name, "").to_numpy(),
+        "Medical Products": text_or_none(route_attributes["Medical Products"]).to_numpy(),
+        "medicine quality": text_or_none(route_attributes["medicine quality"]).to_numpy(),
+        "incident date": incident_date.where(incident_date.notna(), None).to_numpy(),
+        "route": route,
+    })
+
+
+def edges_from_segments(segments_df):
+    # the incident date is built from a list, so that its dtype is inferred from the values (dates, text...);
+    # the other columns only hold text (or None) and stay object columns
+    return pd.DataFrame({col: segments_df[col].tolist() if col == "incident date" else segments_df[col].to_numpy(object)
+                         for col in EDGE_COLUMNS})
+
+
+def construct_nodes(routes_df):
     """
     Constructs the list of nodes from the input dataframe as a dictionary table with columns:
-    ID, lat, lon, country_name, country_geoId
+    ID, lat, lon, country_name, country_geoId, countryCode
     (for now, ID and country_geoId are the same)
     and returns it
     Args:
-        indexed_df: dict keyed by mergeID where each value is a row dict
+        routes_df: routes (1.3), one row per route
 
     Returns: nodes_df (pandas.DataFrame)
 
     """
 
-    node_attributes_col = ["geoname_country", "geoname_country_geoId", "geoname_country_lat", "geoname_country_lon", "geoname_countryCode"]
-    nodes_by_id = {}
-
 # TODO use the "aux_geonames_ID_dictionary" file instead:
     #  use the country geoID and name and lat lon columns only, make a set, done
-    for loc in ["loc1", "loc2", "loc3", "loc4"]:
-        name_col = f"{loc} {node_attributes_col[0]}"
-        geo_id_col = f"{loc} {node_attributes_col[1]}"
-        lat_col = f"{loc} {node_attributes_col[2]}"
-        lon_col = f"{loc} {node_attributes_col[3]}"
-        country_code_col = f"{loc} {node_attributes_col[4]}"
-
-        for _, row in indexed_df.items():
-            geo_id = row.get(geo_id_col)
-            if pd.isna(geo_id) or str(geo_id).strip() == "" or str(geo_id).strip().lower() == "world":
-                continue
-
-            node_id = str(int(float(geo_id))) if str(geo_id).strip().isdigit() or str(geo_id).replace(".", "", 1).isdigit() else str(geo_id).strip()
-            if node_id not in nodes_by_id:
-                # Fetch attributes (first occurrence wins)
-                country_name = row.get(name_col)
-                country_code = row.get(country_code_col)
-                lat = row.get(lat_col)
-                lon = row.get(lon_col)
-
-                nodes_by_id[node_id] = {
-                    "ID": node_id,
-                    "lat": lat,
-                    "lon": lon,
-                    "country_name": None if pd.isna(country_name) else str(country_name),
-                    "country_geoId": node_id,
-                    "countryCode": country_code,
-                }
-
-    nodes_df = pd.DataFrame(list(nodes_by_id.values())).drop_duplicates(subset=["ID"]).reset_index(drop=True)
-    return nodes_df
+    return nodes_from_stops(melt_stops(routes_df))
 
 
-def construct_edges(indexed_df):
+def construct_edges(routes_df):
     """
     Construct the table of edges from the input dataframe with columns:
-    ID, Source, Target, Label
+    ID, Source, Target, Label, Medical Products, medicine quality, incident date
     the ID is the mergeID of the route plus suffix of the route segment (i.e. _1, _2, _3)
 
-    args: indexed_df
+    args: routes_df
     Returns: edges_df
     """
 
-    edge_attributes_col = ["Medical Products", "incident date"]
-    edge_attributes_col_suffix = ["geoname_country", "geoname_country_geoId"]
-
     # loc 3 and/or 4 related columns might be empty
-    # based on route length, there will be 1 2 or 3 edges with the same mergeID
-    edges = []
-
-    for merge_id, row in indexed_df.items():
-        # Build ordered list of stops with both country name and geoId, skipping empties
-        stops = []
-        for loc in ["loc1", "loc2", "loc3", "loc4"]:
-            name_col = f"{loc} {edge_attributes_col_suffix[0]}"
-            id_col = f"{loc} {edge_attributes_col_suffix[1]}"
-            name_val = row.get(name_col)
-            id_val = row.get(id_col)
-            if pd.isna(id_val) or str(id_val).strip() == "" or str(id_val).strip().lower() == "world":
-                continue
-            node_id = str(int(float(id_val))) if str(id_val).strip().isdigit() or str(id_val).replace(".", "", 1).isdigit() else str(id_val).strip()
-            stops.append({
-                "id": node_id,
-                "name": None if pd.isna(name_val) else str(name_val)
-            })
-
-        # Create edges between consecutive valid stops
-        if len(stops) < 2:
-            continue
-
-        medical_products = row.get(edge_attributes_col[0])
-        incident_date = row.get(edge_attributes_col[1])
-
-        for i in range(len(stops) - 1):
-            src = stops[i]
-            tgt = stops[i + 1]
-            edges.append({
-                "ID": f"{merge_id}_{i+1}", # looks like 12345-X_Y (X is the route number and Y is the segment in that route)
-                "Source": src["id"],
-                "Target": tgt["id"],
-                "Label": f"{src['name']} -> {tgt['name']}" if src["name"] or tgt["name"] else "",
-                "Medical Products": None if pd.isna(medical_products) else str(medical_products),
-                "incident date": incident_date if (incident_date is None or not pd.isna(incident_date)) else None
-            })
-
-    edges_df = pd.DataFrame(edges).reset_index(drop=True)
-    return edges_df
-
-
-def transform2network(only_included_routes_data_file_path, output_dir, output_file_path):
-    """
-    Produces an Excel file with two sheets.
+    # based on route length, there will be 1 2 or 3 edges with the same mergeID:
+    # one between each pair of consecutive valid stops of the route
+    return edges_from_segments(route_segments(melt_stops(routes_df), routes_df))
+
+
+def network_code_version():
+    """
+    Hash of this module's source: a build made by other code is not reused
+    """
+    with open(__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def route_hashes(routes_df):
+    """
+    uint64 hash of the content of each route that its nodes and edges depend on (NETWORK_ROUTE_COLUMNS)
+    """
+    return pd.util.hash_pandas_object(routes_df.reindex(columns=NETWORK_ROUTE_COLUMNS), index=False).to_numpy()
+
+
+def build_network(routes_df, previous_build=None):
+    """
+    Nodes and edges of the routes, like construct_nodes and construct_edges, but reusing the stops and edges of the
+    routes unchanged since a previous build: only the new or changed routes (by mergeID and content hash) are
+    melted and turned into edges, the edges of the routes no longer in routes_df are dropped.
+    The kept and new stops and edges are put back in the order of routes_df, so that the result is the same
+    as a full rebuild.
+
+    Args:
+        routes_df: routes (1.3), one row per route
+        previous_build: build returned by an earlier call, None for a full build
+
+    Returns: nodes_df, edges_df, build (dict of tables, pass it as previous_build next time)
+    """
+    merge_ids = pd.Index(routes_df["mergeID"])
+    hashes = route_hashes(routes_df)
+    kept = np.zeros(len(routes_df), dtype=bool)
+    removed_count = 0
+    # routes are matched by mergeID: with duplicated mergeIDs (now or in the previous build), everything is rebuilt
+    previous_merge_ids = pd.Index(previous_build["routes"]["mergeID"]) if previous_build is not None else None
+    if previous_build is not None and merge_ids.is_unique and previous_merge_ids.is_unique \
+            and previous_build["version"]["code_version"].iloc[0] == network_code_version():
+        previous_position = previous_merge_ids.get_indexer(merge_ids)
+        kept = previous_position != -1
+        kept[kept] = previous_build["routes"]["row_hash"].to_numpy()[previous_position[kept]] == hashes[kept]
+        removed_count = len(previous_merge_ids) - int((previous_position != -1).sum())
+
+    rebuilt = np.flatnonzero(~kept)
+    new_stops_df = melt_stops(routes_df.iloc[rebuilt])
+    new_stops_df["route"] = rebuilt[new_stops_df["route"].to_numpy()]
+    stops = [new_stops_df]
+    segments = [route_segments(new_stops_df, routes_df)]
+    if kept.any():
+        # the previous build refers to routes by mergeID, the position in routes_df may have changed
+        kept_merge_ids = merge_ids[kept]
+        for previous_table, tables in [(previous_build["stops"], stops), (previous_build["segments"], segments)]:
+            previous_table = previous_table[previous_table["mergeID"].isin(kept_merge_ids)]
+            route = merge_ids.get_indexer(previous_table["mergeID"])
+            tables.append(previous_table.drop(columns="mergeID").assign(route=route))
+    print(f"🔁 Network build: {int(kept.sum())} routes reused, {len(rebuilt)} built, {removed_count} removed")
+
+    # (the new tables are only left out when empty and there are kept ones, to keep the columns of an empty build)
+    stops_df = pd.concat([df for df in stops if len(df)] or stops[:1], ignore_index=True)
+    stops_df = stops_df.sort_values(["loc", "route"], kind="stable")
+    segments_df = pd.concat([df for df in segments if len(df)] or segments[:1], ignore_index=True)
+    segments_df = segments_df.sort_values("route", kind="stable")
+    build = {
+        "version": pd.DataFrame({"code_version": [network_code_version()]}),
+        "routes": pd.DataFrame({"mergeID": merge_ids.to_numpy(), "row_hash": hashes}),
+        "stops": stops_df.drop(columns="route").assign(mergeID=merge_ids.to_numpy()[stops_df["route"].to_numpy()]),
+        "segments": segments_df.drop(columns="route").assign(mergeID=merge_ids.to_numpy()[segments_df["route"].to_numpy()]),
+    }
+    return nodes_from_stops(stops_df), edges_from_segments(segments_df), build
+
+
+def read_network_build(build_file_path):
+    if not os.path.exists(build_file_path):
+        return None
+    return {table_name: read_artifact(build_file_path, table_name) for table_name in NETWORK_BUILD_TABLES}
+
+
+def encode_network(nodes_df, edges_df, categorical_columns=EDGE_CATEGORICAL_COLUMNS):
+    """
+    Compact, array-backed form of the nodes and edges tables, shared by the matrix and metrics code.
+    Nodes are numbered 0..N-1 in the order of nodes_df, edges refer to them by code instead of by ID string.
+
+    Args:
+        nodes_df: nodes table (construct_nodes, or the "nodes" table of an artifact)
+        edges_df: edges table, whose Source and Target are IDs of nodes_df
+        categorical_columns: edge attributes with few distinct values, stored as pandas categoricals
+
+    Returns: dict with
+        "node_ids": array code -> node ID (the label table)
+        "nodes": DataFrame of the node attributes, row i is node i
+        "source", "target": int32 arrays of node codes, one per edge
+        "edges": DataFrame of the other edge attributes, row i is edge i
+    """
+    node_ids = pd.Index(nodes_df["ID"])
+    if not node_ids.is_unique:
+        raise ValueError(f"Duplicated node IDs: {node_ids[node_ids.duplicated()].unique().tolist()}")
+    source = node_ids.get_indexer(edges_df["Source"])
+    target = node_ids.get_indexer(edges_df["Target"])
+    unknown = (source == -1) | (target == -1)
+    if unknown.any():
+        unknown_ids = pd.concat([edges_df["Source"][source == -1], edges_df["Target"][target == -1]]).unique()
+        raise KeyError(f"Edge endpoints missing from the nodes table: {unknown_ids.tolist()}")
+
+    edge_attributes = edges_df.drop(columns=["Source", "Target"]).reset_index(drop=True)
+    categorical_columns = [col for col in categorical_columns if col in edge_attributes.columns]
+    return {
+        "node_ids": node_ids.to_numpy(),
+        "nodes": nodes_df.drop(columns="ID").reset_index(drop=True),
+        "source": source.astype(np.int32),
+        "target": target.astype(np.int32),
+        "edges": edge_attributes.astype({col: "category" for col in categorical_columns}),
+    }
+
+
+def transform2network(only_included_routes_data_file_path, output_dir, output_file_path, export_excel=False,
+                      build_file_path=None):
+    """
+    Produces an artifact (see artifacts.py) with two tables, optionally exported as an Excel file with two sheets.
     The first sheet contains the list of nodes (set of unique countries)
     and the second sheet the list of edges with some additional information (what was traded and when).
 
     Args:
-        only_included_routes_data_file_path:
+        only_included_routes_data_file_path: path to the routes (1.3), or the DataFrame itself
         output_dir:
         output_file_path:
+        export_excel: also write the Excel workbook (e.g. for Gephi)
+        build_file_path: where the stops and edges of each route are kept between runs (a .pkl artifact, exact
+            cell values), so that only the new or changed routes are built; None for a full build every time
 
     Returns:
-        Path to the written Excel file
+        Path to the written artifact
     """
 
-    routes_df = pd.read_excel(only_included_routes_data_file_path, sheet_name=0)
-    indexed_df = routes_df.set_index("mergeID").to_dict(orient="index")
+    routes_df = load_table(only_included_routes_data_file_path)
 
     # Build nodes and edges
-    nodes_df = construct_nodes(indexed_df)
-    edges_df = construct_edges(indexed_df)
-    timestamped_file_path = add_timestamp_to_filename(output_file_path)
-
-    with pd.ExcelWriter(timestamped_file_path, engine="openpyxl") as writer:
-        nodes_df.to_excel(writer, sheet_name="nodes", index=False) # save nodes on sheet 1 "nodes"
-        edges_df.to_excel(writer, sheet_name="edges", index=False) # save edges on sheet 2 "edges"
+    if build_file_path:
+        nodes_df, edges_df, build = build_network(routes_df, read_network_build(build_file_path))
+        write_artifact(build, build_file_path)
+    else:
+        nodes_df = construct_nodes(routes_df)
+        edges_df = construct_edges(routes_df)
+    # save nodes as table (sheet) 1 "nodes" and edges as table (sheet) 2 "edges" (output_file_path=None: not written)
+    timestamped_file_path = save_artifact(output_file_path, {"nodes": nodes_df, "edges": edges_df},
+                                          export_excel=export_excel) if output_file_path else None
 
     return [nodes_df, edges_df], timestamped_file_path
 
 
-def remove_self_loops(network_data_file_path, output_dir, output_file_path):
+def remove_self_loops(network_data_file_path, output_dir, output_file_path, export_excel=False,
+                      gephi_edge_duration=None):
     """
-        Produces an Excel file with network data but without loops;
+        Produces an artifact (optionally an Excel file too) with network data but without loops;
         The first sheet contains the list of nodes (set of unique countries)
         and the second sheet the list of edges.
 
         Args:
-            network_data_file_path:
+            network_data_file_path: path to the network data (1.5), or a dict with the "nodes" and "edges" DataFrames
             output_dir:
             output_file_path:
+            export_excel: also write the Excel workbook (e.g. for Gephi)
+            gephi_edge_duration: add Gephi's dynamic "Interval" column to nodes and edges (see
+                edge_timeline.add_gephi_intervals), an edge lasting that long after its incident date ("0D", "30D"...);
+                None for a static network
 
         Returns:
-            A paired node_df and edge_df, Path to the written Excel file
+            A paired node_df and edge_df, Path to the written artifact
         """
     # retrieve nodes and edges (produced in previous step transform2network
-    nodes_df = pd.read_excel(network_data_file_path, sheet_name="nodes")
-    edges_df = pd.read_excel(network_data_file_path, sheet_name="edges")
+    nodes_df = load_table(network_data_file_path, "nodes")
+    edges_df = load_table(network_data_file_path, "edges")
 
     edges_df = edges_df[edges_df["Source"] != edges_df["Target"]]
+    if gephi_edge_duration is not None:
+        nodes_df, edges_df = add_gephi_intervals(nodes_df, edges_df, edge_duration=gephi_edge_duration)
 
-    timestamped_file_path = add_timestamp_to_filename(output_file_path)
-
-    with pd.ExcelWriter(timestamped_file_path, engine="openpyxl") as writer:
-        nodes_df.to_excel(writer, sheet_name="nodes", index=False)  # save nodes on sheet 1 "nodes"
-        edges_df.to_excel(writer, sheet_name="edges", index=False)  # save edges on sheet 2 "edges"
+    # save nodes as table (sheet) 1 "nodes" and edges as table (sheet) 2 "edges" (output_file_path=None: not written)
+    timestamped_file_path = save_artifact(output_file_path, {"nodes": nodes_df, "edges": edges_df},
+                                          export_excel=export_excel) if output_file_path else None
 
     return [nodes_df, edges_df], timestamped_file_path
 
-def group_countries_into_region(network_data_file_path, country_to_region_dict_file_path, output_file_path):
+def read_country_to_region(country_to_region_dict_file_path):
+    """
+    Country name -> subregion, in the (clockwise) order of the dictionary file.
+    Reads its "country" and "subregion_m49" columns (as edges2matrix does), or else its "key" and "value" columns.
     """
-        Produces an Excel file with countries grouped into subregions using the dictionary provdied (UN m49 scheme);
+    country_to_region_df = pd.read_excel(country_to_region_dict_file_path, sheet_name=0)
+    if {"country", "subregion_m49"} <= set(country_to_region_df.columns):
+        return country_to_region_df.set_index("country")["subregion_m49"].to_dict()
+    return country_to_region_df.set_index("key")["value"].to_dict()
 
-        In both files, the first sheet contains the list of nodes (set of unique countries/regions)
-        and the second sheet the list of edges.
+
+def spherical_centroid(lat, lon):
+    """
+    Centroid of points on the sphere (mean of the unit vectors), so that regions across the antimeridian
+    (e.g. Polynesia) do not end up on the other side of the globe. NaN coordinates are left out.
+    """
+    lat, lon = np.radians(lat), np.radians(lon)
+    x, y, z = np.nanmean(np.cos(lat) * np.cos(lon)), np.nanmean(np.cos(lat) * np.sin(lon)), np.nanmean(np.sin(lat))
+    return float(np.degrees(np.arctan2(z, np.hypot(x, y)))), float(np.degrees(np.arctan2(y, x)))
+
+
+def contract_network(nodes_df, edges_df, country_to_region, keep_self_loops=True):
+    """
+    Contracts the country network into a subregion network: one node per subregion, one weighted edge per pair of
+    subregions, aggregated in one grouped pass over the (integer-coded, see encode_network) edges.
+    Countries missing from country_to_region stay as their own node.
+
+    Args:
+        nodes_df, edges_df: country network (construct_nodes, construct_edges)
+        country_to_region: dict country name -> subregion, in the order the subregion nodes should have
+        keep_self_loops: keep the edges between two countries of the same subregion (as subregion self-loops)
+
+    Returns:
+        region_nodes_df: ID, Label, lat, lon (centroid of the member countries), countries (count), country_names
+        region_edges_df: ID, Source, Target, Label, Weight (number of country edges), Medical Products
+            (distinct terms), first incident date, last incident date
+    """
+    network = encode_network(nodes_df, edges_df)
+    country_names = network["nodes"]["country_name"].fillna(pd.Series(network["node_ids"]))  # unnamed: own ID
+    node_region = country_names.map(country_to_region)
+    unmapped = node_region.isna()
+    if unmapped.any():
+        print(f"⚠️ No subregion for {sorted(country_names[unmapped].astype(str).unique())}, kept as their own node")
+    node_region = node_region.fillna(country_names)
+    region_order = pd.Index(list(dict.fromkeys(list(country_to_region.values()) + node_region[unmapped].tolist())))
+    node_region_code = region_order.get_indexer(node_region)
+
+    # nodes: one per subregion with countries
+    members_df = pd.DataFrame({"region": node_region_code, "country": country_names,
+                               "lat": pd.to_numeric(network["nodes"]["lat"], errors="coerce"),
+                               "lon": pd.to_numeric(network["nodes"]["lon"], errors="coerce")})
+    region_nodes = []
+    for region_code, members in members_df.groupby("region", sort=True):
+        lat, lon = spherical_centroid(members["lat"].to_numpy(), members["lon"].to_numpy()) \
+            if members["lat"].notna().any() else (np.nan, np.nan)
+        region = str(region_order[region_code])
+        region_nodes.append({"ID": region, "Label": region, "lat": lat, "lon": lon, "countries": len(members),
+                             "country_names": ";".join(members["country"].astype(str))})
+    region_nodes_df = pd.DataFrame(region_nodes, columns=["ID", "Label", "lat", "lon", "countries", "country_names"])
+
+    # edges: country edges re-keyed by subregion code and reduced per (source, target) pair
+    edge_attributes = network["edges"].reindex(columns=["Medical Products", "incident date"])
+    segments_df = pd.DataFrame({
+        "source": node_region_code[network["source"]],
+        "target": node_region_code[network["target"]],
+        "products": edge_attributes["Medical Products"],
+        "date": pd.to_datetime(edge_attributes["incident date"], errors="coerce"),
+    })
+    if not keep_self_loops:
+        segments_df = segments_df[segments_df["source"] != segments_df["target"]]
+    pairs = ["source", "target"]
+    region_edges_df = segments_df.groupby(pairs, sort=True).agg(
+        Weight=("source", "size"), first_date=("date", "min"), last_date=("date", "max")).reset_index()
+
+    # distinct product terms per pair, split from the distinct cells only (few product lists repeat over many edges)
+    product_cells = segments_df[pairs + ["products"]].dropna().astype({"products": object}).drop_duplicates()
+    terms = split_terms(product_cells["products"])
+    terms_df = product_cells[pairs].iloc[terms.index].assign(term=terms.to_numpy())
+    terms_df = terms_df[terms_df["term"].ne("")].drop_duplicates()
+    products = terms_df.groupby(pairs)["term"].agg(lambda t: TERM_SEPARATOR.join(sorted(t)) + TERM_SEPARATOR)
+    region_edges_df = region_edges_df.merge(products.rename("Medical Products"), on=pairs, how="left")
+
+    source_name = region_order[region_edges_df["source"]].astype(str).to_numpy(object)
+    target_name = region_order[region_edges_df["target"]].astype(str).to_numpy(object)
+    region_edges_df.insert(0, "ID", source_name + "_" + target_name)
+    region_edges_df.insert(1, "Source", source_name)
+    region_edges_df.insert(2, "Target", target_name)
+    region_edges_df.insert(3, "Label", source_name + " -> " + target_name)
+    region_edges_df = region_edges_df.drop(columns=pairs).rename(
+        columns={"first_date": "first incident date", "last_date": "last incident date"})
+    return region_nodes_df, region_edges_df[["ID", "Source", "Target", "Label", "Weight", "Medical Products",
+                                             "first incident date", "last incident date"]]
+
+
+def group_countries_into_region(network_data_file_path, country_to_region_dict_file_path, output_file_path,
+                                export_excel=False, keep_self_loops=True):
+    """
+        Produces an artifact (optionally an Excel file too) with countries grouped into subregions using the dictionary provdied (UN m49 scheme);
+        see contract_network for the subregion nodes and edges.
+
+        In both files, the first sheet contains the list of nodes (subregions)
+        and the second sheet the list of weighted edges between them.
 
         Args:
-            network_data_file_path: path to the network data file (nodes and edges)
+            network_data_file_path: path to the network data file (nodes and edges), or a dict with both DataFrames
             country_to_region_dict_file_path: path to the dictionary file that matches countries to subregions
             output_file_path: output path with the new network data
+            export_excel: also write the Excel workbook (e.g. for Gephi)
+            keep_self_loops: keep the flows within a subregion, as self-loops
 
         Returns:
-            A paired node_df and edge_df, Path to the written Excel file
+            A paired node_df and edge_df, Path to the written artifact
         """
     # retrieve nodes and edges (produced in previous step transform2network
-    nodes_df = pd.read_excel(network_data_file_path, sheet_name="nodes")
-    edges_df = pd.read_excel(network_data_file_path, sheet_name="edges")
+    nodes_df = load_table(network_data_file_path, "nodes")
+    edges_df = load_table(network_data_file_path, "edges")
 
     if os.path.exists(country_to_region_dict_file_path):
-        print("🔄 Loading existing GeoNames dictionary...")
-        country_to_region_dict_temp = pd.read_excel(country_to_region_dict_file_path, sheet_name=0)
-        country_to_region_dict = country_to_region_dict_temp.set_index("key")['value'].to_dict()
+        print("🔄 Loading existing country to subregion dictionary...")
+        country_to_region_dict = read_country_to_region(country_to_region_dict_file_path)
     else:
         print("📁 No dictionary found.")
         return None
 
-# TODO this cannot work because in the file we use the ID as the KEY for nodes geolocations and for edges pairing
-# therefore, need to use the m49 json dictionary, create a new nodes_df with those IDs and lat-lon, and then
-    # process the edges
-    # need to go have a look at the edges2matrix file and how I did it there
-    new_nodes_df = nodes_df.copy()
-    new_nodes_df["region"] = nodes_df["country_name"].map(country_to_region_dict)
+    nodes_df, edges_df = contract_network(nodes_df, edges_df, country_to_region_dict, keep_self_loops=keep_self_loops)
+    print(f"🗺️ {len(nodes_df)} subregions, {len(edges_df)} subregion edges ({edges_df['Weight'].sum()} country edges)")
 
-    # print("...Merging nodes strategy : summing variables")
-    # sum the properties such as node category, origin, destination, manufacturing...?
-
-    timestamped_file_path = add_timestamp_to_filename(output_file_path)
-
-    with pd.ExcelWriter(timestamped_file_path, engine="openpyxl") as writer:
-        nodes_df.to_excel(writer, sheet_name="nodes", index=False)  # save nodes on sheet 1 "nodes"
-        edges_df.to_excel(writer, sheet_name="edges", index=False)  # save edges on sheet 2 "edges"
+    # save nodes as table (sheet) 1 "nodes" and edges as table (sheet) 2 "edges" (output_file_path=None: not written)
+    timestamped_file_path = save_artifact(output_file_path, {"nodes": nodes_df, "edges": edges_df},
+                                          export_excel=export_excel) if output_file_path else None
 
     return [nodes_df, edges_df], timestamped_file_path
 
 
-
-
 def match_country_to_region(nodes_df, country_to_region_dict):
     new_nodes_df = nodes_df.copy()
     new_nodes_df["region"] = nodes_df["country_name"].map(country_to_region_dict)
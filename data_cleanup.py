@@ -1,16 +1,9 @@
 import os
+import numpy as np
 import pandas as pd
-from datetime import datetime
 
-def add_timestamp_to_filename(file_path):
-    root, ext = os.path.splitext(file_path)
-    return f"{root}_{datetime.now().strftime("%Y%m%d%H%M%S")}{ext}"
-
-
-def save_df_to_file(file_path, df):
-    timestamped_file_path = add_timestamp_to_filename(file_path)
-    df.to_excel(timestamped_file_path, index=False)
-    return timestamped_file_path
+from artifacts import load_table, save_artifact
+import step_metrics
 
 
 
@@ -18,66 +11,144 @@ def save_df_to_file(file_path, df):
 """  this is a work in progress, the goal is to attemp to clean the falsified medical product category as well as
     giving the ["route stopped at", "discovery location"] columns a ref location (geoNameID)
 """
-def clean_categories(data_file_path, cleanup_dictionary_path, output_file_path):
-    skip_cleanup = False
 
-    if os.path.exists(data_file_path):
-        df = pd.read_excel(data_file_path, sheet_name=0)
+CLEANUP_COLUMNS = ["Medical Products"] # columns whose ";"-separated terms are normalised with the cleanup dictionary
+LOCATION_REFERENCE_COLUMNS = ["route stopped at", "discovery location"] # "loc1".."loc4" references, e.g. "loc2;loc3"
+LOC_COLUMNS = ["loc1", "loc2", "loc3", "loc4"]
+TERM_SEPARATOR = ";"
+
+
+def split_terms(series):
+    """
+    The term stream of a TERM_SEPARATOR-separated column: one stripped term per row,
+    indexed by the position of its cell (empty cells are left out, the terms of a cell stay next to each other)
+    """
+    present = series.reset_index(drop=True).dropna()
+    return present.astype(str).str.split(TERM_SEPARATOR).explode().str.strip()
+
+
+def normalise_terms(series, cleanup_dict):
+    """
+    Normalises the TERM_SEPARATOR-separated terms of each cell with the cleanup dictionary, for all cells at once:
+    the terms are exploded into one long Series, stripped, mapped (on their lower case) through the dictionary
+    and joined back per cell. As before, every term is followed by the separator ("a; Viagra" -> "a;sildenafil;")
+    and empty cells are returned as they are.
+
+    Args:
+        series: column to clean
+        cleanup_dict: dict lower case term -> new term
+
+    Returns: the normalised Series (same index), and a Series of conversion counts indexed by (term, new term)
+    """
+    values = series.reset_index(drop=True)
+    stripped_terms = split_terms(series)
+    new_terms = stripped_terms.str.lower().map(cleanup_dict)
+    is_converted = new_terms.notna()
+
+    # explode() keeps the terms of a cell next to each other: join them back with one reduceat over the run starts
+    cleaned_terms = (new_terms.where(is_converted, stripped_terms).astype(str) + TERM_SEPARATOR).to_numpy(dtype=object)
+    cell_positions = stripped_terms.index.to_numpy()
+    cleaned = values.astype(object)
+    if len(cell_positions):
+        run_starts = np.flatnonzero(np.r_[True, cell_positions[1:] != cell_positions[:-1]])
+        cleaned.iloc[cell_positions[run_starts]] = np.add.reduceat(cleaned_terms, run_starts)
+    conversions = (pd.DataFrame({"term": stripped_terms[is_converted], "new term": new_terms[is_converted]})
+                   .value_counts())
+    return pd.Series(cleaned.to_numpy(), index=series.index, name=series.name), conversions
+
+
+def geo_ids_as_text(series):
+    """
+    geoIDs as text, whether they were read as numbers or strings: 2658434.0 -> "2658434", " world" -> "world", NaN -> None
+    """
+    numeric = pd.to_numeric(series, errors="coerce")
+    text = series.astype(str).str.strip().where(numeric.isna(), np.trunc(numeric).astype("Int64").astype(str))
+    return text.where(series.notna() & text.ne(""), None)
+
+
+def resolve_location_references(df, columns=LOCATION_REFERENCE_COLUMNS):
+    """
+    Replaces the "loc1".."loc4" references of columns with the geoID of that location in the same row,
+    for all cells at once: the references are exploded into one long Series and looked up by (row, loc) position
+    in the matrix of the "locN geoID" columns. Multi-reference cells are supported ("loc2;loc3" -> "123;456"),
+    other terms ("customs") and references to an empty location are kept as they are.
+
+    Args:
+        df: routes data with the "locN geoID" columns, modified in place
+        columns: columns holding ";"-separated references
+
+    Returns: dict column -> number of references resolved
+    """
+    geo_id_matrix = np.column_stack([geo_ids_as_text(df[f"{loc} geoID"]).to_numpy(dtype=object) for loc in LOC_COLUMNS])
+    resolved_counts = {}
+    for col in columns:
+        tokens = split_terms(df[col])
+        loc_numbers = tokens.str.lower().map({loc: i for i, loc in enumerate(LOC_COLUMNS)})
+        is_reference = loc_numbers.notna()
+        geo_ids = pd.Series(None, index=tokens.index, dtype=object)
+        geo_ids[is_reference] = geo_id_matrix[tokens.index[is_reference], loc_numbers[is_reference].astype(int)]
+        is_resolved = geo_ids.notna()
+        resolved_counts[col] = int(is_resolved.sum())
+
+        # join the tokens of each cell back, as in normalise_terms (without the trailing separator)
+        joined_tokens = (tokens.where(~is_resolved, geo_ids) + TERM_SEPARATOR).to_numpy(dtype=object)
+        cell_positions = tokens.index.to_numpy()
+        if len(cell_positions):
+            run_starts = np.flatnonzero(np.r_[True, cell_positions[1:] != cell_positions[:-1]])
+            resolved_cells = pd.Series(np.add.reduceat(joined_tokens, run_starts)).str[:-1]
+            # only the cells with a resolved reference are rewritten, the others keep their exact value
+            has_resolved = np.logical_or.reduceat(is_resolved.to_numpy(), run_starts)
+            if has_resolved.any():
+                values = df[col].astype(object).to_numpy()
+                values[cell_positions[run_starts[has_resolved]]] = resolved_cells.to_numpy()[has_resolved]
+                df[col] = values
+    return resolved_counts
+
+
+def clean_categories(data_file_path, cleanup_dictionary_path, output_file_path, export_excel=False,
+                     columns_to_clean=CLEANUP_COLUMNS, reference_columns=LOCATION_REFERENCE_COLUMNS):
+    """
+    Keeps the included rows and normalises the terms of columns_to_clean with the cleanup dictionary.
+
+    Args:
+        data_file_path: routes data (path or DataFrame)
+        cleanup_dictionary_path: Excel file with the "key" (lower case term) and "value" (new term) columns
+        output_file_path: output artifact path, a timestamp is added to the file name (None: not written)
+        export_excel: also write the output as Excel, for human review
+        columns_to_clean: ";"-separated columns to normalise
+        reference_columns: columns whose "locN" references are replaced with the geoID of that location
+
+    Returns: the cleaned DataFrame, path to the written artifact
+    """
+    if isinstance(data_file_path, pd.DataFrame) or os.path.exists(data_file_path):
+        df = load_table(data_file_path)
     else:
         print("❌ No input file found, aborting method.")
         return None
 
+    # Load only included data
+    clean_df = df[df["include"] > 0].copy()
+
     if os.path.exists(cleanup_dictionary_path):
-        print("🔄 Loading existing GeoNames dictionary...")
+        print("🔄 Loading existing cleanup dictionary...")
         clean_fmp_dict_df = pd.read_excel(cleanup_dictionary_path, sheet_name=0)
         clean_fmp_dict_df_cache = clean_fmp_dict_df.set_index("key")['value'].to_dict()
-    else:
-        print("📁 No dictionary found.")
-        skip_cleanup = True
 
-    # Load only included data
-    clean_df = df[df["include"] > 0]
-
-
-    # columns to clean:
-    # Medical Products
-    def clean_fmp_text(fmp_text):
-
-        # merge various terms (viagra and sildenafil) OR categorise them into a new column
-        if pd.notna(fmp_text) :
-            dirty_words = fmp_text.split(';')
-            new_terms = ''
-            # separate into items
-            for term in dirty_words:
-                # if term needs cleaning, then use the dict for the new value
-                if term.strip().lower() in clean_fmp_dict_df_cache.keys():
-                    new_term = clean_fmp_dict_df_cache.get(term.strip().lower())
-                    new_terms += new_term + ";"
-                    print(f"Term \'{term}\' converted to \'{new_term}\' ")
-                else:
-                    new_terms += term.strip() + ";"
-            return new_terms
-        else:
-            # empty or not a reference to a location column loc1234, so return whatever is already there
-            return fmp_text
-
-    #
-    for row in df.itertuples():
-        for col in ["Medical Products"]:
-            clean_df.at[row.Index, col] = clean_fmp_text(df.at[row.Index, col])
+        # columns to clean, e.g. Medical Products: merge various terms (viagra and sildenafil)
+        for col in columns_to_clean:
+            clean_df[col], conversions = normalise_terms(clean_df[col], clean_fmp_dict_df_cache)
+            step_metrics.count("terms_converted", int(conversions.sum()))
+            print(f"🧹 {col}: {int(conversions.sum())} terms converted in {clean_df[col].notna().sum()} cells")
+            for (term, new_term), count in conversions.items():
+                print(f"    '{term}' -> '{new_term}': {count}")
+    else:
+        print("📁 No cleanup dictionary found, terms are left as they are.")
 
     # match the "route stopped at" and "discovery location" columns to the geonames_ID
-    def match_to_geoID(row, loc_ref_name):
-        if pd.isna(loc_ref_name) and loc_ref_name.strip in ["loc1", "loc2", "loc3", "loc4"]:
-            return df.at[row.Index, loc_ref_name + " geoID"]
-        else:
-            # empty or not a reference to a location column loc1234, so return whatever is already there
-            return loc_ref_name
-
-    #for row in df.itertuples():
-    #    for col in ["route stopped at", "discovery location"]:
-    #        clean_df.at[row.Index, col] = match_to_geoID(row, df.at[row.Index, col])
+    for col, resolved_count in resolve_location_references(clean_df, reference_columns).items():
+        print(f"📍 {col}: {resolved_count} location references replaced with their geoID")
 
-    filepath_to_clean_excel = save_df_to_file(output_file_path, clean_df)
+    # output_file_path=None keeps the result in memory only (the caller persists it)
+    filepath_to_clean_artifact = save_artifact(output_file_path, clean_df, export_excel=export_excel) if output_file_path else None
 
-    return clean_df, filepath_to_clean_excel
\ No newline at end of file
+    return clean_df, filepath_to_clean_artifact
\ No newline at end of file
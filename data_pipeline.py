@@ -8,14 +8,19 @@ This script orchestrates the data processing pipeline for geographic network ana
 4. Transforms processed data into network format for visualization
 
 The pipeline uses intermediary files between steps for data persistence, validation and manual avoiding repeating steps.
+In in-memory mode the steps are chained through DataFrames and the intermediary files are written in the background.
+Each step declares its input and output files: a step whose inputs and code have not changed since its last
+successful run is skipped (see pipeline_scheduler.py), so only the steps affected by an edit are rerun.
+The modules of a step (matplotlib, wordcloud and plotly for the exploratory analysis, requests for GeoNames...)
+are only imported when the step runs, and the GeoNames API check only runs before a step that needs the network.
 """
 
-import shutil
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-from data2network import transform2network, remove_self_loops, group_countries_into_region
-from data_cleanup import clean_categories
-from exploratory_analysis import *
-from geo2features import *
+from artifacts import artifact_file_name, copy_artifact, save_artifact
+from pipeline_scheduler import run_pipeline
+import step_metrics
 
 # Paths and filenames
 ## dictionaries and aux files
@@ -23,13 +28,21 @@ DICT_GEOID_FILENAME = "aux_geonames_ID_dictionary.xlsx"
 DICT_CLEANUP_FILENAME = "aux_cleanup_dictionary.xlsx"
 DICT_COUNTRY_TO_SUBREGION_FILENAME = "aux_country-to-region_sorted_clockwise_UNm49.xlsx" # matches each country to a subregion according to the UN m49 scheme
 ## output files
+## (intermediates are Parquet artifacts, see artifacts.py; the curated 1.1 input and the 1.4 report stay in Excel)
 DATA_GEONAMES_FILENAME = "1.1_ENGdata_geoID.xlsx" # IMPORTANT! file 1.1 has a lot of manual cleaning, do not use 1.0
-DATA_CLEANED = "1.2_ENGdata_cleanedCategories.xlsx"
-INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME = "1.3_ENGdata_geonamesExtracted.xlsx"
+DATA_CLEANED = artifact_file_name("1.2_ENGdata_cleanedCategories.xlsx")
+INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME = artifact_file_name("1.3_ENGdata_geonamesExtracted.xlsx")
 EXPLORATORY_ANALYSIS_FILENAME = "1.4_exploratory_analysis.xlsx"
-NETWORK_DATA_FILENAME = "1.5_nodes_edges.xlsx"
-NETWORK_DATA_NOLOOPS_FILENAME = "1.6_nodes_edges_noloops.xlsx"
-NETWORK_DATA_SUBREGIONS_FILENAME = "1.7_nodes_subregions_edges.xlsx"
+NETWORK_DATA_FILENAME = artifact_file_name("1.5_nodes_edges.xlsx")
+NETWORK_DATA_NOLOOPS_FILENAME = artifact_file_name("1.6_nodes_edges_noloops.xlsx")
+NETWORK_DATA_SUBREGIONS_FILENAME = artifact_file_name("1.7_nodes_subregions_edges.xlsx")
+EXPORT_EXCEL_INTERMEDIATES = False # also export 1.2, 1.3 and 1.5 as Excel for review
+GEPHI_EXPORT_FORMATS = [".gexf"] # formats 1.6 and 1.7 are exported to for Gephi: ".gexf", ".graphml" and/or ".xlsx"
+GEPHI_EDGE_DURATION = "0D" # 1.6 gets Gephi's dynamic "Interval" columns, edges lasting that long after their incident date (None: static)
+NETWORK_BUILD_FILENAME = "aux_network_build.pkl" # stops and edges of each route of the last 1.5 build, only new/changed routes are rebuilt
+PIPELINE_STATE_FILENAME = "aux_pipeline_state.json" # input and code hashes of the last successful run of each step
+PROFILES_DIRNAME = "aux_profiles" # cProfile dumps of the steps, when profiling is on
+GEONAMES_ON_QUOTA = "wait" # when the API limit is met: "wait" for the next quota window, "exit" (resume on the next run) or "partial"
 ## DIRs
 #ANALYSIS_DIR = "C:/Users/aolliaro/OneDrive - Nexus365/DPhil data and analysis/phd_analysis_data/"
 ANALYSIS_DIR = "C:/Users/alber/OneDrive - Nexus365/DPhil data and analysis/phd_analysis_data/"
@@ -47,94 +60,206 @@ def pre_testing():
     Tests the GeoNames API query functionality before running the main pipeline
     to ensure proper API access and response handling.
     """
+    from geo2features import test_query_geonames_api
     test_query_geonames_api()
 
- 
+
+# In-memory mode: the steps hand their outputs to the next ones directly (each file is parsed at most once per run)
+# and the artifacts are written by a background thread while the next steps run.
+ARTIFACT_WRITER = ThreadPoolExecutor(max_workers=1)
+PENDING_WRITES = []
+
+
+def step_input(file_name, memory):
+    """
+    The in-memory output of an earlier step of this run, if any, otherwise the path of the file in ANALYSIS_DIR
+    """
+    if memory is not None and file_name in memory:
+        return memory[file_name]
+    return os.path.join(ANALYSIS_DIR, file_name)
+
+
+def persist_output(data, file_name, memory, export_excel=False, network_formats=()):
+    """
+    Writes a step output to a timestamped artifact and copies it to its reusable file_name.
+    In in-memory mode, the data is also handed over to the next steps and the write happens in the background.
+    network_formats: for a network output, the formats it is also exported to (see network_export.NETWORK_WRITERS)
+    """
+    def write():
+        latest_file_path = save_artifact(os.path.join(ANALYSIS_DIR, file_name), data, export_excel=export_excel)
+        if network_formats:
+            from network_export import export_network
+            export_network(data, latest_file_path, network_formats)
+        copy_artifact(latest_file_path, os.path.join(ANALYSIS_DIR, file_name))
+
+    tables = data.values() if isinstance(data, dict) else [data]
+    step_metrics.count("rows_out", sum(len(df) for df in tables))
+    if memory is None:
+        write()
+        return
+    memory[file_name] = data
+    PENDING_WRITES.append(ARTIFACT_WRITER.submit(write))
+
+
+def flush_pending_writes():
+    """
+    Blocks until all background writes are done, re-raising their errors
+    """
+    while PENDING_WRITES:
+        PENDING_WRITES.pop(0).result()
+
+
+# Step 1.1 to 1.2: from data and to cleaned categories, text, etc =================================================
+def step1to2(memory=None):
+    """
+    TODO: node role and node type need cleaning into file v1.2 (match the locX mentioned to a node)
+    """
+    from data_cleanup import clean_categories
+    print("Step 1.1 to 1.2: from data and to cleaner categories...")
+    df, _ = clean_categories(
+        step_input(DATA_GEONAMES_FILENAME, memory),
+        os.path.join(ANALYSIS_DIR, DICT_CLEANUP_FILENAME),
+        None
+    )
+    persist_output(df, DATA_CLEANED, memory, export_excel=EXPORT_EXCEL_INTERMEDIATES)
+
+
+# Step 1.2 to 1.3: from data and geoID to geographical features ===================================================
+def step2to3(memory=None):
+    from geo2features import process_all_locations
+    print("Step 1.2 to 1.3: from data and geoID to geographical features...")
+    df, _, unresolved_geo_ids = process_all_locations(
+        step_input(DATA_CLEANED, memory),
+        os.path.join(ANALYSIS_DIR, DICT_GEOID_FILENAME),
+        None,
+        on_quota=GEONAMES_ON_QUOTA,
+        return_unresolved=True
+    )
+    if df is None:
+        print("⏸️ Step 1.2 to 1.3 paused on the API limit, run the pipeline again to resume it.")
+        return False
+    country_columns = [col for col in df.columns if col.endswith(" geoname_country_geoId")]
+    if unresolved_geo_ids and not df[country_columns].notna().any(axis=None):
+        raise RuntimeError(f"None of the geoIDs could be resolved ({len(unresolved_geo_ids)} failed), "
+                           f"check the GeoNames username and API access.")
+    if unresolved_geo_ids:
+        # 1.3 is written (right away: an incomplete step's output is not handed over in memory, the next steps read
+        # the file), but the step is not recorded as up to date, so that the next run retries these geoIDs
+        persist_output(df, INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME, None, export_excel=EXPORT_EXCEL_INTERMEDIATES)
+        print(f"⚠️ Step 1.2 to 1.3 incomplete, {len(unresolved_geo_ids)} geoIDs unresolved "
+              f"(e.g. {unresolved_geo_ids[:5]}), run the pipeline again to retry them.")
+        return False
+    persist_output(df, INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME, memory, export_excel=EXPORT_EXCEL_INTERMEDIATES)
+
+
+# Step 1.3 to 1.4: Exploratory analysis, diagrams and stats ======================================================
+def step3to4(memory=None):
+    from exploratory_analysis import run_exploratory_analysis
+    print("Step 1.3 to 1.4: Exploratory analysis, diagrams and stats...")
+    explo_analysis_results, latest_1_4_file_path  = run_exploratory_analysis(
+        step_input(INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME, memory),
+        ANALYSIS_DIR,
+        step_input(DATA_CLEANED, memory),
+        os.path.join(ANALYSIS_DIR, EXPLORATORY_ANALYSIS_FILENAME)
+    )
+    copy_artifact(latest_1_4_file_path, os.path.join(ANALYSIS_DIR, EXPLORATORY_ANALYSIS_FILENAME))
+
+
+# Step 1.3 to 1.5: transform data to edges pairs ==================================================================
+def step3to5(memory=None):
+    from data2network import transform2network
+    print("Step 1.3 to 1.5: transform data to edges pairs...")
+    (nodes_df, edges_df), _ = transform2network(
+        step_input(INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME, memory),
+        ANALYSIS_DIR,
+        None,
+        build_file_path=os.path.join(ANALYSIS_DIR, NETWORK_BUILD_FILENAME))
+    persist_output({"nodes": nodes_df, "edges": edges_df}, NETWORK_DATA_FILENAME, memory,
+                   export_excel=EXPORT_EXCEL_INTERMEDIATES)
+
+
+def step5to6(memory=None):
+    from data2network import remove_self_loops
+    print("Step 1.5 to 1.6: remove same-country loop edges...")
+    (nodes_df, edges_df), _ = remove_self_loops(
+        step_input(NETWORK_DATA_FILENAME, memory),
+        ANALYSIS_DIR,
+        None,
+        gephi_edge_duration=GEPHI_EDGE_DURATION)
+    persist_output({"nodes": nodes_df, "edges": edges_df}, NETWORK_DATA_NOLOOPS_FILENAME, memory,
+                   network_formats=GEPHI_EXPORT_FORMATS)
+
+
+def step5to7(memory=None):
+    from data2network import group_countries_into_region
+    print("Step 1.5 to 1.7: merging countries into subregions...")
+    (nodes_df, edges_df), _ = group_countries_into_region(
+        step_input(NETWORK_DATA_FILENAME, memory),
+        os.path.join(ANALYSIS_DIR, DICT_COUNTRY_TO_SUBREGION_FILENAME),
+        None)
+    persist_output({"nodes": nodes_df, "edges": edges_df}, NETWORK_DATA_SUBREGIONS_FILENAME, memory,
+                   network_formats=GEPHI_EXPORT_FORMATS)
+
+
+# sequence of the pipeline: each step with the files it reads and writes (relative to ANALYSIS_DIR),
+# the modules holding its code, including the ones they import (artifacts for all steps), and the settings it reads:
+# a change to any of them reruns the step
+# (the GeoNames dictionary is a cache of step 2, not one of its inputs);
+# "preflight" checks run once, before the first step declaring them actually runs
+NETWORK_MODULES = ["data2network", "data_cleanup", "edge_timeline", "artifacts"]
+steps = {
+    1: {"name": "step1to2", "func": step1to2,
+        "inputs": [DATA_GEONAMES_FILENAME, DICT_CLEANUP_FILENAME],
+        "outputs": [DATA_CLEANED],
+        "modules": ["data_cleanup", "artifacts"],
+        "settings": {"EXPORT_EXCEL_INTERMEDIATES": EXPORT_EXCEL_INTERMEDIATES}},
+    2: {"name": "step2to3", "func": step2to3,
+        "inputs": [DATA_CLEANED],
+        "outputs": [INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME],
+        "modules": ["geo2features", "geonames_cache", "geonames_client", "geonames_offline", "artifacts"],
+        "settings": {"EXPORT_EXCEL_INTERMEDIATES": EXPORT_EXCEL_INTERMEDIATES, "GEONAMES_ON_QUOTA": GEONAMES_ON_QUOTA},
+        "preflight": [pre_testing]},
+    3: {"name": "step3to4", "func": step3to4,
+        "inputs": [INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME, DATA_CLEANED],
+        "outputs": [EXPLORATORY_ANALYSIS_FILENAME],
+        "modules": ["exploratory_analysis", "mywordcloud", "sankeydiagram", "artifacts"]},
+    4: {"name": "step3to5", "func": step3to5,
+        "inputs": [INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME],
+        "outputs": [NETWORK_DATA_FILENAME],
+        "modules": NETWORK_MODULES,
+        "settings": {"EXPORT_EXCEL_INTERMEDIATES": EXPORT_EXCEL_INTERMEDIATES}},
+    5: {"name": "step5to6", "func": step5to6,
+        "inputs": [NETWORK_DATA_FILENAME],
+        "outputs": [NETWORK_DATA_NOLOOPS_FILENAME],
+        "modules": NETWORK_MODULES + ["network_export"],
+        "settings": {"GEPHI_EDGE_DURATION": GEPHI_EDGE_DURATION, "GEPHI_EXPORT_FORMATS": GEPHI_EXPORT_FORMATS}},
+    6: {"name": "step5to7", "func": step5to7,
+        "inputs": [NETWORK_DATA_FILENAME, DICT_COUNTRY_TO_SUBREGION_FILENAME],
+        "outputs": [NETWORK_DATA_SUBREGIONS_FILENAME],
+        "modules": NETWORK_MODULES + ["network_export"],
+        "settings": {"GEPHI_EXPORT_FORMATS": GEPHI_EXPORT_FORMATS}},
+}
+
 
 if __name__ == "__main__":
 
-    pre_testing()
-
-
-
-    start_from_step = 4
-    end_step = 4
-
-    # Step 1.1 to 1.2: from data and to cleaned categories, text, etc =================================================
-    def step1to2():
-        """
-        TODO: node role and node type need cleaning into file v1.2 (match the locX mentioned to a node)
-        """
-        print("Step 1.1 to 1.2: from data and to cleaner categories...")
-        df, latest_1_2_file_path = clean_categories(
-            os.path.join(ANALYSIS_DIR, DATA_GEONAMES_FILENAME),
-            os.path.join(ANALYSIS_DIR, DICT_CLEANUP_FILENAME),
-            os.path.join(ANALYSIS_DIR, DATA_CLEANED)
-        )
-        # copy the latest file to a reusable file_name
-        shutil.copy(latest_1_2_file_path, os.path.join(ANALYSIS_DIR, DATA_CLEANED))
-
-    # Step 1.2 to 1.3: from data and geoID to geographical features ===================================================
-    def step2to3():
-        print("Step 1.2 to 1.3: from data and geoID to geographical features...")
-        df, latest_1_3_file_path = process_all_locations(
-            os.path.join(ANALYSIS_DIR, DATA_CLEANED),
-            os.path.join(ANALYSIS_DIR, DICT_GEOID_FILENAME),
-            os.path.join(ANALYSIS_DIR, INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME)
-        )
-        # copy the latest file to a reusable file_name
-        shutil.copy(latest_1_3_file_path, os.path.join(ANALYSIS_DIR, INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME))
-
-    # Step 1.3 to 1.4: Exploratory analysis, diagrams and stats ======================================================
-    def step3to4():
-        print("Step 1.3 to 1.4: Exploratory analysis, diagrams and stats...")
-        explo_analysis_results, latest_1_4_file_path  = run_exploratory_analysis(
-            os.path.join(ANALYSIS_DIR, INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME),
-            ANALYSIS_DIR,
-            os.path.join(ANALYSIS_DIR, DATA_CLEANED),
-            os.path.join(ANALYSIS_DIR, EXPLORATORY_ANALYSIS_FILENAME)
-        )
-        shutil.copy(latest_1_4_file_path, os.path.join(ANALYSIS_DIR, EXPLORATORY_ANALYSIS_FILENAME))
-
-    # Step 1.3 to 1.5: transform data to edges pairs ==================================================================
-    def step3to5():
-        print("Step 1.3 to 1.5: transform data to edges pairs...")
-        network_data, network_nodes_edges_file_path = transform2network(
-            os.path.join(ANALYSIS_DIR, INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME),
-            ANALYSIS_DIR,
-            os.path.join(ANALYSIS_DIR, NETWORK_DATA_FILENAME))
-        shutil.copy(network_nodes_edges_file_path, os.path.join(ANALYSIS_DIR, NETWORK_DATA_FILENAME))
-
-
-    def step5to6():
-        print("Step 1.5 to 1.6: remove same-country loop edges...")
-        network_data, network_nodes_edges_file_path = remove_self_loops(
-            os.path.join(ANALYSIS_DIR, NETWORK_DATA_FILENAME),
-            ANALYSIS_DIR,
-            os.path.join(ANALYSIS_DIR, NETWORK_DATA_NOLOOPS_FILENAME))
-        shutil.copy(network_nodes_edges_file_path, os.path.join(ANALYSIS_DIR, NETWORK_DATA_FILENAME))
-
-
-
-    def step5to7():
-        print("Step 1.5 to 1.7: merging countries into subregions...")
-        network_data, network_nodes_edges_file_path = group_countries_into_region(
-            os.path.join(ANALYSIS_DIR, NETWORK_DATA_FILENAME),
-            ANALYSIS_DIR,
-            os.path.join(ANALYSIS_DIR, NETWORK_DATA_NOLOOPS_FILENAME))
-        shutil.copy(network_nodes_edges_file_path, os.path.join(ANALYSIS_DIR, NETWORK_DATA_FILENAME))
-
-
-    # sequence of the pipeline
-    steps = {
-        1: step1to2,
-        2: step2to3,
-        3: step3to4,
-        4: step3to5,
-        5: step5to6,
-        6: step5to7,
-    }
-
-    for step in range(start_from_step, end_step+1):
-        steps[step]()
+    # steps allowed to run; up-to-date steps are skipped unless force_rerun is set
+    start_from_step = 1
+    end_step = 6
+    force_rerun = False
+    in_memory = True # chain the steps in memory, writing the artifacts in the background
+    max_workers = 2 # independent steps (e.g. step3to4 and step3to5) run concurrently in that many processes
+    profile_steps = False # dump a cProfile of each step (aux_profiles/<step>_<timestamp>.prof)
 
+    run_pipeline(
+        steps,
+        ANALYSIS_DIR,
+        os.path.join(ANALYSIS_DIR, PIPELINE_STATE_FILENAME),
+        selected_steps=range(start_from_step, end_step + 1),
+        force=force_rerun,
+        in_memory=in_memory,
+        flush=flush_pending_writes,
+        max_workers=max_workers,
+        manifest_dir=ANALYSIS_DIR, # run_manifest_<timestamp>.json: time, memory, rows, bytes and API calls per step
+        profile_dir=os.path.join(ANALYSIS_DIR, PROFILES_DIRNAME) if profile_steps else None
+    )
@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from artifacts import artifact_file_name, read_artifact
+
+
+# Time-indexed view of the edges table (construct_edges), for the analyses by period (year by year, sliding windows).
+# The edges are sorted once by incident date: the edges of any time window are then a contiguous slice,
+# found by binary search, and a series of windows is answered in one sweep over the sorted dates.
+# Also writes the Gephi dynamic time intervals, see https://gephi.org/users/supported-graph-formats/spreadsheet/
+
+DATE_COLUMN = "incident date"
+GEPHI_INTERVAL_COLUMN = "Interval"
+GEPHI_DATE_FORMAT = "%Y-%m-%d"
+
+
+class EdgeTimeline:
+    """
+    Edges sorted by date. Windows are half-open: [start, end). Edges without a (valid) date are kept apart
+    in undated_edges and are in no window.
+    """
+
+    def __init__(self, edges_df, date_column=DATE_COLUMN):
+        dates = pd.to_datetime(edges_df[date_column], errors="coerce").to_numpy(dtype="datetime64[ns]")
+        order = np.argsort(dates, kind="stable")  # NaT sorts last
+        dated_count = int((~np.isnat(dates)).sum())
+        self.dates = dates[order[:dated_count]]
+        self.edges = edges_df.iloc[order[:dated_count]]
+        self.undated_edges = edges_df.iloc[order[dated_count:]]
+
+    def __len__(self):
+        return len(self.edges)
+
+    def positions(self, dates):
+        return np.searchsorted(self.dates, pd.DatetimeIndex(dates).to_numpy(dtype="datetime64[ns]"), side="left")
+
+    def between(self, start, end):
+        """
+        Edges dated in [start, end), in date order
+        """
+        start_position, end_position = np.searchsorted(
+            self.dates, [pd.Timestamp(start).to_datetime64(), pd.Timestamp(end).to_datetime64()], side="left")
+        return self.edges.iloc[start_position:max(start_position, end_position)]
+
+    def window_bounds(self, window, step=None, start=None, end=None):
+        """
+        Args:
+            window: window length, a pandas offset ("365D", "12MS", "YS" for calendar years...)
+            step: shift between the starts of consecutive windows, default: the window length (no overlap)
+            start, end: first window start, and date the windows start before; default: the first edge date
+                (rolled back to the step's anchor, e.g. January 1st for "YS") and the last edge date
+
+        Returns: DataFrame with the start and end of each window
+        """
+        step = pd.tseries.frequencies.to_offset(step or window)
+        if start is None:
+            if not len(self):
+                return pd.DataFrame({"start": pd.DatetimeIndex([]), "end": pd.DatetimeIndex([])})
+            start = step.rollback(pd.Timestamp(self.dates[0]))
+        end = pd.Timestamp(end if end is not None else self.dates[-1]) + pd.Timedelta(1, "ns")
+        starts = pd.date_range(pd.Timestamp(start), end, freq=step, inclusive="left")
+        return pd.DataFrame({"start": starts, "end": starts + pd.tseries.frequencies.to_offset(window)})
+
+    def windows(self, window, step=None, start=None, end=None):
+        """
+        Edges of each window (see window_bounds), all bounds looked up at once
+
+        Yields: (window start, window end, edges DataFrame)
+        """
+        bounds = self.window_bounds(window, step, start, end)
+        start_positions = self.positions(bounds["start"])
+        end_positions = self.positions(bounds["end"])
+        for window_start, window_end, start_position, end_position in zip(
+                bounds["start"], bounds["end"], start_positions, end_positions):
+            yield window_start, window_end, self.edges.iloc[start_position:max(start_position, end_position)]
+
+    def by_year(self):
+        """
+        Edges of each calendar year, from the year of the first edge to the year of the last one
+        """
+        return self.windows("YS")
+
+    def corridor_counts(self, window, step=None, start=None, end=None):
+        """
+        Number of edges per (Source, Target) corridor in each window: one row per window, one column per corridor
+        (that has edges in at least one window)
+        """
+        bounds = self.window_bounds(window, step, start, end)
+        corridor_edges = self.edges[["Source", "Target"]]
+        corridor_codes = corridor_edges.groupby(["Source", "Target"], sort=False, dropna=False).ngroup().to_numpy()
+        corridors = pd.MultiIndex.from_frame(corridor_edges.drop_duplicates())  # in ngroup(sort=False) order
+        start_positions = self.positions(bounds["start"])
+        end_positions = self.positions(bounds["end"])
+        counts = np.zeros((len(bounds), len(corridors)), dtype=np.int64)
+        for i, (start_position, end_position) in enumerate(zip(start_positions, end_positions)):
+            counts[i] = np.bincount(corridor_codes[start_position:end_position], minlength=len(corridors))
+        windows = pd.IntervalIndex.from_arrays(bounds["start"], bounds["end"], closed="left")
+        counts_df = pd.DataFrame(counts, index=windows, columns=corridors)
+        return counts_df.loc[:, counts_df.sum(axis=0) > 0]
+
+
+def gephi_dates(dates):
+    """
+    Dates as Gephi text ("2019-02-01"), None where missing; each distinct date is only formatted once
+    """
+    codes, unique_dates = pd.factorize(pd.to_datetime(dates, errors="coerce"))
+    date_texts = np.append(pd.DatetimeIndex(unique_dates).strftime(GEPHI_DATE_FORMAT).to_numpy(object), None)
+    return pd.Series(date_texts[codes], index=getattr(dates, "index", None))  # code -1 (NaT) picks the trailing None
+
+
+def gephi_intervals(start_dates, end_dates):
+    """
+    Gephi time interval cells "<[2019-02-01, 2019-03-01]>", "" where the start date is missing (always present)
+    """
+    start_texts, end_texts = gephi_dates(start_dates), gephi_dates(end_dates)
+    intervals = "<[" + start_texts + ", " + end_texts.fillna(start_texts) + "]>"
+    return intervals.where(start_texts.notna(), "")
+
+
+def add_gephi_intervals(nodes_df, edges_df, date_column=DATE_COLUMN, edge_duration="0D"):
+    """
+    Adds the Gephi dynamic "Interval" column to both tables (copies), so that Gephi's timeline can filter the network.
+    An edge is present from its incident date for edge_duration, a node from its first to its last edge.
+
+    Args:
+        nodes_df, edges_df: network tables (construct_nodes, construct_edges)
+        date_column: edge date column
+        edge_duration: how long an edge stays in the network after its incident date (a pandas Timedelta string)
+
+    Returns: nodes_df, edges_df
+    """
+    edge_start = pd.to_datetime(edges_df[date_column], errors="coerce")
+    edge_end = edge_start + pd.Timedelta(edge_duration)
+    edges_df = edges_df.assign(**{GEPHI_INTERVAL_COLUMN: gephi_intervals(edge_start, edge_end)})
+
+    endpoint_dates = pd.DataFrame({
+        "ID": np.concatenate([edges_df["Source"].to_numpy(object), edges_df["Target"].to_numpy(object)]),
+        "start": np.concatenate([edge_start.to_numpy(), edge_start.to_numpy()]),
+        "end": np.concatenate([edge_end.to_numpy(), edge_end.to_numpy()]),
+    }).groupby("ID").agg(start=("start", "min"), end=("end", "max"))
+    node_dates = endpoint_dates.reindex(nodes_df["ID"])
+    node_intervals = gephi_intervals(node_dates["start"], node_dates["end"])
+    nodes_df = nodes_df.assign(**{GEPHI_INTERVAL_COLUMN: node_intervals.to_numpy()})
+    return nodes_df, edges_df
+
+
+if __name__ == "__main__":
+    # working directory
+    wdir = 'C:/Users/aolliaro/OneDrive - Nexus365/DPhil data and analysis/phd_analysis_data'
+    network_file_path = os.path.join(wdir, artifact_file_name("1.6_nodes_edges_noloops.xlsx"))
+
+    timeline = EdgeTimeline(read_artifact(network_file_path, "edges"))
+    print(f"{len(timeline)} dated edges, {len(timeline.undated_edges)} without a date")
+    for year_start, _, year_edges in timeline.by_year():
+        corridor_count = len(year_edges[["Source", "Target"]].drop_duplicates())
+        print(f"{year_start.year}: {len(year_edges)} edges, {corridor_count} corridors")
+
+    # 2-year windows sliding by 6 months
+    corridor_counts = timeline.corridor_counts("24MS", step="6MS")
+    corridor_counts.to_excel(os.path.join(wdir, "corridor_counts_24M_windows.xlsx"))
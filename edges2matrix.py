@@ -1,6 +1,20 @@
+import csv
+import io
 import os
+from functools import lru_cache
+
 import pandas as pd
 import numpy as np
+from openpyxl import Workbook
+
+from artifacts import artifact_file_name, read_artifact
+from data2network import encode_network
+from data_cleanup import split_terms
+
+try:
+    import scipy.sparse as sparse
+except ImportError:  # without scipy, the matrices can only be built dense
+    sparse = None
 
 BASE_COUNTRY_ORDER = ["Ireland", "United Kingdom", "Portugal", "Spain", "France", "Belgium", "The Netherlands",
                       "Switzerland", "Italy", "Malta", "Germany", "Denmark", "Poland", "Lithuania", "Serbia",
@@ -12,6 +26,10 @@ BASE_COUNTRY_ORDER = ["Ireland", "United Kingdom", "Portugal", "Spain", "France"
                       "South Africa", "Namibia", "Gabon", "Cameroon", "Nigeria", "Niger", "Ghana", "Ivory Coast",
                       "Liberia", "Guinea", "The Gambia", "Senegal", "Trinidad and Tobago", "Colombia", "Puerto Rico",
                       "Honduras", "Mexico", "United States", "Canada"]
+DATE_COLUMN = "incident date"
+TERM_COLUMNS = ["Medical Products"] # ";"-separated columns, grouped by term: an edge is in the group of each of its terms
+MATRIX_EXPORT_CHUNK_ROWS = 1000 # matrix rows formatted and written at a time
+MATRIX_EXPORT_FORMATS = [".csv", ".xlsx", ".txt", ".npz"] # .txt: Circos tableviewer table, .npz: numpy (with labels)
 
 
 def read_edges_from_csv(file_path):
@@ -24,106 +42,346 @@ def read_edges_from_csv(file_path):
 
 
 def read_edges_from_excel(file_path):
-    # Read the edges from the Excel file
+    # Read the edges from the network artifact (or its Excel export)
     cols = ['Source', 'Target']
-    edges = pd.read_excel(file_path, sheet_name='edges')
+    edges = read_artifact(file_path, 'edges')
     edges = edges[cols]
     print("Edges list from Excel:")
     print(edges)
-    nodes_names = pd.read_excel(file_path, sheet_name='nodes', index_col='ID')
+    nodes_names = read_artifact(file_path, 'nodes').set_index('ID')
     nodes_names = nodes_names['country_name']
     print("nodes_names list from Excel:")
     print(nodes_names)
     return edges, nodes_names
 
 
-def create_adjacency_matrix(edges, nodes_geoid_to_name, countries_clockwise, norm=False):
-    nodes_geoid_to_name = nodes_geoid_to_name.to_dict()
+def read_network(file_path):
+    # Read the nodes and edges of the network artifact (or its Excel export) in the compact, integer-coded form
+    return encode_network(read_artifact(file_path, 'nodes'), read_artifact(file_path, 'edges'))
+
+
+def network_axis_positions(network, countries_clockwise):
+    """
+    Position of every node (by code) on the matrix axes, -1 for countries not in countries_clockwise.
+    The country names are looked up once per node instead of once per edge.
+    """
+    country_position = pd.Index(countries_clockwise).get_indexer(network["nodes"]["country_name"])
+    return country_position.astype(np.int32)
+
+
+def accumulate_adjacency(src_m_idx, dest_m_idx, size, dense=True, group_codes=None, group_count=None):
+    """
+    Weighted and binary adjacency matrices from the axis positions of the edges' ends, in one pass:
+    the edges are summed once per (row, column) cell, and the binary matrix is read off the same cells.
+
+    Args:
+        src_m_idx, dest_m_idx: row and column of every edge (integer arrays)
+        size: number of rows and columns
+        dense: numpy arrays, else scipy.sparse CSR matrices (memory proportional to the non-empty cells)
+        group_codes: group (0..group_count-1) of every edge, to build one matrix per group instead of one in total
+        group_count: number of groups
+
+    Returns: (weighted, binary) matrices of ints: (size x size), or with group_codes,
+        (group_count x size x size) numpy arrays if dense, else lists of group_count sparse matrices
+    """
+    src_m_idx = np.asarray(src_m_idx, dtype=np.int64)
+    if group_codes is not None:
+        # groups stacked vertically: row g * size + i of the (group_count * size x size) matrix is row i of group g
+        src_m_idx = np.asarray(group_codes, dtype=np.int64) * size + src_m_idx
+    row_count = size if group_codes is None else group_count * size
+
+    if not dense:
+        if sparse is None:
+            raise ImportError("scipy is needed for sparse adjacency matrices, install it or use dense=True")
+        weighted = sparse.coo_matrix((np.ones(len(src_m_idx), dtype=np.int64), (src_m_idx, dest_m_idx)),
+                                     shape=(row_count, size)).tocsr()  # duplicates summed
+        binary = weighted.copy()
+        binary.data[:] = 1
+        if group_codes is None:
+            return weighted, binary
+        return tuple([stacked[g * size:(g + 1) * size] for g in range(group_count)] for stacked in (weighted, binary))
+
+    cell_counts = np.bincount(src_m_idx * size + dest_m_idx, minlength=row_count * size)
+    weighted = cell_counts.reshape(-1, size, size) if group_codes is not None else cell_counts.reshape(size, size)
+    weighted = weighted.astype(int)
+    return weighted, (weighted > 0).astype(int)
+
+
+def edge_groups(network, by):
+    """
+    Group of every edge of an encoded network, for the per-group matrices.
+
+    Args:
+        network: dict from encode_network() or read_network()
+        by: "year" (of the incident date), a term column (TERM_COLUMNS, one group per term) or any other edge column
+            (e.g. "medicine quality")
+
+    Returns: (edge positions, group codes, group keys): an edge can appear once per term, or not at all when it has
+        no key (missing date or value); keys are sorted
+    """
+    edges = network["edges"]
+    if by == "year":
+        keys = pd.to_datetime(edges[DATE_COLUMN], errors="coerce").dt.year.dropna().astype(int)
+    elif by in TERM_COLUMNS:
+        keys = split_terms(edges[by])
+        keys = keys[keys.ne("")]
+        keys = keys[~pd.MultiIndex.from_arrays([keys.index, keys]).duplicated()]  # a term counts once per edge
+    else:
+        keys = edges[by].astype(object)
+    keys = keys.dropna()
+    group_codes, group_keys = pd.factorize(keys, sort=True)
+    return keys.index.to_numpy(), group_codes, group_keys
+
+
+def adjacency_tensor_from_network(network, countries_clockwise, by, dense=True):
+    """
+    One weighted and one binary adjacency matrix per group of edges (see edge_groups), e.g. per year or per product,
+    all built in a single pass over the edges.
 
-    # Initialize an empty adjacency matrix
+    Args:
+        network: dict from encode_network() or read_network()
+        countries_clockwise: country names on the matrix axes
+        by: "year", a term column such as "Medical Products", or an edge column such as "medicine quality"
+        dense: see accumulate_adjacency
+
+    Returns: (group keys, weighted, binary): (K x N x N) numpy arrays if dense, else lists of K sparse matrices,
+        slice k being the matrix of the edges of group keys[k]
+    """
+    edge_positions, group_codes, group_keys = edge_groups(network, by)
+    grouped_network = dict(network, source=network["source"][edge_positions], target=network["target"][edge_positions])
+    weighted, binary = adjacency_matrices_from_network(grouped_network, countries_clockwise, dense=dense,
+                                                       group_codes=group_codes, group_count=len(group_keys))
+    return group_keys, weighted, binary
+
+
+def adjacency_matrices_from_network(network, countries_clockwise, dense=True, group_codes=None, group_count=None):
+    """
+    Weighted and binary (normalised) adjacency matrices of an encoded network (see data2network.encode_network),
+    rows and columns in the order of countries_clockwise, from a single pass over the edges.
+
+    Args:
+        network: dict from encode_network() or read_network()
+        countries_clockwise: country names on the matrix axes
+        dense, group_codes, group_count: see accumulate_adjacency
+
+    Returns: (weighted, binary) (N x N) matrices, N = len(countries_clockwise)
+    """
+    position = network_axis_positions(network, countries_clockwise)
+    src_m_idx = position[network["source"]]
+    dest_m_idx = position[network["target"]]
+    not_placed = (src_m_idx == -1) | (dest_m_idx == -1)
+    if not_placed.any():
+        codes = np.unique(np.concatenate([network["source"][src_m_idx == -1], network["target"][dest_m_idx == -1]]))
+        raise ValueError(f"Countries not in countries_clockwise: {network['nodes']['country_name'].iloc[codes].tolist()}")
+    return accumulate_adjacency(src_m_idx, dest_m_idx, len(countries_clockwise), dense=dense,
+                                group_codes=group_codes, group_count=group_count)
+
+
+def adjacency_matrix_from_network(network, countries_clockwise, norm=False):
+    """
+    Adjacency matrix of an encoded network (see adjacency_matrices_from_network).
+
+    Args:
+        network: dict from encode_network() or read_network()
+        countries_clockwise: country names on the matrix axes
+        norm: 1 for any number of edges between two countries (non-weighted), else the number of edges
+
+    Returns: (N x N) numpy array, N = len(countries_clockwise)
+    """
+    weighted, binary = adjacency_matrices_from_network(network, countries_clockwise)
+    return binary if norm else weighted
+
+
+def create_adjacency_matrix(edges, nodes_geoid_to_name, countries_clockwise, norm=False):
+    # the node names and their axis positions are looked up once, as a whole column, instead of once per edge
+    position = pd.Index(countries_clockwise).get_indexer(
+        pd.concat([edges['Source'], edges['Target']]).map(nodes_geoid_to_name))
+    if (position == -1).any():
+        raise ValueError("Edge countries not in countries_clockwise")
     size = len(nodes_geoid_to_name)
-    adjacency_matrix = np.zeros((size, size), dtype=int)
-
-    # Populate the adjacency matrix with edges
-    for df_row_idx, edge in edges.iterrows():
-        src_m_idx = countries_clockwise.index(nodes_geoid_to_name.get(edge['Source']))
-        dest_m_idx = countries_clockwise.index(nodes_geoid_to_name.get(edge['Target']))
-        if norm:
-            adjacency_matrix[src_m_idx, dest_m_idx] = 1
-        else:
-            adjacency_matrix[src_m_idx, dest_m_idx] += 1
+    if len(position) and position.max() >= size:
+        raise IndexError(f"countries_clockwise has more countries than the {size} nodes")
+    weighted, binary = accumulate_adjacency(position[:len(edges)], position[len(edges):], size)
+    return binary if norm else weighted
 
-    return adjacency_matrix
 
+@lru_cache(maxsize=None)
+def conform_label_to_circos(label):
+    label = label.replace(" ", "")
+    label = label.replace("'", "")
+    label = label.replace("ü", "u")
+    label = label.replace("HongKong", "HongKongSAR")
+    return label
 
-def save_adjacency_matrix(matrix, nodes, csv_file_path, xlsx_file_path):
-    # Convert the matrix to a DataFrame
-    matrix_df = pd.DataFrame(matrix, index=nodes, columns=nodes)
 
-    # Save the DataFrame to a CSV file
-    matrix_df.to_csv(csv_file_path)
-    print(f"Adjacency matrix saved to {csv_file_path}")
+def csv_cell(text):
+    # quoted like pandas.to_csv (csv.QUOTE_MINIMAL) when it holds a separator, a quote or a line break
+    cell = io.StringIO()
+    csv.writer(cell, lineterminator="").writerow([text])
+    return cell.getvalue()
+
+
+def matrix_row_chunks(matrix, chunk_rows=MATRIX_EXPORT_CHUNK_ROWS):
+    """
+    Yields: (first row number, dense rows, rows as text) for chunk_rows rows at a time (matrix: numpy or scipy.sparse)
+    """
+    for chunk_start in range(0, matrix.shape[0], chunk_rows):
+        rows = matrix[chunk_start:chunk_start + chunk_rows]
+        rows = rows.toarray() if sparse is not None and sparse.issparse(rows) else np.asarray(rows)
+        yield chunk_start, rows, rows.astype(str)
+
+
+def export_adjacency_matrix(matrix, labels, file_root, formats=MATRIX_EXPORT_FORMATS,
+                            chunk_rows=MATRIX_EXPORT_CHUNK_ROWS):
+    """
+    Writes an adjacency matrix in several formats at once: the labels are prepared once, and every chunk of rows
+    is formatted once and written to all the open text/Excel outputs, in a single pass over the matrix.
+
+    Args:
+        matrix: (N x N) numpy array or scipy.sparse matrix, rows and columns in the order of labels
+        labels: N row/column names (e.g. countries_clockwise)
+        file_root: path of the outputs without extension, e.g. ".../adjacency_matrix"
+        formats: extensions among MATRIX_EXPORT_FORMATS:
+            ".csv", ".xlsx": matrix with the labels as first row and column
+            ".txt": Circos table, for this webapp: https://mk.bcgsc.ca/tableviewer/ (0s written as "-")
+            ".npz": compressed numpy (scipy.sparse) matrix, with the labels in a "<file_root>_labels.txt" sidecar
+        chunk_rows: rows formatted and written at a time
+
+    Returns: list of written paths
+    """
+    labels = [str(label) for label in labels]
+    if matrix.shape != (len(labels), len(labels)):
+        raise ValueError(f"Matrix shape {matrix.shape} does not match the {len(labels)} labels")
+    unknown_formats = set(formats) - set(MATRIX_EXPORT_FORMATS)
+    if unknown_formats:
+        raise ValueError(f"Unknown matrix export formats: {sorted(unknown_formats)}")
+
+    file_paths = {ext: f"{file_root}{ext}" for ext in formats}
+    text_files = {ext: open(file_paths[ext], "w", encoding="utf-8", newline="\n") for ext in [".csv", ".txt"]
+                  if ext in formats}
+    try:
+        csv_labels = [csv_cell(label) for label in labels]
+        circos_labels = [conform_label_to_circos(label) for label in labels]
+        if ".csv" in text_files:
+            text_files[".csv"].write(",".join([""] + csv_labels) + "\n")
+        if ".txt" in text_files:
+            text_files[".txt"].write("\t".join(["order", "labels"] + circos_labels) + "\n")
+        if ".xlsx" in formats:
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet("Sheet1")
+            sheet.append([None] + labels)
+
+        for chunk_start, rows, row_texts in matrix_row_chunks(matrix, chunk_rows):
+            if ".csv" in text_files:
+                text_files[".csv"].write("".join(
+                    csv_labels[chunk_start + i] + "," + ",".join(row_text) + "\n" for i, row_text in enumerate(row_texts)))
+            if ".txt" in text_files:
+                circos_texts = np.where(rows == 0, "-", row_texts)
+                text_files[".txt"].write("".join(
+                    f"{chunk_start + i + 1}\t{circos_labels[chunk_start + i]}\t" + "\t".join(row_text) + "\n"
+                    for i, row_text in enumerate(circos_texts)))
+            if ".xlsx" in formats:
+                for i, row in enumerate(rows.tolist()):
+                    sheet.append([labels[chunk_start + i]] + row)
+    finally:
+        for text_file in text_files.values():
+            text_file.close()
+
+    if ".xlsx" in formats:
+        workbook.save(file_paths[".xlsx"])
+    if ".npz" in formats:
+        if sparse is not None and sparse.issparse(matrix):
+            sparse.save_npz(file_paths[".npz"], matrix.tocsr())
+        else:
+            np.savez_compressed(file_paths[".npz"], matrix=np.asarray(matrix))
+        with open(f"{file_root}_labels.txt", "w", encoding="utf-8", newline="\n") as labels_file:
+            labels_file.write("".join(f"{label}\n" for label in labels))
+    for ext in formats:
+        print(f"Adjacency matrix saved to {file_paths[ext]}")
+    return list(file_paths.values())
+
 
-    # Save the DataFrame to an XLSX file
-    matrix_df.to_excel(xlsx_file_path, engine='openpyxl')
-    print(f"Adjacency matrix saved to {xlsx_file_path}")
+def save_adjacency_matrix(matrix, nodes, csv_file_path, xlsx_file_path):
+    # Save the matrix to a CSV and an XLSX file, in one pass (see export_adjacency_matrix)
+    for file_path, ext in [(csv_file_path, ".csv"), (xlsx_file_path, ".xlsx")]:
+        if os.path.splitext(file_path)[1] != ext:
+            raise ValueError(f"{file_path} should be a {ext} file")
+    if os.path.splitext(csv_file_path)[0] == os.path.splitext(xlsx_file_path)[0]:
+        export_adjacency_matrix(matrix, nodes, os.path.splitext(csv_file_path)[0], [".csv", ".xlsx"])
+    else:
+        export_adjacency_matrix(matrix, nodes, os.path.splitext(csv_file_path)[0], [".csv"])
+        export_adjacency_matrix(matrix, nodes, os.path.splitext(xlsx_file_path)[0], [".xlsx"])
 
 
 def save_adjacency_matrix_to_txt_for_circos(ordered_matrix, labels_ordered_clockwise, output_txt_file_path):
     """
-    Sort the columns and rows of the adjacency matrix according to the order of the countries_clockwise list
+    Save the adjacency matrix as a Circos table (see export_adjacency_matrix)
     output of this function is to be used on this webapp: https://mk.bcgsc.ca/tableviewer/
     Args:
         ordered_matrix: adjacency matrix with columns and row ordered according the countries_clockwise list's order
         labels_ordered_clockwise: Series of countries sorted "clockwise" for a circular or chord graph display
-        output_txt_file_path: full path to the output file
+        output_txt_file_path: full path to the output .txt file
     """
+    file_root, ext = os.path.splitext(output_txt_file_path)
+    if ext != ".txt":
+        raise ValueError(f"{output_txt_file_path} should be a .txt file")
+    export_adjacency_matrix(ordered_matrix, labels_ordered_clockwise, file_root, [".txt"])
 
-    def conform_label_to_circos(label):
-        label = label.replace(" ", "")
-        label = label.replace("'", "")
-        label = label.replace("ü", "u")
-        label = label.replace("HongKong", "HongKongSAR")
-        return label
 
-    countries_clockwise_stripped = [conform_label_to_circos(c) for c in labels_ordered_clockwise]
+def region_incidence_matrix(countries_clockwise, regions_clockwise, country_to_region_dict):
+    """
+    Incidence matrix M (Nc x Nr): M[i, j] = 1 if country i is in region j
 
-    # Create DataFrame with order and labels as the first two columns
-    order_column = list(range(1, len(labels_ordered_clockwise) + 1))
-    matrix_df = pd.DataFrame(ordered_matrix, columns=labels_ordered_clockwise)
-    matrix_df.insert(0, 'order', order_column)
-    matrix_df.insert(1, 'labels', countries_clockwise_stripped)
+    Args:
+        countries_clockwise: list of Nc country names, in the order of the country adjacency matrix axes.
+        regions_clockwise: list of Nr region names in the desired output order.
+        country_to_region_dict: dict mapping country -> region.
+    """
+    Nc = len(countries_clockwise)
+    Nr = len(regions_clockwise)
 
-    # Replace 0s with "-"
-    matrix_df.replace(0, "-", inplace=True)
+    M = np.zeros((Nc, Nr), dtype=int)
+    region_index = {r: idx for idx, r in enumerate(regions_clockwise)}
 
-    # Save to TXT
-    with open(output_txt_file_path, 'w') as f:
-        # Write the header
-        f.write("\t".join(["order", "labels"] + countries_clockwise_stripped) + "\n")
-        # Write the rows including the node labels
-        for idx, row in enumerate(matrix_df.iterrows()):
-            _, row_values = row
-            f.write(f"{order_column[idx]}\t{countries_clockwise_stripped[idx]}\t" + "\t".join(
-                map(str, row_values.tolist()[2:])) + "\n")
+    missing_countries = []
+    missing_regions = []
+    for i, country in enumerate(countries_clockwise):
+        region = country_to_region_dict.get(country)
+        if region is None:
+            missing_countries.append(country)
+            continue
+        j = region_index.get(region)
+        if j is None:
+            missing_regions.append(region)
+            continue
+        M[i, j] = 1
 
-    print(f"Adjacency matrix saved to {output_txt_file_path}")
+    if missing_countries:
+        raise KeyError(f"Countries missing in country_to_region_dict: {missing_countries}")
+    if missing_regions:
+        raise KeyError(f"Regions not found in regions_clockwise: {sorted(set(missing_regions))}")
+    return M
 
 
 def aggregate_adjacency_by_region(
-    adj_matrix_country: np.ndarray,
+    adj_matrix_country,
+    countries_clockwise,
+    regions_clockwise,
     country_to_region_dict: dict,
     binary: bool = False,
     remove_self_loops: bool = False,
-) -> np.ndarray:
+):
     """
     Aggregate a country-level adjacency matrix into a region-level adjacency matrix.
     This method achieves this by computing R = M^T * A * M
     R: region adjacency matrix (T transpose)
     A: country adjacency matrix
-    M: incidence matrix (#regions * #countries)
+    M: incidence matrix (#countries * #regions), see region_incidence_matrix
     Args:
-        adj_matrix_country: (Nc x Nc) numpy array. Rows/cols must align with countries_clockwise.
+        adj_matrix_country: (Nc x Nc) numpy array or scipy.sparse matrix, or a (K x Nc x Nc) numpy array
+            (adjacency_tensor_from_network) whose K slices are all aggregated at once, or a list of K
+            (Nc x Nc) scipy.sparse matrices (adjacency_tensor_from_network with dense=False), aggregated
+            slice by slice. Rows/cols must align with countries_clockwise.
         countries_clockwise: list of Nc country names in the same order as adj_matrix_country axes.
         regions_clockwise: list of Nr region names in the desired output order.
         country_to_region_dict: dict mapping country -> region.
@@ -131,62 +389,57 @@ def aggregate_adjacency_by_region(
         remove_self_loops: if True, zero out the diagonal of the resulting region matrix.
 
     Returns:
-        (Nr x Nr) numpy array where entry (i, j) is the sum of flows from region i to region j.
+        (Nr x Nr) (or (K x Nr x Nr)) matrix, of the same kind as adj_matrix_country, where entry (i, j) is the sum
+        of flows from region i to region j. A list of sparse matrices gives a list of K sparse (Nr x Nr) matrices.
     """
+    if isinstance(adj_matrix_country, (list, tuple)):
+        return [
+            aggregate_adjacency_by_region(adj_slice, countries_clockwise, regions_clockwise, country_to_region_dict,
+                                          binary=binary, remove_self_loops=remove_self_loops)
+            for adj_slice in adj_matrix_country
+        ]
+
     Nc = len(countries_clockwise)
-    Nr = len(regions_clockwise)
 
-    if adj_matrix_country.shape != (Nc, Nc):
+    if adj_matrix_country.shape[-2:] != (Nc, Nc):
         raise ValueError(
             f"adj_matrix_country shape {adj_matrix_country.shape} does not match "
             f"countries list length {Nc}"
         )
 
     # Build incidence matrix M (Nc x Nr): country -> region
-    M = np.zeros((Nc, Nr), dtype=int)
-    region_index = {r: idx for idx, r in enumerate(regions_clockwise)}
+    M = region_incidence_matrix(countries_clockwise, regions_clockwise, country_to_region_dict)
+    if sparse is not None and sparse.issparse(adj_matrix_country):
+        M = sparse.csr_matrix(M)
 
-    missing_countries = []
-    missing_regions = []
-    for i, country in enumerate(countries_clockwise):
-        region = country_to_region_dict.get(country)
-        if region is None:
-            missing_countries.append(country)
-            continue
-        j = region_index.get(region)
-        if j is None:
-            missing_regions.append(region)
-            continue
-        M[i, j] = 1
-
-    if missing_countries:
-        raise KeyError(f"Countries missing in country_to_region_dict: {missing_countries}")
-    if missing_regions:
-        raise KeyError(f"Regions not found in regions_clockwise: {sorted(set(missing_regions))}")
-
-    # Aggregate: R = M^T * A * M
+    # Aggregate: R = M^T * A * M (for a stack of matrices, slice by slice)
     region_adj = M.T @ adj_matrix_country @ M
 
     if binary:
         region_adj = (region_adj > 0).astype(int)
 
     if remove_self_loops:
-        np.fill_diagonal(region_adj, 0)
+        if sparse is not None and sparse.issparse(region_adj):
+            region_adj = region_adj.tolil()
+            region_adj.setdiag(0)
+            region_adj = region_adj.tocsr()
+            region_adj.eliminate_zeros()
+        else:
+            diagonal = np.arange(region_adj.shape[-1])
+            region_adj[..., diagonal, diagonal] = 0
 
     return region_adj
 
 
-
 if __name__ == "__main__":
     # working directory
     wdir = 'C:/Users/aolliaro/OneDrive - Nexus365/DPhil data and analysis/phd_analysis_data'
     # File paths
-    edges_file_path = os.path.join(wdir, '1.5_nodes_edges.xlsx')
-    output_csv_file_path = os.path.join(wdir, 'adjacency_matrix.csv')
-    output_xlsx_file_path = os.path.join(wdir, 'adjacency_matrix.xlsx')
-    output_txt_file_path_norm = os.path.join(wdir, 'adjacency_matrix_norm.txt')
-    output_txt_file_path_regions_norm = os.path.join(wdir, 'adjacency_matrix_regions_norm.txt')
-    output_txt_file_path = os.path.join(wdir, 'adjacency_matrix.txt')
+    edges_file_path = os.path.join(wdir, artifact_file_name('1.5_nodes_edges.xlsx'))
+    # output paths without extension, see export_adjacency_matrix
+    output_file_root = os.path.join(wdir, 'adjacency_matrix')
+    output_file_root_norm = os.path.join(wdir, 'adjacency_matrix_norm')
+    output_file_root_regions_norm = os.path.join(wdir, 'adjacency_matrix_regions_norm')
     input_countries_regions_file_path = os.path.join(wdir, 'aux_country-to-region_sorted_clockwise_UNm49.xlsx')
 
     """CAREFUL this pairing list of sorted countries and corresponding regions
@@ -209,21 +462,26 @@ if __name__ == "__main__":
     # list of regions sorted "clockwise" for a circular or chord graph display
     regions_clockwise = regions['subregion_m49'].unique()
 
-    # Read edges from CSV
-    edges, nodes_geoid_to_name = read_edges_from_excel(edges_file_path)
+    # Read nodes and edges from the network artifact
+    network = read_network(edges_file_path)
 
-    # Create a weighted adjacency matrix
-    output_adjacency_matrix = create_adjacency_matrix(edges, nodes_geoid_to_name, countries_clockwise, norm=False)
-    # Create a non-weighted (normalised) adjacency matrix
-    output_adjacency_matrix_norm = create_adjacency_matrix(edges, nodes_geoid_to_name, countries_clockwise, norm=True)
+    # Create the weighted and the non-weighted (normalised) adjacency matrices
+    output_adjacency_matrix, output_adjacency_matrix_norm = adjacency_matrices_from_network(network, countries_clockwise)
     # convert the country normalised matrixed to a regions' adjacency matrix
-    output_adjacency_matrix_regions = aggregate_adjacency_by_region(output_adjacency_matrix_norm, country_to_region_dict)
+    output_adjacency_matrix_regions = aggregate_adjacency_by_region(output_adjacency_matrix_norm, countries_clockwise,
+                                                                    regions_clockwise, country_to_region_dict)
 
-    # Save weighted adjacency matrix to CSV and XLSX
-    save_adjacency_matrix(output_adjacency_matrix, countries_clockwise, output_csv_file_path, output_xlsx_file_path)
-    # Save weighted adjacency matrix to TXT - for Circos chord graph visualisation
-    save_adjacency_matrix_to_txt_for_circos(output_adjacency_matrix, countries_clockwise, output_txt_file_path)
+    # Save weighted adjacency matrix to CSV, XLSX, NPZ and TXT (for Circos chord graph visualisation)
+    export_adjacency_matrix(output_adjacency_matrix, countries_clockwise, output_file_root)
     # Save normalised adjacency matrix to TXT - for Circos chord graph visualisation
-    save_adjacency_matrix_to_txt_for_circos(output_adjacency_matrix_norm, countries_clockwise, output_txt_file_path_norm)
+    export_adjacency_matrix(output_adjacency_matrix_norm, countries_clockwise, output_file_root_norm, [".txt"])
     # Save normalised adjacency matrix of regions to .txt - for Circos chord graph visualisation
-    save_adjacency_matrix_to_txt_for_circos(output_adjacency_matrix_regions, regions_clockwise, output_txt_file_path_regions_norm)
+    export_adjacency_matrix(output_adjacency_matrix_regions, regions_clockwise, output_file_root_regions_norm, [".txt"])
+
+    # Per-year normalised matrices of regions, from the yearly country matrices built in one pass
+    years, _, yearly_adjacency_matrices_norm = adjacency_tensor_from_network(network, countries_clockwise, "year")
+    yearly_adjacency_matrices_regions = aggregate_adjacency_by_region(
+        yearly_adjacency_matrices_norm, countries_clockwise, regions_clockwise, country_to_region_dict)
+    for year, year_matrix_regions in zip(years, yearly_adjacency_matrices_regions):
+        export_adjacency_matrix(year_matrix_regions, regions_clockwise, f'{output_file_root_regions_norm}_{year}',
+                                [".txt"])
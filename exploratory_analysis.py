@@ -4,22 +4,28 @@ import os
 import pickle
 from datetime import datetime
 from sankeydiagram import create_and_plot_sankey_diagram_phd_data
+from artifacts import load_table
 
 def add_timestamp_to_filename(file_path):
     root, ext = os.path.splitext(file_path)
     return f"{root}_{datetime.now().strftime("%Y%m%d%H%M%S")}{ext}"
 
 
-def run_exploratory_analysis(data_only_included_file_path, output_dir, full_data_file_path, exploratory_analysis_file_path):
+def run_exploratory_analysis(data_only_included_file_path, output_dir, full_data_file_path, exploratory_analysis_file_path,
+                             show_plots=True):
     """
     Perform exploratory analysis on the input data and save results to the output directory.
 
     Parameters:
     -----------
-    input_file_path : str
-        Path to the input Excel file containing the data
+    data_only_included_file_path : str or DataFrame
+        Path to the included data (1.3), or the DataFrame itself
+    full_data_file_path : str or DataFrame
+        Path to the full data (1.2), or the DataFrame itself
     output_dir : str
         Directory where output files will be saved
+    show_plots : bool
+        Display the Sankey diagram and the wordclouds (they are saved to output_dir either way)
 
     Returns:
     --------
@@ -32,8 +38,8 @@ def run_exploratory_analysis(data_only_included_file_path, output_dir, full_data
 
     try:
         # Read the data
-        included_df = pd.read_excel(data_only_included_file_path, sheet_name=0)
-        df_full = pd.read_excel(full_data_file_path, sheet_name=0)
+        included_df = load_table(data_only_included_file_path)
+        df_full = load_table(full_data_file_path)
         # Convert Publication Date to datetime in both dataframes
         included_df['Publication Date'] = pd.to_datetime(included_df['Publication Date'], errors='coerce')
         df_full['Publication Date'] = pd.to_datetime(df_full['Publication Date'], errors='coerce')
@@ -91,7 +97,7 @@ def run_exploratory_analysis(data_only_included_file_path, output_dir, full_data
         print("plotting sankey diagram...")
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         sankey_diagram_file_path = os.path.join(output_dir, f"sankey_diagram_{timestamp}.html")
-        create_and_plot_sankey_diagram_phd_data(results, sankey_diagram_file_path)
+        create_and_plot_sankey_diagram_phd_data(results, sankey_diagram_file_path, show_plot=show_plots)
 
         # 5. Count medicine quality distribution (ratio of "falsified" to "indistinguishable"
         medicine_quality_counts = included_df['medicine quality'].value_counts()
@@ -111,14 +117,16 @@ def run_exploratory_analysis(data_only_included_file_path, output_dir, full_data
         create_wordcloud(
             included_df['Medical Products'],
             os.path.join(output_dir, f"medical_products_wordcloud_{timestamp}.png"),
-            'Medical Products WordCloud'
+            'Medical Products WordCloud',
+            show_plot=show_plots
         )
         # 8. collect FMP encountered and plot/save WordClouds ----------------------------------------------------------
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         create_wordcloud(
             included_df['wording used'],
             os.path.join(output_dir, f"wording_used_wordcloud_{timestamp}.png"),
-            'Wording Used WordCloud'
+            'Wording Used WordCloud',
+            show_plot=show_plots
         )
 
         # 9. Calculate manufacturing roles percentage ------------------------------------------------------------------
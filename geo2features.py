@@ -1,24 +1,47 @@
-from typing import Any, Hashable
-
 import pandas as pd
-import requests
-import xml.etree.ElementTree as ET
-from datetime import datetime
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
+import tempfile
+import threading
 import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from artifacts import load_table, save_artifact
+from geonames_cache import GeonamesCache, cache_file_path_for
+from geonames_client import GeonamesClient, GeonamesQuotaExceeded, GeonamesTransientError, make_geonames_rate_limiter
+from geonames_offline import GeonamesOfflineIndex
+import step_metrics
 
-from numpy.f2py.auxfuncs import throw_error
 
 USERNAME = 'albertoolliaro' # geonames API requires a private username to allow more queries
 GEONAME_DICTIONARY_FILE_PATH = ""
+GEONAMES_API_URL = "http://api.geonames.org/hierarchy" # overridable, e.g. to point at a local stub server
+GEONAMES_HOURLY_QUOTA = 1000 # free accounts are limited to 1000 credits per hour
+GEONAMES_QUOTA_WINDOW_S = 3600
+GEONAMES_MAX_WORKERS = 4 # concurrent API requests when resolving new geoIDs
+GEONAMES_OFFLINE_INDEX = None # GeonamesOfflineIndex, set by use_offline_geonames_index()
+LOC_COLUMNS = ["loc1", "loc2", "loc3", "loc4"]
+# "locN <column suffix>" filled from each key of the hierarchy dict, in the order the columns are filled
+LOC_ATTRIBUTES = {
+    "geoname_cont": "continent",
+    "geoname_country": "geoname_countryName",
+    "geoname_countryCode": "geoname_countryCode",
+    "geoname_country_geoId": "geoname_country_geoId",
+    "geoname_country_lat": "geoname_country_lat",
+    "geoname_country_lon": "geoname_country_lon",
+    "geoname_ADM1": "ADM1",
+    "geoname_ADM2": "ADM2",
+    "geoname_ADM3": "ADM3",
+}
 
 test_geonameID = 7285904
 
 def prep_phase(data_file_path, geoname_dictionary_file_path):
 
     # Load data and filter by 'include'
-    if os.path.exists(data_file_path):
-        df = pd.read_excel(data_file_path, sheet_name=0)
+    if isinstance(data_file_path, pd.DataFrame) or os.path.exists(data_file_path):
+        df = load_table(data_file_path)
     else:
         print("❌ No input file found, aborting method.")
         return None
@@ -30,65 +53,76 @@ def prep_phase(data_file_path, geoname_dictionary_file_path):
     global GEONAME_DICTIONARY_FILE_PATH
     GEONAME_DICTIONARY_FILE_PATH = geoname_dictionary_file_path
 
-    if os.path.exists(geoname_dictionary_file_path):
-        print("🔄 Loading existing GeoNames dictionary...")
-        geonames_dict_df = pd.read_excel(geoname_dictionary_file_path, sheet_name=0)
-        geonames_dict_cache = geonames_dict_df.set_index("geonameId").to_dict(orient="index")
-    else:
+    # entries are looked up lazily by key; the legacy Excel dictionary is imported the first time only
+    cache_file_path = cache_file_path_for(geoname_dictionary_file_path)
+    if os.path.exists(cache_file_path):
+        print("🔄 Opening existing GeoNames dictionary...")
+    elif not os.path.exists(geoname_dictionary_file_path):
         print("📁 No dictionary found, starting fresh.")
-        geonames_dict_cache = {}
+    geonames_dict_cache = GeonamesCache(cache_file_path, legacy_excel_file_path=geoname_dictionary_file_path)
 
     return df, geonames_dict_cache
 
 
-def add_timestamp_to_filename(file_path):
-    root, ext = os.path.splitext(file_path)
-    return f"{root}_{datetime.now().strftime("%Y%m%d%H%M%S")}{ext}"
-
-
-def save_df_to_file(file_path, df):
-    timestamped_file_path = add_timestamp_to_filename(file_path)
-    df.to_excel(timestamped_file_path, index=False)
-    return timestamped_file_path
+GEONAMES_RATE_LIMITER = make_geonames_rate_limiter(GEONAMES_HOURLY_QUOTA)
+GEONAMES_CLIENT = GeonamesClient(rate_limiter=GEONAMES_RATE_LIMITER, pool_size=GEONAMES_MAX_WORKERS)
 
 
 # queries geonames API to find location hierarchy and geonameID, lat, lon, of country
+# (or the local dump index, when one is in use, see use_offline_geonames_index)
 def query_geonames_api(geoname_id):
-    url = f"http://api.geonames.org/hierarchy?geonameId={geoname_id}&username={USERNAME}"
-    time.sleep(0.6)  # Throttle to stay under 1000/hour
-    response = requests.get(url)
-
-    root = ET.fromstring(response.content)
+    if GEONAMES_OFFLINE_INDEX is not None:
+        step_metrics.count("geonames_offline_queries")
+        return hierarchy_to_result(GEONAMES_OFFLINE_INDEX.hierarchy(geoname_id)[1:]) # removes the "earth" element
 
-    # Check rate-limit
-    status = root.find("status")
-    if status is not None and "hourly limit" in status.attrib.get("message", "").lower():
-        print("⚠️ Hourly limit met")
-        raise RuntimeError("hourly limit met")
+    # pooled session, throttled to stay under the hourly quota, retried on transient errors;
+    # raises GeonamesQuotaExceeded when the hourly limit is met
+    step_metrics.count("geonames_api_calls")
+    root = GEONAMES_CLIENT.get_xml(GEONAMES_API_URL, {"geonameId": geoname_id, "username": USERNAME})
 
     geo_elements = root.findall("geoname")[1:] # removes the "earth" element
 
+    return hierarchy_to_result([{child.tag: child.text or "" for child in element} for element in geo_elements])
+
+
+def hierarchy_to_result(geo_elements):
+    """
+    Builds the cached dictionary entry from the hierarchy, continent first (Earth already removed).
+    Args:
+        geo_elements: list of dicts with the toponymName, name, countryCode, geonameId, lat, lng of each level
+
+    Returns: dict with continent, geoname_countryName, geoname_country_geoId, ..., ADM1, ADM2, ADM3
+    """
     result = {}
     if len(geo_elements) >= 1:
-        result["continent"] = geo_elements[0].findtext("toponymName")
-        result["geoname_continent_lat"] = geo_elements[0].findtext("lat")
-        result["geoname_continent_lon"] = geo_elements[0].findtext("lng")
+        result["continent"] = geo_elements[0].get("toponymName")
+        result["geoname_continent_lat"] = geo_elements[0].get("lat")
+        result["geoname_continent_lon"] = geo_elements[0].get("lng")
         if len(geo_elements) >= 2:
-            result["geoname_countryName"] = geo_elements[1].findtext("name")
-            result["geoname_countryCode"] = geo_elements[1].findtext("countryCode")
-            result["geoname_country_geoId"] = geo_elements[1].findtext("geonameId")
-            result["geoname_country_lat"] = geo_elements[1].findtext("lat")
-            result["geoname_country_lon"] = geo_elements[1].findtext("lng")
+            result["geoname_countryName"] = geo_elements[1].get("name")
+            result["geoname_countryCode"] = geo_elements[1].get("countryCode")
+            result["geoname_country_geoId"] = geo_elements[1].get("geonameId")
+            result["geoname_country_lat"] = geo_elements[1].get("lat")
+            result["geoname_country_lon"] = geo_elements[1].get("lng")
             if len(geo_elements) >= 3:
-                result["ADM1"] = geo_elements[2].findtext("toponymName") # admin levels often indicate "region, district, state"
+                result["ADM1"] = geo_elements[2].get("toponymName") # admin levels often indicate "region, district, state"
                 if len(geo_elements) >= 4:
-                    result["ADM2"] = geo_elements[3].findtext("toponymName") # which is helpful to understand the context
+                    result["ADM2"] = geo_elements[3].get("toponymName") # which is helpful to understand the context
                     if len(geo_elements) >= 5:
-                        result["ADM3"] = geo_elements[4].findtext("toponymName") # especially on visual/graph/diagrams
+                        result["ADM3"] = geo_elements[4].get("toponymName") # especially on visual/graph/diagrams
 
     return result
 
 
+def use_offline_geonames_index(index_dir):
+    """
+    Answers query_geonames_api from a local dump index (built with geonames_offline.build_offline_index)
+    instead of the rate-limited API. Pass None to go back to the API.
+    """
+    global GEONAMES_OFFLINE_INDEX
+    GEONAMES_OFFLINE_INDEX = GeonamesOfflineIndex(index_dir) if index_dir else None
+
+
 # Fetch from cache (or update dictionary if needed) and return the country info, admin123 and continent
 def get_geonames_data(geo_id, geonames_dict_cache, ):
     try:
@@ -106,31 +140,169 @@ def get_geonames_data(geo_id, geonames_dict_cache, ):
         # if not in dictionary: query API
         print(f"🔍 Querying new GeoNames ID: {geo_id_int}")
         result = query_geonames_api(geo_id_int)
-        geonames_dict_cache[geo_id_int] = result
-
-        # Save the updated dictionary immediately
-        pd.DataFrame.from_dict(geonames_dict_cache, orient="index").reset_index().rename(
-            columns={"index": "geonameId"}).to_excel(GEONAME_DICTIONARY_FILE_PATH, index=False)
+        geonames_dict_cache[geo_id_int] = result  # persisted immediately by the cache backend
         return result
 
-    # we save the geonames dictionary if things crash, notably due to the API
+    # API errors (limit met, transient failures that outlived the retries) are handled by the caller
+    # rather than cached or returned as {}; everything fetched so far is already persisted
     except RuntimeError:
-        print("⚠️ Saving partial dictionary to avoid loss...")
-        pd.DataFrame.from_dict(geonames_dict_cache, orient="index").reset_index().rename(
-            columns={"index": "geonameId"}).to_excel(GEONAME_DICTIONARY_FILE_PATH, index=False)
         raise
     except Exception as e:
         print(f"Error handling geoID {geo_id}: {e}")
         return {}
 
 
-# Process locations, by column loc 1234 then by row, to retrieve its hierarchy from the geonames API
-def process_all_locations(data_file_path, geoname_dictionary_file_path, output_file_path):
+def normalise_geo_ids(geo_ids):
+    """
+    Vectorised version of the geoID cleaning done in get_geonames_data():
+    null, empty, "world" and other non-numeric cells become <NA>, the rest are cast to int.
+
+    Args:
+        geo_ids: pandas.Series of raw "locN geoID" cells
+
+    Returns: pandas.Series of dtype Int64
+    """
+    numeric = pd.to_numeric(geo_ids.astype("string").str.strip(), errors="coerce")
+    return np.trunc(numeric).astype("Int64")
+
+
+def collect_unique_geo_ids(df, locs=LOC_COLUMNS):
+    """
+    Collects the set of distinct geoIDs referenced by any of the "locN geoID" columns.
+
+    Returns: sorted list of int geoIDs
+    """
+    geo_ids = set()
+    for loc in locs:
+        geo_id_col = f"{loc} geoID"
+        if geo_id_col in df.columns:
+            geo_ids.update(int(geo_id) for geo_id in normalise_geo_ids(df[geo_id_col]).dropna().unique())
+    return sorted(geo_ids)
+
+
+def resolve_geo_ids(geo_ids, geonames_dict_cache, max_workers=GEONAMES_MAX_WORKERS):
+    """
+    Fetches the hierarchy of every geoID that is not cached yet, concurrently,
+    under the shared GEONAMES_RATE_LIMITER. Each answer is written to the cache as soon as it arrives.
+
+    Args:
+        geo_ids: iterable of int geoIDs, e.g. from collect_unique_geo_ids()
+        geonames_dict_cache: GeonamesCache (or dict) geoID -> hierarchy dict, updated in place
+        max_workers: number of concurrent API requests
+
+    Returns: geonames_dict_cache
 
+    Raises:
+        GeonamesQuotaExceeded: the hourly limit was met, everything fetched so far is in the cache
+    """
+    geo_ids = list(geo_ids)
+    missing_geo_ids = [geo_id for geo_id in geo_ids if geo_id not in geonames_dict_cache]
+    step_metrics.count("geonames_lookups", len(geo_ids))
+    step_metrics.count("geonames_cache_hits", len(geo_ids) - len(missing_geo_ids))
+    if not missing_geo_ids:
+        return geonames_dict_cache
+
+    print(f"🔍 Querying {len(missing_geo_ids)} new GeoNames IDs with {max_workers} workers...")
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(query_geonames_api, geo_id): geo_id for geo_id in missing_geo_ids}
+    try:
+        for future in as_completed(futures):
+            geo_id = futures[future]
+            try:
+                geonames_dict_cache[geo_id] = future.result()
+            except GeonamesTransientError as e:
+                # left out of the cache, so that it is fetched again on the next run
+                # (process_all_locations reports it as unresolved, the pipeline step then counts as incomplete)
+                print(f"⚠️ Giving up on geoID {geo_id} for this run: {e}")
+            except GeonamesQuotaExceeded:
+                raise
+            except Exception as e:
+                print(f"Error handling geoID {geo_id}: {e}")
+    except GeonamesQuotaExceeded:
+        executor.shutdown(wait=True, cancel_futures=True)
+        # keep the answers of the requests that were already in flight
+        for future, geo_id in futures.items():
+            if not future.cancelled() and future.exception() is None and geo_id not in geonames_dict_cache:
+                geonames_dict_cache[geo_id] = future.result()
+        raise
+    finally:
+        print(f"📡 GeoNames client stats: {GEONAMES_CLIENT.stats_summary()}")
+    executor.shutdown(wait=True)
+    return geonames_dict_cache
+
+
+def wait_for_next_quota_window():
+    """
+    Sleeps until the next GeoNames quota window (the hourly credits reset on the hour), plus a safety margin.
+    """
+    wait_s = GEONAMES_QUOTA_WINDOW_S - time.time() % GEONAMES_QUOTA_WINDOW_S + 60
+    print(f"⏳ API limit met, waiting {wait_s / 60:.0f} minutes for the next quota window...")
+    time.sleep(wait_s)
+
+
+def build_hierarchy_table(geo_ids, geonames_dict_cache):
+    """
+    One row per geoID with the attributes of its cached hierarchy (empty when it is not in the dictionary).
+
+    Returns: pandas.DataFrame indexed by geonameId (Int64), one column per value of LOC_ATTRIBUTES
+    """
+    hierarchy_df = pd.DataFrame.from_dict({geo_id: geonames_dict_cache.get(geo_id) or {} for geo_id in geo_ids},
+                                          orient="index", columns=list(LOC_ATTRIBUTES.values()))
+    hierarchy_df.index = hierarchy_df.index.astype("Int64")
+    return hierarchy_df
+
+
+# Process locations: resolve the distinct geoIDs of loc 1234 once, then join their hierarchy onto each loc block
+def process_all_locations(data_file_path, geoname_dictionary_file_path, output_file_path, offline_index_dir=None,
+                          on_quota="partial", export_excel=False, return_unresolved=False):
+    """
+    Args:
+        data_file_path: routes data with the "locN geoID" columns (path or DataFrame)
+        geoname_dictionary_file_path: Excel GeoNames dictionary (the SQLite cache is kept next to it)
+        output_file_path: output artifact path, a timestamp is added to the file name (None: not written)
+        offline_index_dir: optional GeoNames dump index (see geonames_offline.py), new geoIDs are then resolved locally
+        on_quota: what to do when the API limit is met:
+            "partial" saves the output with the geoIDs resolved so far (legacy behaviour),
+            "wait" sleeps until the next quota window and carries on,
+            "exit" returns (None, None) without writing a half-filled output
+            Every answer is stored in the SQLite GeoNames cache as it arrives: the cache is the resume state,
+            a new run only queries the geoIDs that are not in it yet.
+        export_excel: also write the output as Excel, for human review
+        return_unresolved: also return the sorted list of the geoIDs left unresolved (API limit, transient or other
+            errors): their rows have empty hierarchy columns, and are only filled by a later run
+
+    Returns: the enriched DataFrame, path to the written artifact (and the unresolved geoIDs, see return_unresolved)
+    """
     df, geonames_dict_cache = prep_phase(data_file_path, geoname_dictionary_file_path)
+    if offline_index_dir:
+        use_offline_geonames_index(offline_index_dir)
 
+    # Resolve every distinct geoID once, then build one table of their hierarchies to join on
+    geo_ids = collect_unique_geo_ids(df)
+    while True:
+        try:
+            resolve_geo_ids(geo_ids, geonames_dict_cache)
+            break
+        except GeonamesQuotaExceeded:
+            resolved_count = sum(geo_id in geonames_dict_cache for geo_id in geo_ids)
+            print(f"💾 {resolved_count}/{len(geo_ids)} geoIDs resolved and kept in the GeoNames cache.")
+            if on_quota == "wait":
+                wait_for_next_quota_window()
+                continue
+            if on_quota == "exit":
+                print(f"⏸️ API limit met, progress kept in {cache_file_path_for(geoname_dictionary_file_path)}; "
+                      f"run again to resume.")
+                unresolved_geo_ids = [geo_id for geo_id in geo_ids if geo_id not in geonames_dict_cache]
+                geonames_dict_cache.close()
+                return (None, None, unresolved_geo_ids) if return_unresolved else (None, None)
+            print("⛔ Process halted due to API limit, only the geoIDs already in the dictionary are filled.")
+            break
+    hierarchy_df = build_hierarchy_table(geo_ids, geonames_dict_cache)
+    unresolved_geo_ids = [geo_id for geo_id in geo_ids if geo_id not in geonames_dict_cache]
+    if unresolved_geo_ids:
+        print(f"⚠️ {len(unresolved_geo_ids)}/{len(geo_ids)} geoIDs could not be resolved, their rows are left empty.")
 
-    for loc in ["loc1", "loc2", "loc3", "loc4"]:
+    for loc in LOC_COLUMNS:
         print(f"📍 Working on: {loc}")
         geoname_id_col = f"{loc} geoID"
 
@@ -157,28 +329,22 @@ def process_all_locations(data_file_path, geoname_dictionary_file_path, output_f
                 insert_pos = df.columns.get_loc(insert_after_col) + 1
                 df.insert(insert_pos, new_col_name, pd.NA)
 
-        # Apply lookup on the get_geonames_data() for each row with lambdas
-        try:
-            df[f"{loc} geoname_cont"] = df[geoname_id_col].apply(lambda x: get_geonames_data(x, geonames_dict_cache).get("continent"))
-            df[f"{loc} geoname_country"] = df[geoname_id_col].apply(
-                lambda x: get_geonames_data(x, geonames_dict_cache).get("geoname_countryName"))
-            df[f"{loc} geoname_countryCode"] = df[geoname_id_col].apply(
-                lambda x: get_geonames_data(x, geonames_dict_cache).get("geoname_countryCode"))
-            df[f"{loc} geoname_country_geoId"] = df[geoname_id_col].apply(
-                lambda x: get_geonames_data(x, geonames_dict_cache).get("geoname_country_geoId"))
-            df[f"{loc} geoname_country_lat"] = df[geoname_id_col].apply(
-                lambda x: get_geonames_data(x, geonames_dict_cache).get("geoname_country_lat"))
-            df[f"{loc} geoname_country_lon"] = df[geoname_id_col].apply(
-                lambda x: get_geonames_data(x, geonames_dict_cache).get("geoname_country_lon"))
-            df[f"{loc} geoname_ADM1"] = df[geoname_id_col].apply(lambda x: get_geonames_data(x, geonames_dict_cache).get("ADM1"))
-            df[f"{loc} geoname_ADM2"] = df[geoname_id_col].apply(lambda x: get_geonames_data(x, geonames_dict_cache).get("ADM2"))
-            df[f"{loc} geoname_ADM3"] = df[geoname_id_col].apply(lambda x: get_geonames_data(x, geonames_dict_cache).get("ADM3"))
-        except RuntimeError:
-            print("⛔ Process halted due to API limit.")
-            break
+        # Attach the whole block of attributes with a single join on the normalised geoID
+        looked_up = normalise_geo_ids(df[geoname_id_col]).to_frame("geonameId").merge(
+            hierarchy_df, how="left", left_on="geonameId", right_index=True)
+        for new_col_suffix, attribute in LOC_ATTRIBUTES.items():
+            df[f"{loc} {new_col_suffix}"] = looked_up[attribute].to_numpy()
+
+    # Export the dictionary for human review (the SQLite cache remains the source of truth)
+    geonames_dict_cache.export_to_excel(geoname_dictionary_file_path)
+    geonames_dict_cache.close()
+
     # Save the final DataFrame with timestam
-    output_file_path=  save_df_to_file(output_file_path, df)
-    print("✅ All done. Output saved to:", output_file_path)
+    if output_file_path:
+        output_file_path = save_artifact(output_file_path, df, export_excel=export_excel)
+    print("✅ All done. Output saved to:", output_file_path or "(kept in memory)")
+    if return_unresolved:
+        return df, output_file_path, unresolved_geo_ids
     return df, output_file_path
 
 
@@ -186,6 +352,7 @@ def test_query_geonames_api():
     """
     Test the query_geonames_api function to ensure the correct hierarchy is returned by
     calling http://api.geonames.org/hierarchy?geonameId=7285904&username=albertoolliaro
+    (or the local dump index, fully offline, after use_offline_geonames_index())
     """
     result_hierarchy = ["Europe", "Switzerland", "Canton de Genève", "Geneva", "Genthod",
                         "2658434", "47.00016", "8.01427", "CH"]
@@ -213,3 +380,74 @@ def test_query_geonames_api():
     assert result_hierarchy[7] == country_lon, f"Test failed! Expected '{result_hierarchy[7]}', but got '{country_lon}'."
     assert result_hierarchy[8] == country_code, f"Test failed! Expected '{result_hierarchy[8]}', but got '{country_code}'."
 
+
+# canned answer of http://api.geonames.org/hierarchy?geonameId=7285904, used by the stub server below
+TEST_HIERARCHY_XML = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<geonames style="MEDIUM">
+<geoname><toponymName>Earth</toponymName><name>Earth</name><lat>0</lat><lng>0</lng><geonameId>6295630</geonameId><countryCode/><fcl>L</fcl><fcode>AREA</fcode></geoname>
+<geoname><toponymName>Europe</toponymName><name>Europe</name><lat>48.69096</lat><lng>9.14062</lng><geonameId>6255148</geonameId><countryCode/><fcl>L</fcl><fcode>CONT</fcode></geoname>
+<geoname><toponymName>Swiss Confederation</toponymName><name>Switzerland</name><lat>47.00016</lat><lng>8.01427</lng><geonameId>2658434</geonameId><countryCode>CH</countryCode><fcl>A</fcl><fcode>PCLI</fcode></geoname>
+<geoname><toponymName>Canton de Genève</toponymName><name>Geneva</name><lat>46.20222</lat><lng>6.14569</lng><geonameId>2660645</geonameId><countryCode>CH</countryCode><fcl>A</fcl><fcode>ADM1</fcode></geoname>
+<geoname><toponymName>Geneva</toponymName><name>Geneva</name><lat>46.21558</lat><lng>6.14622</lng><geonameId>6458783</geonameId><countryCode>CH</countryCode><fcl>A</fcl><fcode>ADM2</fcode></geoname>
+<geoname><toponymName>Genthod</toponymName><name>Genthod</name><lat>46.26751</lat><lng>6.15713</lng><geonameId>7285904</geonameId><countryCode>CH</countryCode><fcl>A</fcl><fcode>ADM3</fcode></geoname>
+</geonames>"""
+
+
+def test_resolve_geo_ids_with_stub_server():
+    """
+    Test resolve_geo_ids against a local stub server answering every hierarchy request with TEST_HIERARCHY_XML:
+    each distinct geoID must be fetched exactly once (plus one retry after a simulated 503),
+    and cached IDs must not be fetched at all.
+    """
+    global GEONAMES_API_URL, GEONAMES_CLIENT
+    requested_ids = []
+
+    class StubHierarchyHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested_ids.append(int(self.path.split("geonameId=")[1].split("&")[0]))
+            if requested_ids.count(1) == 1 and requested_ids[-1] == 1:
+                self.send_response(503) # first request of geoID 1 fails, the client must retry it
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = TEST_HIERARCHY_XML.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/xml")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), StubHierarchyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    temp_dir = tempfile.TemporaryDirectory()
+    previous_api_url, previous_client = GEONAMES_API_URL, GEONAMES_CLIENT
+    GEONAMES_API_URL = f"http://127.0.0.1:{server.server_port}/hierarchy"
+    GEONAMES_CLIENT = GeonamesClient(backoff_base=0.01)
+    geonames_dict_cache = GeonamesCache(os.path.join(temp_dir.name, "test_geonames_dictionary.sqlite"))
+    try:
+        # Arrange
+        df = pd.DataFrame({
+            "loc1 geoID": [test_geonameID, test_geonameID, "world"],
+            "loc2 geoID": [float(test_geonameID), 1, None],
+            "loc3 geoID": [None, 2, ""],
+            "loc4 geoID": [None, None, None],
+        })
+        geonames_dict_cache[2] = {"continent": "Europe"}
+
+        # Act
+        resolve_geo_ids(collect_unique_geo_ids(df), geonames_dict_cache)
+
+        # Assert
+        assert sorted(requested_ids) == [1, 1, test_geonameID], f"Test failed! Unexpected API requests: {requested_ids}."
+        assert GEONAMES_CLIENT.stats["retries"] == 1, f"Test failed! Expected 1 retry, got {GEONAMES_CLIENT.stats['retries']}."
+        assert geonames_dict_cache[test_geonameID]["ADM3"] == "Genthod", "Test failed! Hierarchy not parsed."
+        assert geonames_dict_cache[2] == {"continent": "Europe"}, "Test failed! Cached geoID was overwritten."
+    finally:
+        GEONAMES_API_URL, GEONAMES_CLIENT = previous_api_url, previous_client
+        geonames_dict_cache.close()
+        server.shutdown()
+        server.server_close()
+        temp_dir.cleanup()
@@ -0,0 +1,114 @@
+import json
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+
+# Persistent GeoNames dictionary (geonameId -> hierarchy dict) backed by SQLite.
+# Every new entry is written (and committed) on its own, so a crash loses at most the entry being written,
+# and lookups only read the requested key instead of loading the whole dictionary at startup.
+# The old "aux_geonames_ID_dictionary.xlsx" is imported once and can still be exported for human review.
+
+def cache_file_path_for(geoname_dictionary_file_path):
+    """
+    The SQLite file lives next to the Excel dictionary: aux_geonames_ID_dictionary.xlsx -> aux_geonames_ID_dictionary.sqlite
+    """
+    root, _ = os.path.splitext(geoname_dictionary_file_path)
+    return f"{root}.sqlite"
+
+
+class GeonamesCache:
+    """
+    Dict-like view of the persistent GeoNames dictionary, keyed by int geonameId.
+    Supports `geo_id in cache`, `cache[geo_id]`, `cache[geo_id] = result`, `cache.get(geo_id)` and len(cache),
+    so it can be passed wherever a plain geonames_dict_cache dict was used.
+    """
+
+    def __init__(self, cache_file_path, legacy_excel_file_path=None):
+        is_new = not os.path.exists(cache_file_path)
+        self.cache_file_path = cache_file_path
+        self._lock = threading.Lock()
+        self._memory = {}  # entries already read or written during this run
+        self._connection = sqlite3.connect(cache_file_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")  # readers never block on the writer, survives crashes
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS geonames (geonameId INTEGER PRIMARY KEY, hierarchy TEXT NOT NULL)")
+        self._connection.commit()
+
+        if is_new and legacy_excel_file_path and os.path.exists(legacy_excel_file_path):
+            self.import_excel(legacy_excel_file_path)
+
+    def __contains__(self, geo_id):
+        return self._read(geo_id) is not None
+
+    def __getitem__(self, geo_id):
+        result = self._read(geo_id)
+        if result is None:
+            raise KeyError(geo_id)
+        return result
+
+    def __setitem__(self, geo_id, result):
+        self.update({geo_id: result})
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM geonames").fetchone()[0]
+
+    def get(self, geo_id, default=None):
+        result = self._read(geo_id)
+        return default if result is None else result
+
+    def update(self, results):
+        """
+        Writes several entries in a single transaction.
+        Args:
+            results: dict geonameId -> hierarchy dict
+        """
+        rows = [(int(geo_id), json.dumps(result)) for geo_id, result in results.items()]
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO geonames (geonameId, hierarchy) VALUES (?, ?)", rows)
+            self._connection.commit()
+            for geo_id, result in results.items():
+                self._memory[int(geo_id)] = result
+
+    def _read(self, geo_id):
+        geo_id = int(geo_id)
+        with self._lock:
+            if geo_id not in self._memory:
+                row = self._connection.execute("SELECT hierarchy FROM geonames WHERE geonameId = ?", (geo_id,)).fetchone()
+                if row is None:
+                    return None
+                self._memory[geo_id] = json.loads(row[0])
+            return self._memory[geo_id]
+
+    def import_excel(self, excel_file_path):
+        """
+        One-off import of the legacy Excel dictionary (one row per geonameId, one column per attribute).
+        Empty cells are dropped so that they read back as missing keys, like a fresh API answer.
+        """
+        print(f"🔄 Importing GeoNames dictionary from {excel_file_path}...")
+        dictionary_df = pd.read_excel(excel_file_path, sheet_name=0).set_index("geonameId")
+        results = {}
+        for geo_id, row in dictionary_df.iterrows():
+            # .item() turns numpy scalars back into plain, JSON-serialisable python values
+            results[geo_id] = {key: (value.item() if hasattr(value, "item") else value)
+                               for key, value in row.items() if pd.notna(value)}
+        self.update(results)
+
+    def to_dataframe(self):
+        with self._lock:
+            rows = self._connection.execute("SELECT geonameId, hierarchy FROM geonames ORDER BY geonameId").fetchall()
+        return pd.DataFrame.from_dict({geo_id: json.loads(hierarchy) for geo_id, hierarchy in rows}, orient="index")
+
+    def export_to_excel(self, excel_file_path):
+        """
+        Writes the whole dictionary in the legacy Excel layout, for human review.
+        """
+        self.to_dataframe().reset_index().rename(columns={"index": "geonameId"}).to_excel(excel_file_path, index=False)
+        print(f"GeoNames dictionary exported to {excel_file_path}")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,171 @@
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# HTTP layer for the GeoNames web services: one pooled keep-alive session shared by all worker threads,
+# timeouts, retries with exponential backoff and jitter on transient failures,
+# and distinct errors for an exhausted quota (stop and wait for the next window) and transient failures.
+
+# https://www.geonames.org/export/webservice-exception.html
+GEONAMES_QUOTA_STATUS_CODES = {18, 19, 20}  # daily, hourly, weekly limit of credits exceeded
+GEONAMES_TRANSIENT_STATUS_CODES = {13, 22}  # database timeout, server overloaded
+GEONAMES_NOT_FOUND_STATUS_CODE = 11  # record does not exist
+
+
+class GeonamesAPIError(RuntimeError):
+    """Any failure of the GeoNames web services that is not worth retrying."""
+
+
+class GeonamesQuotaExceeded(GeonamesAPIError):
+    """The credits of the current (hourly, daily, weekly) window are exhausted."""
+
+
+class GeonamesTransientError(GeonamesAPIError):
+    """Server errors, timeouts or dropped connections that persisted through all retries."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    Holds at most `capacity` tokens, refilled continuously at `rate` tokens per second;
+    acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_geonames_rate_limiter(hourly_quota, burst=10):
+    """
+    Token bucket tuned so that no rolling hour can exceed the hourly quota:
+    `burst` requests may go out at once, the rest are spread evenly over the hour.
+    """
+    return TokenBucket(rate=(hourly_quota - burst) / 3600, capacity=burst)
+
+
+class GeonamesClient:
+    """
+    Args:
+        rate_limiter: optional TokenBucket, one token is taken per attempt (retries cost credits too)
+        pool_size: number of keep-alive connections, match it to the number of worker threads
+        timeout: (connect, read) timeout in seconds
+        max_retries: attempts after the first one for transient failures
+        backoff_base, backoff_max: the n-th retry waits about backoff_base * 2**n seconds (capped), with jitter
+    """
+
+    def __init__(self, rate_limiter=None, pool_size=4, timeout=(5, 30), max_retries=5, backoff_base=1.0, backoff_max=60.0):
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "transient_errors": 0, "quota_errors": 0,
+                      "total_latency_s": 0.0, "max_latency_s": 0.0}
+
+    def get_xml(self, url, params):
+        """
+        GETs url and returns the parsed XML root, retrying transient failures.
+        A GeoNames "record does not exist" status returns the (empty) root as is.
+
+        Raises:
+            GeonamesQuotaExceeded: credit limit of the current window met, not retried
+            GeonamesTransientError: still failing after max_retries retries
+            GeonamesAPIError: any other error reported by GeoNames (e.g. invalid user), not retried
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self._record(retries=1)
+                time.sleep(self._backoff(attempt))
+            try:
+                return self._attempt(url, params)
+            except GeonamesTransientError as e:
+                self._record(transient_errors=1)
+                print(f"⚠️ GeoNames attempt {attempt + 1}/{self.max_retries + 1} failed: {e}")
+                last_error = e
+            except GeonamesQuotaExceeded:
+                self._record(quota_errors=1)
+                raise
+        raise last_error
+
+    def _attempt(self, url, params):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise GeonamesTransientError(f"{type(e).__name__}: {e}") from e
+        finally:
+            self._record_latency(time.perf_counter() - start)
+
+        if response.status_code == 429 or response.status_code >= 500:
+            raise GeonamesTransientError(f"HTTP {response.status_code}")
+        if response.status_code >= 400:
+            raise GeonamesAPIError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+        try:
+            root = ET.fromstring(response.content)
+        except ET.ParseError as e:
+            raise GeonamesTransientError(f"unreadable answer ({e})") from e
+
+        status = root.find("status")
+        if status is not None:
+            message = status.attrib.get("message", "")
+            code = int(status.attrib.get("value", -1))
+            if code in GEONAMES_QUOTA_STATUS_CODES or "limit" in message.lower():
+                print(f"⚠️ {message}")
+                raise GeonamesQuotaExceeded(message)
+            if code in GEONAMES_TRANSIENT_STATUS_CODES:
+                raise GeonamesTransientError(message)
+            if code != GEONAMES_NOT_FOUND_STATUS_CODE:
+                raise GeonamesAPIError(message)
+        return root
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _record(self, **increments):
+        with self._stats_lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def _record_latency(self, latency):
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["total_latency_s"] += latency
+            self.stats["max_latency_s"] = max(self.stats["max_latency_s"], latency)
+
+    def stats_summary(self):
+        with self._stats_lock:
+            summary = dict(self.stats)
+        summary["mean_latency_s"] = summary["total_latency_s"] / summary["requests"] if summary["requests"] else 0.0
+        return summary
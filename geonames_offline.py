@@ -0,0 +1,182 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Offline replacement for http://api.geonames.org/hierarchy, built from the GeoNames dump
+# (https://download.geonames.org/export/dump/): allCountries.txt, hierarchy.txt and countryInfo.txt.
+#
+# The dump is indexed once into a compact on-disk structure:
+#   ids.npy      int32  geonameIds, sorted (binary-searched, memory-mapped)
+#   parents.npy  int32  geonameId of the parent of each id (0 for Earth)
+#   starts.npy / ends.npy  int64  byte range of each id's record in records.bin
+#   records.bin  utf-8 "toponymName\tname\tlat\tlng\tcountryCode" records
+# A lookup is then a binary search plus a few memory-mapped reads per hierarchy level.
+
+EARTH_GEONAME_ID = 6295630
+CONTINENT_GEONAME_IDS = {"AF": 6255146, "AS": 6255147, "EU": 6255148, "NA": 6255149,
+                         "OC": 6255151, "SA": 6255150, "AN": 6255152}
+RECORD_FIELDS = ["toponymName", "name", "lat", "lng", "countryCode"]
+
+# column positions in allCountries.txt (tab separated, no header)
+ALL_COUNTRIES_COLUMNS = {0: "geonameId", 1: "name", 4: "lat", 5: "lng", 7: "fcode", 8: "countryCode",
+                         10: "admin1", 11: "admin2", 12: "admin3"}
+CHUNK_SIZE = 500_000
+
+
+def read_country_info(country_info_file_path):
+    """
+    Returns a DataFrame indexed by ISO country code with the country "name", its "geonameId" and "continent" code
+    """
+    # comment="#" cannot be used: the postal code formats contain "#"
+    with open(country_info_file_path, encoding="utf-8") as country_info_file:
+        lines = [line for line in country_info_file if not line.startswith("#")]
+    country_info_df = pd.read_csv(io.StringIO("".join(lines)), sep="\t", header=None, dtype=str,
+                                  keep_default_na=False, usecols=[0, 4, 8, 16])
+    country_info_df.columns = ["countryCode", "name", "continent", "geonameId"]
+    country_info_df["geonameId"] = country_info_df["geonameId"].astype(int)
+    return country_info_df.set_index("countryCode")
+
+
+def read_all_countries(all_countries_file_path):
+    """
+    Streams allCountries.txt in chunks, only keeping the columns needed for the hierarchy
+    """
+    return pd.read_csv(all_countries_file_path, sep="\t", header=None, dtype=str, keep_default_na=False,
+                       usecols=list(ALL_COUNTRIES_COLUMNS), names=range(19), quoting=3, chunksize=CHUNK_SIZE)
+
+
+def admin_key(chunk, level):
+    key = chunk["countryCode"]
+    for admin_col in ["admin1", "admin2", "admin3"][:level]:
+        key = key + "|" + chunk[admin_col]
+    return key
+
+
+def build_offline_index(dump_dir, index_dir):
+    """
+    Indexes a GeoNames dump directory into index_dir (see the layout at the top of this file).
+    Parents come from hierarchy.txt (ADM links preferred); features missing from it are attached to their
+    deepest ADM1-3 division by admin codes, then to their country, countries to their continent and continents to Earth.
+
+    Args:
+        dump_dir: directory with allCountries.txt, hierarchy.txt and countryInfo.txt
+        index_dir: output directory, created if needed
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    all_countries_file_path = os.path.join(dump_dir, "allCountries.txt")
+
+    country_info_df = read_country_info(os.path.join(dump_dir, "countryInfo.txt"))
+    country_name_by_geoname_id = country_info_df.set_index("geonameId")["name"]
+    country_geoname_id_by_code = country_info_df["geonameId"]
+    continent_by_country_geoname_id = (country_info_df.set_index("geonameId")["continent"]
+                                       .map(CONTINENT_GEONAME_IDS))
+
+    hierarchy_df = pd.read_csv(os.path.join(dump_dir, "hierarchy.txt"), sep="\t", header=None,
+                               names=["parent", "child", "type"], dtype={"parent": int, "child": int, "type": str})
+    hierarchy_df["is_adm"] = hierarchy_df["type"].eq("ADM")
+    parent_by_child = (hierarchy_df.sort_values("is_adm", kind="stable")
+                       .drop_duplicates("child", keep="last").set_index("child")["parent"])
+
+    # pass 1: admin divisions, to attach features that hierarchy.txt does not cover
+    print("🔄 Indexing GeoNames admin divisions...")
+    admin_ids_by_level = {1: [], 2: [], 3: []}
+    for chunk in read_all_countries(all_countries_file_path):
+        chunk.columns = list(ALL_COUNTRIES_COLUMNS.values())
+        for level in admin_ids_by_level:
+            adm_rows = chunk[chunk["fcode"] == f"ADM{level}"]
+            admin_ids_by_level[level].append(pd.Series(adm_rows["geonameId"].astype(int).values,
+                                                       index=admin_key(adm_rows, level).values))
+    admin_ids_by_level = {level: pd.concat(parts)[lambda s: ~s.index.duplicated()]
+                          for level, parts in admin_ids_by_level.items()}
+
+    # pass 2: records and parents
+    print("🔄 Indexing GeoNames features...")
+    ids, parents, starts, ends = [], [], [], []
+    offset = 0
+    with open(os.path.join(index_dir, "records.bin"), "wb") as records_file:
+        for chunk in read_all_countries(all_countries_file_path):
+            chunk.columns = list(ALL_COUNTRIES_COLUMNS.values())
+            chunk_ids = chunk["geonameId"].astype(int)
+
+            parent = chunk_ids.map(parent_by_child)
+            for level in [3, 2, 1]:
+                admin_parent = admin_key(chunk, level).map(admin_ids_by_level[level])
+                admin_parent = admin_parent.where(admin_parent != chunk_ids)  # a division is not its own parent
+                parent = parent.fillna(admin_parent)
+            parent = parent.fillna(chunk_ids.map(continent_by_country_geoname_id))
+            parent = parent.fillna(chunk["countryCode"].map(country_geoname_id_by_code).where(
+                lambda country_id: country_id != chunk_ids))
+            parent = parent.where(~chunk_ids.isin(CONTINENT_GEONAME_IDS.values()), EARTH_GEONAME_ID)
+            parent = parent.where(chunk_ids != EARTH_GEONAME_ID, 0)
+            parent = parent.fillna(EARTH_GEONAME_ID)
+
+            # countries carry their English name (as the API does), everything else its dump name
+            name = chunk_ids.map(country_name_by_geoname_id).fillna(chunk["name"])
+            records = (chunk["name"] + "\t" + name + "\t" + chunk["lat"] + "\t" + chunk["lng"] + "\t"
+                       + chunk["countryCode"]).str.encode("utf-8")
+            lengths = records.str.len().to_numpy(dtype=np.int64)
+            chunk_ends = offset + np.cumsum(lengths)
+            records_file.write(b"".join(records))
+
+            ids.append(chunk_ids.to_numpy(dtype=np.int32))
+            parents.append(parent.to_numpy(dtype=np.int32))
+            starts.append(chunk_ends - lengths)
+            ends.append(chunk_ends)
+            offset = int(chunk_ends[-1]) if len(chunk_ends) else offset
+
+    ids = np.concatenate(ids)
+    order = np.argsort(ids, kind="stable")
+    np.save(os.path.join(index_dir, "ids.npy"), ids[order])
+    np.save(os.path.join(index_dir, "parents.npy"), np.concatenate(parents)[order])
+    np.save(os.path.join(index_dir, "starts.npy"), np.concatenate(starts)[order])
+    np.save(os.path.join(index_dir, "ends.npy"), np.concatenate(ends)[order])
+    print(f"✅ Indexed {len(ids)} GeoNames features into {index_dir}")
+
+
+class GeonamesOfflineIndex:
+    """
+    Read-only, memory-mapped view of an index built by build_offline_index(). Safe to share between threads.
+    """
+
+    def __init__(self, index_dir):
+        self.ids = np.load(os.path.join(index_dir, "ids.npy"), mmap_mode="r")
+        self.parents = np.load(os.path.join(index_dir, "parents.npy"), mmap_mode="r")
+        self.starts = np.load(os.path.join(index_dir, "starts.npy"), mmap_mode="r")
+        self.ends = np.load(os.path.join(index_dir, "ends.npy"), mmap_mode="r")
+        self.records = np.memmap(os.path.join(index_dir, "records.bin"), dtype=np.uint8, mode="r")
+
+    def _position(self, geo_id):
+        position = int(np.searchsorted(self.ids, geo_id))
+        if position < len(self.ids) and self.ids[position] == geo_id:
+            return position
+        return None
+
+    def _record(self, position):
+        record = bytes(self.records[self.starts[position]:self.ends[position]]).decode("utf-8")
+        element = dict(zip(RECORD_FIELDS, record.split("\t")))
+        element["geonameId"] = str(int(self.ids[position]))
+        return element
+
+    def hierarchy(self, geo_id, max_depth=20):
+        """
+        Same elements, in the same order (Earth first, geo_id last), as the <geoname> list of the hierarchy API.
+        Each element is a dict with the keys toponymName, name, lat, lng, countryCode and geonameId.
+
+        Returns: list of dicts, empty if geo_id is not in the dump
+        """
+        elements = []
+        position = self._position(int(geo_id))
+        while position is not None and len(elements) < max_depth:
+            elements.append(self._record(position))
+            parent_id = int(self.parents[position])
+            position = self._position(parent_id) if parent_id else None
+        return elements[::-1]
+
+
+if __name__ == "__main__":
+    # working directory
+    wdir = 'C:/Users/aolliaro/OneDrive - Nexus365/DPhil data and analysis/phd_analysis_data'
+    build_offline_index(os.path.join(wdir, "geonames_dump"), os.path.join(wdir, "geonames_offline_index"))
@@ -3,7 +3,7 @@ from matplotlib import pyplot as plt
 from wordcloud import WordCloud
 
 
-def create_wordcloud(text_dataframe, output_path, title):
+def create_wordcloud(text_dataframe, output_path, title, show_plot=True):
 
     # one data cleanup step has been done by hand and a second in the data_cleanup.py
     text = ';'.join(text_dataframe.dropna().astype(str))
@@ -38,7 +38,8 @@ def create_wordcloud(text_dataframe, output_path, title):
     plt.axis('off')
     plt.title(title)
     plt.savefig(output_path, dpi=200)  # dpi aligns with figsize; scale controls pixel density
-    plt.show()
+    if show_plot:
+        plt.show()
     plt.close()
 
     return wordcloud
@@ -0,0 +1,209 @@
+import os
+
+import pandas as pd
+
+from artifacts import artifact_file_name, read_artifact, write_artifact
+from edge_timeline import GEPHI_INTERVAL_COLUMN
+
+
+# Writes the nodes and edges tables as GEXF (Gephi's own format) or GraphML, as an alternative to the Excel workbook:
+# openpyxl builds the whole workbook in memory and Gephi is slow to import it.
+# The XML is streamed: the tables are converted chunk by chunk (all the rows of a chunk at once, column by column)
+# and each chunk of lines is written straight to the file, so the document is never held in memory.
+# GEXF 1.2 (https://gexf.net/schema.html): with a Gephi "Interval" column (edge_timeline.add_gephi_intervals), the
+# graph is dynamic and each node and edge gets its start and end dates, for Gephi's timeline.
+
+CHUNK_ROWS = 10000
+GEXF_NAMESPACE = "http://www.gexf.net/1.2draft"
+GRAPHML_NAMESPACE = "http://graphml.graphdrawing.org/xmlns"
+EXPORT_DATE_FORMAT = "%Y-%m-%d"
+# columns that are part of the node/edge element itself rather than attributes
+NODE_LABEL_COLUMNS = ["Label", "country_name"] # first one present
+EDGE_ELEMENT_COLUMNS = ["ID", "Source", "Target", "Label", "Weight"]
+
+
+def xml_text(values):
+    """
+    Series of values -> Series of XML-escaped text (also usable in attribute values); dates without time
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        text = values.dt.strftime(EXPORT_DATE_FORMAT)
+    elif pd.api.types.is_bool_dtype(values):
+        text = values.map({True: "true", False: "false"})
+    else:
+        text = values.astype(object).astype(str)
+    return (text.str.replace("&", "&amp;", regex=False).str.replace("<", "&lt;", regex=False)
+            .str.replace(">", "&gt;", regex=False).str.replace('"', "&quot;", regex=False)
+            .str.replace(r"[\x00-\x08\x0b\x0c\x0e-\x1f]", "", regex=True))
+
+
+def attribute_type(values):
+    """
+    GEXF/GraphML type of a column, from its values for object columns (e.g. the coordinates of construct_nodes)
+    """
+    inferred = pd.api.types.infer_dtype(values, skipna=True)
+    if inferred == "boolean":
+        return "boolean"
+    if inferred == "integer":
+        return "long"
+    if inferred in ["floating", "mixed-integer-float", "decimal"]:
+        return "double"
+    return "string"
+
+
+def cells(values, template):
+    """
+    One XML fragment per row: template with {} replaced by the escaped value, "" where the value is missing
+    """
+    before, after = template.split("{}")
+    return (before + xml_text(values) + after).where(values.notna(), "")
+
+
+def interval_dates(intervals):
+    """
+    Gephi "<[2019-02-01, 2019-03-01]>" cells -> start and end dates (text), None where there is no interval
+    """
+    parts = intervals.astype(object).astype(str).str.extract(r"<\[\s*([^,\]]+?)\s*,\s*([^\]]+?)\s*\]>")
+    return parts[0], parts[1]
+
+
+def node_labels(nodes_df):
+    for col in NODE_LABEL_COLUMNS:
+        if col in nodes_df.columns:
+            return nodes_df[col].astype(object).where(nodes_df[col].notna(), nodes_df["ID"])
+    return nodes_df["ID"]
+
+
+def write_chunks(output_file, df, chunk_rows, lines_of_chunk):
+    for chunk_start in range(0, len(df), chunk_rows):
+        lines = lines_of_chunk(df.iloc[chunk_start:chunk_start + chunk_rows])
+        output_file.write("".join(lines.to_numpy(dtype=object).tolist()))
+
+
+def write_gexf(nodes_df, edges_df, file_path, chunk_rows=CHUNK_ROWS):
+    """
+    Streams the network to a GEXF file. Columns become node/edge attributes (the edge Label and Weight are written
+    as the edge's own label and weight); missing values are left out.
+
+    Args:
+        nodes_df: nodes table with an ID column, labelled by its Label or country_name column
+        edges_df: edges table with ID, Source and Target columns
+        file_path: .gexf file to write
+        chunk_rows: rows converted and written at a time
+    """
+    dynamic = GEPHI_INTERVAL_COLUMN in nodes_df.columns or GEPHI_INTERVAL_COLUMN in edges_df.columns
+    node_attributes = [col for col in nodes_df.columns if col not in ["ID", GEPHI_INTERVAL_COLUMN]]
+    edge_attributes = [col for col in edges_df.columns if col not in EDGE_ELEMENT_COLUMNS + [GEPHI_INTERVAL_COLUMN]]
+
+    def element_cells(df, attributes):
+        # the attvalues, and the start/end attributes of the element when it has an interval
+        attvalues = pd.Series("", index=df.index, dtype=object)
+        for i, col in enumerate(attributes):
+            attvalues = attvalues + cells(df[col], f'<attvalue for="{i}" value="{{}}"/>')
+        attvalues = ("<attvalues>" + attvalues + "</attvalues>").where(attvalues != "", "")
+        spell = pd.Series("", index=df.index, dtype=object)
+        if GEPHI_INTERVAL_COLUMN in df.columns:
+            start, end = interval_dates(df[GEPHI_INTERVAL_COLUMN])
+            spell = cells(start, ' start="{}"') + cells(end, ' end="{}"')
+        return attvalues, spell
+
+    def node_lines(chunk):
+        attvalues, spell = element_cells(chunk, node_attributes)
+        return ('<node id="' + xml_text(chunk["ID"]) + '" label="' + xml_text(node_labels(chunk)) + '"' + spell + ">"
+                + attvalues + "</node>\n")
+
+    def edge_lines(chunk):
+        attvalues, spell = element_cells(chunk, edge_attributes)
+        label = cells(chunk["Label"], ' label="{}"') if "Label" in chunk.columns else ""
+        weight = cells(chunk["Weight"], ' weight="{}"') if "Weight" in chunk.columns else ""
+        return ('<edge id="' + xml_text(chunk["ID"]) + '" source="' + xml_text(chunk["Source"]) + '" target="'
+                + xml_text(chunk["Target"]) + '"' + label + weight + spell + ">" + attvalues + "</edge>\n")
+
+    with open(file_path, "w", encoding="utf-8", newline="\n") as output_file:
+        output_file.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<gexf xmlns="{GEXF_NAMESPACE}" version="1.2">\n')
+        output_file.write(f'<graph defaultedgetype="directed" mode="{"dynamic" if dynamic else "static"}"'
+                          f'{' timeformat="date"' if dynamic else ""}>\n')
+        for attribute_class, df, attributes in [("node", nodes_df, node_attributes), ("edge", edges_df, edge_attributes)]:
+            output_file.write(f'<attributes class="{attribute_class}">\n')
+            for i, col in enumerate(attributes):
+                title = xml_text(pd.Series([col])).iloc[0]
+                output_file.write(f'<attribute id="{i}" title="{title}" type="{attribute_type(df[col])}"/>\n')
+            output_file.write("</attributes>\n")
+        output_file.write("<nodes>\n")
+        write_chunks(output_file, nodes_df, chunk_rows, node_lines)
+        output_file.write("</nodes>\n<edges>\n")
+        write_chunks(output_file, edges_df, chunk_rows, edge_lines)
+        output_file.write("</edges>\n</graph>\n</gexf>\n")
+    print(f"GEXF network saved to {file_path}")
+
+
+def write_graphml(nodes_df, edges_df, file_path, chunk_rows=CHUNK_ROWS):
+    """
+    Streams the network to a GraphML file, every column (but the IDs and endpoints) as a data key;
+    missing values are left out.
+
+    Args: see write_gexf
+    """
+    node_keys = [col for col in nodes_df.columns if col != "ID"]
+    edge_keys = [col for col in edges_df.columns if col not in ["ID", "Source", "Target"]]
+
+    def data_cells(df, keys, prefix):
+        data = pd.Series("", index=df.index, dtype=object)
+        for i, col in enumerate(keys):
+            data = data + cells(df[col], f'<data key="{prefix}{i}">{{}}</data>')
+        return data
+
+    def node_lines(chunk):
+        return '<node id="' + xml_text(chunk["ID"]) + '">' + data_cells(chunk, node_keys, "n") + "</node>\n"
+
+    def edge_lines(chunk):
+        return ('<edge id="' + xml_text(chunk["ID"]) + '" source="' + xml_text(chunk["Source"]) + '" target="'
+                + xml_text(chunk["Target"]) + '">' + data_cells(chunk, edge_keys, "e") + "</edge>\n")
+
+    with open(file_path, "w", encoding="utf-8", newline="\n") as output_file:
+        output_file.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<graphml xmlns="{GRAPHML_NAMESPACE}">\n')
+        for element, df, keys, prefix in [("node", nodes_df, node_keys, "n"), ("edge", edges_df, edge_keys, "e")]:
+            for i, col in enumerate(keys):
+                name = xml_text(pd.Series([col])).iloc[0]
+                output_file.write(f'<key id="{prefix}{i}" for="{element}" attr.name="{name}" '
+                                  f'attr.type="{attribute_type(df[col])}"/>\n')
+        output_file.write('<graph id="G" edgedefault="directed">\n')
+        write_chunks(output_file, nodes_df, chunk_rows, node_lines)
+        write_chunks(output_file, edges_df, chunk_rows, edge_lines)
+        output_file.write("</graph>\n</graphml>\n")
+    print(f"GraphML network saved to {file_path}")
+
+
+def write_excel(nodes_df, edges_df, file_path, chunk_rows=CHUNK_ROWS):
+    write_artifact({"nodes": nodes_df, "edges": edges_df}, file_path)
+    print(f"Excel network saved to {file_path}")
+
+
+NETWORK_WRITERS = {".gexf": write_gexf, ".graphml": write_graphml, ".xlsx": write_excel}
+
+
+def export_network(data, artifact_file_path, formats):
+    """
+    Writes the network next to its artifact, in each of the formats: "1.6_nodes_edges_noloops_<ts>.gexf"...
+
+    Args:
+        data: dict with the "nodes" and "edges" DataFrames
+        artifact_file_path: the (timestamped) artifact the exports go next to
+        formats: extensions among NETWORK_WRITERS (".gexf", ".graphml", ".xlsx")
+
+    Returns: list of written paths
+    """
+    root, _ = os.path.splitext(artifact_file_path)
+    export_file_paths = []
+    for ext in formats:
+        NETWORK_WRITERS[ext](data["nodes"], data["edges"], f"{root}{ext}")
+        export_file_paths.append(f"{root}{ext}")
+    return export_file_paths
+
+
+if __name__ == "__main__":
+    # working directory
+    wdir = 'C:/Users/aolliaro/OneDrive - Nexus365/DPhil data and analysis/phd_analysis_data'
+    network_file_path = os.path.join(wdir, artifact_file_name("1.6_nodes_edges_noloops.xlsx"))
+    network = {table_name: read_artifact(network_file_path, table_name) for table_name in ["nodes", "edges"]}
+    export_network(network, network_file_path, [".gexf", ".graphml"])
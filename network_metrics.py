@@ -1,6 +1,20 @@
 import networkx as nx
 import itertools
 
+
+def graph_from_network(network, keep_self_loops=False):
+    """
+    Undirected networkx graph of an encoded network (see data2network.encode_network).
+    Nodes are the integer node codes (network["node_ids"][code] gives back the ID, network["nodes"] the attributes),
+    so that the graph copies made by kpp_neg stay small.
+    """
+    G = nx.Graph()
+    G.add_nodes_from(range(len(network["node_ids"])))
+    source, target = network["source"].tolist(), network["target"].tolist()
+    G.add_edges_from((s, t) for s, t in zip(source, target) if keep_self_loops or s != t)
+    return G
+
+
 def kpp_neg(G, k):
     """
     KPP-NEG: Find k nodes whose removal maximally increases fragmentation.
@@ -0,0 +1,372 @@
+"""
+Incremental step scheduler for the data pipeline, in the spirit of `make`.
+
+Each step declares the files it reads ("inputs") and writes ("outputs"), relative to the analysis directory,
+the modules its code lives in ("modules") and the values of the settings it reads ("settings"). The steps are ordered as a DAG (a step runs after the steps
+producing its inputs) and a step is skipped when the content hashes of its inputs and of its code (and settings)
+are the same as on its last successful run and its outputs still exist.
+The hashes of the last successful runs are kept in a JSON state file.
+
+In-memory mode chains the steps through a dict artifact name -> data instead of re-reading each intermediate file:
+the steps persist their outputs in the background and the fingerprints are recorded once all writes are done.
+
+With max_workers > 1, independent branches of the DAG (e.g. the exploratory analysis and the network construction,
+which both only read 1.3) run concurrently in a pool of processes. Each step writes its own files, so the outputs
+do not depend on the scheduling; the log of each step running in the pool is captured and printed as one block.
+
+Every step that runs is measured (wall and CPU time, peak RSS while it runs, the counters of step_metrics.py such as
+rows and bytes read or GeoNames API calls, and the size of its outputs); with manifest_dir, a run manifest is written
+as JSON.
+"""
+
+import contextlib
+import cProfile
+import hashlib
+import importlib.util
+import inspect
+import io
+import json
+import multiprocessing
+import os
+import time
+import traceback
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+import step_metrics
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_content_hash(file_path):
+    """
+    sha256 of the file (or directory) content. For .xlsx files, the docProps/ parts (creation and modification times)
+    are left out, so that re-saving identical data does not look like a change to the steps downstream.
+    """
+    digest = hashlib.sha256()
+    if os.path.isdir(file_path):  # multi-table artifacts are directories
+        for part_name in sorted(os.listdir(file_path)):
+            digest.update(part_name.encode("utf-8"))
+            digest.update(file_content_hash(os.path.join(file_path, part_name)).encode("utf-8"))
+        return digest.hexdigest()
+    if file_path.endswith(".xlsx") and zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as workbook:
+            for part_name in sorted(workbook.namelist()):
+                if not part_name.startswith("docProps/"):
+                    digest.update(part_name.encode("utf-8"))
+                    digest.update(workbook.read(part_name))
+        return digest.hexdigest()
+
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def step_code_version(step):
+    """
+    Hash of the step function's source, of the source files of the modules it declares
+    (found without importing them) and of the values of its settings.
+    """
+    digest = hashlib.sha256(inspect.getsource(step["func"]).encode("utf-8"))
+    for module_name in step.get("modules", []):
+        spec = importlib.util.find_spec(module_name)
+        if spec is not None and spec.origin and os.path.exists(spec.origin):
+            digest.update(file_content_hash(spec.origin).encode("utf-8"))
+    digest.update(json.dumps(step.get("settings", {}), sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def step_dependencies(steps):
+    """
+    Returns: dict step key -> set of the keys of the steps producing its inputs
+
+    Raises:
+        ValueError: two steps write the same output
+    """
+    producer_by_output = {}
+    for key, step in steps.items():
+        for output in step["outputs"]:
+            if output in producer_by_output:
+                raise ValueError(f"'{output}' is an output of both step {producer_by_output[output]} and step {key}")
+            producer_by_output[output] = key
+    return {key: {producer_by_output[i] for i in step["inputs"] if i in producer_by_output} - {key}
+            for key, step in steps.items()}
+
+
+def order_steps(steps):
+    """
+    Topological order of the steps: every step comes after the steps that produce its inputs,
+    otherwise the declaration order is kept.
+
+    Args:
+        steps: dict step key -> step dict with "func", "inputs", "outputs" and optional "modules"
+
+    Returns: list of step keys
+
+    Raises:
+        ValueError: two steps write the same output, or the dependencies contain a cycle
+    """
+    dependencies = step_dependencies(steps)
+    ordered = []
+    while len(ordered) < len(steps):
+        ready = [key for key in steps if key not in ordered and dependencies[key] <= set(ordered)]
+        if not ready:
+            raise ValueError(f"Cyclic dependencies between steps {[key for key in steps if key not in ordered]}")
+        ordered.append(ready[0])
+    return ordered
+
+
+def load_state(state_file_path):
+    if os.path.exists(state_file_path):
+        with open(state_file_path, encoding="utf-8") as state_file:
+            return json.load(state_file)
+    return {}
+
+
+def save_state(state_file_path, state):
+    temp_file_path = f"{state_file_path}.tmp"
+    with open(temp_file_path, "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file, indent=1)
+    os.replace(temp_file_path, state_file_path)
+
+
+def step_fingerprint(step, base_dir):
+    """
+    Returns: dict with the hash of each input and of the code, or None if an input is missing
+    """
+    input_hashes = {}
+    for input_name in step["inputs"]:
+        input_path = os.path.join(base_dir, input_name)
+        if not os.path.exists(input_path):
+            return None
+        input_hashes[input_name] = file_content_hash(input_path)
+    return {"inputs": input_hashes, "code": step_code_version(step)}
+
+
+def is_up_to_date(step, fingerprint, previous_state, base_dir):
+    return (previous_state is not None
+            and previous_state.get("inputs") == fingerprint["inputs"]
+            and previous_state.get("code") == fingerprint["code"]
+            and all(os.path.exists(os.path.join(base_dir, output)) for output in step["outputs"]))
+
+
+def outputs_exist(step, base_dir):
+    return all(os.path.exists(os.path.join(base_dir, output)) for output in step["outputs"])
+
+
+def run_measured_step(func, memory, profile_file_path=None):
+    """
+    Calls the step function and measures it, optionally under cProfile (stats dumped to profile_file_path,
+    to be read with pstats or snakeviz).
+
+    Returns: (what func returned, dict of metrics)
+    """
+    counters_before = step_metrics.snapshot()
+    profiler = cProfile.Profile() if profile_file_path else None
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        with step_metrics.PeakRssSampler() as rss_sampler:
+            completed = func(memory) if memory is not None else func()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file_path)
+    metrics = {"wall_time_s": round(time.perf_counter() - wall_start, 3),
+               "cpu_time_s": round(time.process_time() - cpu_start, 3),  # all threads of the process
+               "peak_rss_bytes": rss_sampler.peak,  # while the step ran
+               "process_peak_rss_bytes": step_metrics.peak_rss_bytes()}  # since the process started (earlier steps too)
+    metrics.update(step_metrics.difference(step_metrics.snapshot(), counters_before))
+    return completed, metrics
+
+
+def run_step_in_worker(func, memory, flush, profile_file_path=None):
+    """
+    Runs a step in a pool process, with its output captured.
+    The in-memory outputs are only handed back once flush() has written them, as the worker may exit afterwards.
+
+    Returns: (what func returned, the in-memory dict, captured log, formatted exception or None, dict of metrics)
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            completed, metrics = run_measured_step(func, memory, profile_file_path)
+            if flush is not None:
+                flush()
+        except Exception:
+            return None, memory, log.getvalue(), traceback.format_exc(), {}
+    return completed, memory, log.getvalue(), None, metrics
+
+
+def write_manifest(manifest_dir, manifest):
+    """
+    Returns: path to the timestamped JSON manifest
+    """
+    manifest_file_path = os.path.join(manifest_dir, f"run_manifest_{datetime.now().strftime('%Y%m%d%H%M%S')}.json")
+    with open(manifest_file_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    print(f"📋 Run manifest saved to {manifest_file_path}")
+    return manifest_file_path
+
+
+def print_step_log(name, log):
+    print(f"──────── {name} ────────")
+    print(log.rstrip("\n"))
+    print(f"──────── end of {name} ────────")
+
+
+def run_pipeline(steps, base_dir, state_file_path, selected_steps=None, force=False, in_memory=False, flush=None,
+                 max_workers=1, manifest_dir=None, profile_dir=None):
+    """
+    Runs the selected steps in dependency order, skipping those whose inputs and code have not changed.
+
+    Args:
+        steps: dict step key -> step dict with "func" (called without arguments, or with the in-memory dict, may return False
+            when it could not finish, e.g. paused on the API limit), "inputs", "outputs" (file names relative to base_dir)
+            and optional "modules" (names of the modules holding the step's code, including the ones it only uses
+            indirectly; they are not imported here), "settings" (dict of the values of the module-level settings the
+            step reads, a change reruns it)
+            and "preflight" (checks called without arguments, once per run, before the first step listing them runs,
+            e.g. an API health check for the steps that need the network)
+        base_dir: directory the input and output names are relative to
+        state_file_path: JSON file with the fingerprints of the last successful runs
+        selected_steps: keys of the steps that may run (default: all)
+        force: run the selected steps even when they are up to date
+        in_memory: call each "func" with a dict artifact name -> data, shared by all steps of the run, in which
+            the steps leave their outputs for the next ones. A step reading an output regenerated during the run
+            always runs (its file may not be written yet)
+        flush: in-memory mode, called without arguments once all steps ran; returns when all outputs are written
+        max_workers: > 1 runs the steps whose upstream steps are done concurrently, in that many processes
+            ("spawn" start method everywhere, as on Windows: the step functions must be importable module-level functions)
+        manifest_dir: write the metrics of the run to a timestamped run_manifest_*.json in this directory
+        profile_dir: also run the steps under cProfile and dump one <step name>_<timestamp>.prof per step in this directory
+
+    Returns: dict step key -> "ran", "skipped", "incomplete" or "missing inputs"
+
+    Raises:
+        RuntimeError: a step running in the pool raised an exception (its traceback is printed with its log)
+    """
+    state = load_state(state_file_path)
+    outcome = {}
+    memory = {} if in_memory else None
+    regenerated = set()  # outputs of the steps that ran (in-memory mode)
+    fingerprints = {}
+    dependencies = step_dependencies(steps)
+    pending = [key for key in order_steps(steps) if selected_steps is None or key in selected_steps]
+    running = {}  # future -> step key
+    preflights_done = []
+    metrics = {}  # step key -> metrics of the steps that ran
+    started = datetime.now()
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def start_step(key):
+        """
+        Returns the step's result if it ran in this process, None if it was skipped or submitted to the pool
+        """
+        step = steps[key]
+        name = step.get("name", str(key))
+        if not any(i in regenerated for i in step["inputs"]):
+            fingerprints[key] = step_fingerprint(step, base_dir)
+            if fingerprints[key] is None:
+                print(f"❌ Step {name}: missing inputs {step['inputs']}, skipping it.")
+                outcome[key] = "missing inputs"
+                return None
+            if not force and is_up_to_date(step, fingerprints[key], state.get(name), base_dir):
+                print(f"⏭️ Step {name}: inputs and code unchanged, skipping it.")
+                outcome[key] = "skipped"
+                return None
+
+        for check in step.get("preflight", []):
+            if check not in preflights_done:
+                check()
+                preflights_done.append(check)
+
+        profile_file_path = (os.path.join(profile_dir, f"{name}_{datetime.now().strftime('%Y%m%d%H%M%S')}.prof")
+                             if profile_dir else None)
+        if executor is None:
+            completed, step_run_metrics = run_measured_step(step["func"], memory, profile_file_path)
+            return completed, memory, None, None, step_run_metrics
+        step_memory = None if memory is None else {i: memory[i] for i in step["inputs"] if i in memory}
+        print(f"🔀 Step {name} started in the process pool.")
+        running[executor.submit(run_step_in_worker, step["func"], step_memory, flush, profile_file_path)] = key
+        return None
+
+    def finish_step(key, result):
+        step = steps[key]
+        name = step.get("name", str(key))
+        completed, step_memory, log, error, metrics[key] = result
+        if log is not None:
+            print_step_log(name, log)
+        if error is not None:
+            print(error)
+            raise RuntimeError(f"Step {name} failed, see its log above.")
+
+        if memory is None:
+            if completed is False or not outputs_exist(step, base_dir):
+                print(f"⚠️ Step {name} did not produce all of {step['outputs']}, it will run again next time.")
+                outcome[key] = "incomplete"
+                return
+            state[name] = fingerprints[key]
+            save_state(state_file_path, state)
+            metrics[key]["bytes_written"] = sum(step_metrics.path_size(os.path.join(base_dir, output))
+                                                for output in step["outputs"])
+        else:
+            if completed is False:
+                print(f"⚠️ Step {name} did not complete, it will run again next time.")
+                outcome[key] = "incomplete"
+                return
+            memory.update({output: step_memory[output] for output in step["outputs"] if output in step_memory})
+            regenerated.update(step["outputs"])
+        outcome[key] = "ran"
+
+    executor = (ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn"))
+                if max_workers > 1 else None)
+    try:
+        while pending or running:
+            waiting_for = set(pending) | set(running.values())
+            for key in [key for key in pending if not dependencies[key] & waiting_for]:
+                pending.remove(key)
+                result = start_step(key)
+                if result is not None:
+                    finish_step(key, result)
+            if running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=lambda f: list(steps).index(running[f])):
+                    finish_step(running.pop(future), future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    if memory is not None:
+        if flush is not None:
+            flush()
+        # fingerprinted from the written files, which hold the data the steps were handed
+        for key, step_outcome in outcome.items():
+            step = steps[key]
+            name = step.get("name", str(key))
+            if step_outcome != "ran":
+                continue
+            fingerprint = step_fingerprint(step, base_dir)
+            if fingerprint is None or not outputs_exist(step, base_dir):
+                print(f"⚠️ Step {name} did not produce all of {step['outputs']}, it will run again next time.")
+                outcome[key] = "incomplete"
+                continue
+            state[name] = fingerprint
+            metrics[key]["bytes_written"] = sum(step_metrics.path_size(os.path.join(base_dir, output))
+                                                for output in step["outputs"])
+        save_state(state_file_path, state)
+
+    if manifest_dir:
+        write_manifest(manifest_dir, {
+            "started": started.isoformat(timespec="seconds"),
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "in_memory": in_memory,
+            "max_workers": max_workers,
+            "steps": {steps[key].get("name", str(key)): {"outcome": step_outcome, **metrics.get(key, {})}
+                      for key, step_outcome in outcome.items()},
+        })
+    return outcome
@@ -1,7 +1,7 @@
 import plotly.graph_objects as go
 
 
-def create_and_plot_sankey_diagram_phd_data(data, output_path):
+def create_and_plot_sankey_diagram_phd_data(data, output_path, show_plot=True):
     years = ['2018', '2019', '2020', '2021', '2022']
     years_count = len(years)
     # Define the Sankey labels BASED ON THE ANALYSIS DATA 2018 TO 2022
@@ -62,7 +62,8 @@ def create_and_plot_sankey_diagram_phd_data(data, output_path):
         title_font_size=20,  # Increased title font size
         font=dict(size=15)  # Increased font size for labels
     )
-    fig.show()
+    if show_plot:
+        fig.show()
 
     fig.update_layout(title_text="Article and Routes Distribution Flow Per Year")
     fig.write_html(output_path)
@@ -0,0 +1,119 @@
+import os
+import sys
+import threading
+from collections import Counter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # optional, only used for the peak RSS on Windows
+    psutil = None
+
+
+# Process-wide counters that the pipeline code increments (rows and bytes read, GeoNames API calls, cache hits...).
+# pipeline_scheduler takes a snapshot before and after each step, in the process running the step,
+# and reports the difference in the run manifest.
+
+RSS_SAMPLE_INTERVAL_S = 0.05 # how often PeakRssSampler reads the resident memory
+
+_counters = Counter()
+_lock = threading.Lock()
+
+
+def count(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def snapshot():
+    with _lock:
+        return dict(_counters)
+
+
+def difference(after, before):
+    """
+    Counters incremented between two snapshots, with a "<x>_cache_hit_ratio" for each "<x>_lookups"/"<x>_cache_hits" pair
+    (only where the "<x>_cache_hits" counter exists)
+    """
+    delta = {name: value - before.get(name, 0) for name, value in after.items() if value != before.get(name, 0)}
+    for name in list(delta):
+        prefix = name[:-len("_lookups")]
+        if name.endswith("_lookups") and f"{prefix}_cache_hits" in after:
+            delta[f"{prefix}_cache_hit_ratio"] = round(delta.get(f"{prefix}_cache_hits", 0) / delta[name], 4)
+    return delta
+
+
+def peak_rss_bytes():
+    """
+    High-water mark of the resident memory of this process so far (None if it cannot be measured)
+    """
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == "darwin" else max_rss * 1024  # bytes on macOS, kilobytes on Linux
+    if psutil is not None:
+        memory_info = psutil.Process().memory_info()
+        return getattr(memory_info, "peak_wset", memory_info.rss)
+    return None
+
+
+def current_rss_bytes():
+    """
+    Resident memory of this process now (None if it cannot be measured)
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return None
+
+
+class PeakRssSampler:
+    """
+    Peak resident memory of the process while a block of code (a step) runs, unlike peak_rss_bytes, which is the
+    high-water mark since the process started. The resident memory is sampled in a thread every interval_s; if the
+    process high-water mark rose during the block, that new mark was reached during it and is taken as its peak.
+    """
+
+    def __init__(self, interval_s=RSS_SAMPLE_INTERVAL_S):
+        self.interval_s = interval_s
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_until_stopped, daemon=True)
+
+    def _sample(self):
+        rss = current_rss_bytes()
+        if rss is not None:
+            self.peak = rss if self.peak is None else max(self.peak, rss)
+
+    def _sample_until_stopped(self):
+        while not self._stop.wait(self.interval_s):
+            self._sample()
+
+    def __enter__(self):
+        self.process_peak_before = peak_rss_bytes()
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        process_peak = peak_rss_bytes()
+        if process_peak is not None and self.process_peak_before is not None and process_peak > self.process_peak_before:
+            self.peak = process_peak if self.peak is None else max(self.peak, process_peak)
+        return False
+
+
+def path_size(path):
+    """
+    Size in bytes of a file, or of all the files in a directory (multi-table artifacts)
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(path_size(os.path.join(path, name)) for name in os.listdir(path))
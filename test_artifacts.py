@@ -0,0 +1,27 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from artifacts import read_artifact, write_artifact
+
+
+class ArtifactRoundTripTest(unittest.TestCase):
+
+    def test_object_columns_read_back_as_written(self):
+        df = pd.DataFrame({
+            "geoId with None": pd.Series([2658434, None, 3], dtype=object),
+            "geoId with world": pd.Series([2658434, "world", 7.5], dtype=object),
+            "flag": pd.Series([True, False, True], dtype=object),
+            "text": ["Switzerland", None, "Peru"],
+            "count": [1, 2, 3],
+        })
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "table.parquet")
+            write_artifact(df, file_path)
+            pd.testing.assert_frame_equal(read_artifact(file_path), df)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from artifacts import write_artifact
+from data2network import build_network, construct_edges, construct_nodes, read_network_build
+
+
+def make_routes(merge_ids):
+    countries = [("France", "1001", "FR"), ("Italy", "1002", "IT"), ("Spain", "1003", "ES")]
+    routes = {"mergeID": merge_ids,
+              "Medical Products": ["sildenafil;"] * len(merge_ids),
+              "medicine quality": ["falsified"] * len(merge_ids),
+              "incident date": pd.to_datetime(["2020-01-01"] * len(merge_ids))}
+    for loc_index, loc in enumerate(["loc1", "loc2", "loc3", "loc4"]):
+        stops = [countries[(i + loc_index) % len(countries)] if loc_index < 2 else (None, None, None)
+                 for i in range(len(merge_ids))]
+        routes[f"{loc} geoname_country"] = [name for name, _, _ in stops]
+        routes[f"{loc} geoname_country_geoId"] = [geo_id for _, geo_id, _ in stops]
+        routes[f"{loc} geoname_country_lat"] = [1.5 if name else None for name, _, _ in stops]
+        routes[f"{loc} geoname_country_lon"] = [2.5 if name else None for name, _, _ in stops]
+        routes[f"{loc} geoname_countryCode"] = [code for _, _, code in stops]
+    return pd.DataFrame(routes)
+
+
+class BuildNetworkTest(unittest.TestCase):
+
+    def assert_same_as_full_build(self, routes_df, previous_build):
+        nodes_df, edges_df, _ = build_network(routes_df, previous_build)
+        pd.testing.assert_frame_equal(nodes_df, construct_nodes(routes_df))
+        pd.testing.assert_frame_equal(edges_df, construct_edges(routes_df))
+
+    def test_rerun_after_duplicated_merge_ids(self):
+        duplicated_routes = make_routes(["1-1", "1-1", "2-1"])
+        _, _, build = build_network(duplicated_routes)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # as saved by transform2network, then read back on the next run
+            build_file_path = os.path.join(tmp_dir, "aux_network_build.pkl")
+            write_artifact(build, build_file_path)
+            previous_build = read_network_build(build_file_path)
+        self.assert_same_as_full_build(make_routes(["1-1", "2-1", "3-1"]), previous_build)
+        self.assert_same_as_full_build(duplicated_routes, previous_build)
+
+    def test_rerun_reuses_unchanged_routes(self):
+        _, _, build = build_network(make_routes(["1-1", "2-1"]))
+        self.assert_same_as_full_build(make_routes(["1-1", "2-1", "3-1"]), build)
+
+
+if __name__ == "__main__":
+    unittest.main()
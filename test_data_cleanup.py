@@ -0,0 +1,22 @@
+import unittest
+
+import pandas as pd
+
+from data_cleanup import LOC_COLUMNS, resolve_location_references
+
+
+class ResolveLocationReferencesTest(unittest.TestCase):
+
+    def test_only_cells_with_a_resolved_reference_are_rewritten(self):
+        df = pd.DataFrame({"references": [" customs ", 7, "loc2;loc3", None, "LOC1; customs ", "loc4"]})
+        for loc_index, loc in enumerate(LOC_COLUMNS):
+            df[f"{loc} geoID"] = [100 + loc_index, 200, 300, None, 500, None]
+
+        resolved_counts = resolve_location_references(df, ["references"])
+
+        self.assertEqual(resolved_counts, {"references": 3})
+        self.assertEqual(df["references"].tolist(), [" customs ", 7, "300;300", None, "500;customs", "loc4"])
+
+
+if __name__ == "__main__":
+    unittest.main()
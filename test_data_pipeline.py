@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import data_pipeline
+import geo2features
+from artifacts import write_artifact
+from geonames_client import GeonamesTransientError
+from pipeline_scheduler import run_pipeline
+
+FAILING_GEO_ID = 3
+
+
+def fake_query_geonames_api(geoname_id, failing_geo_ids=(FAILING_GEO_ID,)):
+    if geoname_id in failing_geo_ids:
+        raise GeonamesTransientError(f"503 for geoID {geoname_id}")
+    return geo2features.hierarchy_to_result([
+        {"toponymName": "Europe", "lat": "48", "lng": "10"},
+        {"name": f"Country {geoname_id}", "countryCode": "XX", "geonameId": str(100 + geoname_id),
+         "lat": "1.5", "lng": "2.5"},
+    ])
+
+
+class GeonamesStepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.analysis_dir = self.tmp_dir.name
+        routes = {"mergeID": ["1-1", "2-1"], "include": [1, 1]}
+        for loc_index, loc in enumerate(geo2features.LOC_COLUMNS):
+            routes[f"{loc} location as stated"] = ["somewhere", "elsewhere"]
+            routes[f"{loc} geoID"] = [1 + loc_index, 2] if loc_index < 3 else [None, None]
+        write_artifact(pd.DataFrame(routes), os.path.join(self.analysis_dir, data_pipeline.DATA_CLEANED))
+        self.steps = {2: dict(data_pipeline.steps[2], preflight=[])}
+        self.state_file_path = os.path.join(self.analysis_dir, data_pipeline.PIPELINE_STATE_FILENAME)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_step(self, query_geonames_api):
+        with mock.patch.object(data_pipeline, "ANALYSIS_DIR", self.analysis_dir), \
+                mock.patch.object(geo2features, "query_geonames_api", query_geonames_api):
+            return run_pipeline(self.steps, self.analysis_dir, self.state_file_path)
+
+    def recorded_steps(self):
+        if not os.path.exists(self.state_file_path):
+            return {}
+        with open(self.state_file_path, encoding="utf-8") as state_file:
+            return json.load(state_file)
+
+    def test_transient_failure_leaves_the_step_unfingerprinted(self):
+        self.assertEqual(self.run_step(fake_query_geonames_api), {2: "incomplete"})
+        self.assertNotIn("step2to3", self.recorded_steps())
+        self.assertTrue(os.path.exists(os.path.join(self.analysis_dir,
+                                                    data_pipeline.INCLUDED_DATA_WITH_LOCATIONS_FETCHED_FILENAME)))
+
+        # the next run retries the failed geoID only, and is then recorded
+        retried = []
+        def query_geonames_api(geoname_id):
+            retried.append(geoname_id)
+            return fake_query_geonames_api(geoname_id, failing_geo_ids=())
+        self.assertEqual(self.run_step(query_geonames_api), {2: "ran"})
+        self.assertEqual(retried, [FAILING_GEO_ID])
+        self.assertIn("step2to3", self.recorded_steps())
+
+    def test_nothing_resolved_raises(self):
+        with self.assertRaises(RuntimeError):
+            self.run_step(lambda geoname_id: fake_query_geonames_api(geoname_id, failing_geo_ids=(1, 2, 3)))
+        self.assertNotIn("step2to3", self.recorded_steps())
+
+
+if __name__ == "__main__":
+    unittest.main()
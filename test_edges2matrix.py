@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from edges2matrix import adjacency_tensor_from_network, aggregate_adjacency_by_region
+
+COUNTRIES = ["France", "Italy", "Spain", "Peru"]
+COUNTRY_TO_REGION = {"France": "Europe", "Italy": "Europe", "Spain": "Europe", "Peru": "South America"}
+REGIONS = ["South America", "Europe"]
+
+
+def make_network():
+    # as from encode_network(): nodes numbered in the order of the nodes table, edges by node code
+    return {"nodes": pd.DataFrame({"country_name": COUNTRIES}),
+            "source": np.array([0, 0, 1, 3, 2, 3], dtype=np.int32),
+            "target": np.array([1, 3, 1, 2, 0, 0], dtype=np.int32),
+            "edges": pd.DataFrame({"incident date": pd.to_datetime(
+                ["2019-03-01", "2019-05-01", "2020-01-01", "2020-02-01", "2020-02-01", None])})}
+
+
+class AggregateAdjacencyByRegionTest(unittest.TestCase):
+
+    def test_sparse_group_slices_match_the_dense_tensor(self):
+        network = make_network()
+        keys, weighted, binary = adjacency_tensor_from_network(network, COUNTRIES, "year")
+        sparse_keys, sparse_weighted, sparse_binary = adjacency_tensor_from_network(network, COUNTRIES, "year",
+                                                                                    dense=False)
+        self.assertEqual(list(sparse_keys), list(keys))
+
+        for options in [{}, {"binary": True, "remove_self_loops": True}]:
+            for dense_tensor, sparse_slices in [(weighted, sparse_weighted), (binary, sparse_binary)]:
+                expected = aggregate_adjacency_by_region(dense_tensor, COUNTRIES, REGIONS, COUNTRY_TO_REGION,
+                                                         **options)
+                region_slices = aggregate_adjacency_by_region(sparse_slices, COUNTRIES, REGIONS, COUNTRY_TO_REGION,
+                                                              **options)
+                self.assertEqual(len(region_slices), len(keys))
+                for k, region_slice in enumerate(region_slices):
+                    self.assertEqual(region_slice.shape, (len(REGIONS), len(REGIONS)))
+                    np.testing.assert_array_equal(region_slice.toarray(), expected[k])
+
+
+if __name__ == "__main__":
+    unittest.main()
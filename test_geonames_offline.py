@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import geo2features
+import geonames_offline
+from geonames_offline import EARTH_GEONAME_ID, GeonamesOfflineIndex, build_offline_index
+
+EUROPE_GEONAME_ID = geonames_offline.CONTINENT_GEONAME_IDS["EU"]
+SWITZERLAND_GEONAME_ID = 2658434
+GENEVA_CANTON_GEONAME_ID = 2660645
+GENEVA_GEONAME_ID = 2660646  # not in hierarchy.txt, attached to its canton by admin code
+
+# (geonameId, name, lat, lng, fcode, countryCode, admin1), deliberately not sorted by geonameId
+FEATURES = [
+    (GENEVA_GEONAME_ID, "Geneva", "46.20222", "6.14569", "PPLA", "CH", "GE"),
+    (SWITZERLAND_GEONAME_ID, "Swiss Confederation", "47.00016", "8.01427", "PCLF", "CH", "00"),
+    (EARTH_GEONAME_ID, "Earth", "0", "0", "AREA", "", ""),
+    (GENEVA_CANTON_GEONAME_ID, "Genève", "46.19156", "6.14821", "ADM1", "CH", "GE"),
+    (EUROPE_GEONAME_ID, "Europe", "48.69096", "9.14062", "CONT", "", ""),
+]
+
+
+def write_dump(dump_dir):
+    with open(os.path.join(dump_dir, "allCountries.txt"), "w", encoding="utf-8") as all_countries_file:
+        for geo_id, name, lat, lng, fcode, country_code, admin1 in FEATURES:
+            columns = [str(geo_id), name, name, "", lat, lng, "P", fcode, country_code, "", admin1] + [""] * 8
+            all_countries_file.write("\t".join(columns) + "\n")
+    with open(os.path.join(dump_dir, "countryInfo.txt"), "w", encoding="utf-8") as country_info_file:
+        country_info_file.write("#ISO\tISO3\tISO-Numeric\tfips\tCountry\tCapital\n")
+        columns = ["CH", "CHE", "756", "SZ", "Switzerland", "Bern", "41290", "8516543", "EU", ".ch", "CHF", "Franc",
+                   "41", "####", "^(\\d{4})$", "de-CH,fr-CH,it-CH", str(SWITZERLAND_GEONAME_ID), "DE,IT,LI,FR,AT", ""]
+        country_info_file.write("\t".join(columns) + "\n")
+    with open(os.path.join(dump_dir, "hierarchy.txt"), "w", encoding="utf-8") as hierarchy_file:
+        hierarchy_file.write(f"{EUROPE_GEONAME_ID}\t{SWITZERLAND_GEONAME_ID}\t\n")
+        hierarchy_file.write(f"{EUROPE_GEONAME_ID}\t{GENEVA_CANTON_GEONAME_ID}\t\n")  # the ADM link wins
+        hierarchy_file.write(f"{SWITZERLAND_GEONAME_ID}\t{GENEVA_CANTON_GEONAME_ID}\tADM\n")
+
+
+class OfflineIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        dump_dir = os.path.join(cls.tmp_dir.name, "dump")
+        cls.index_dir = os.path.join(cls.tmp_dir.name, "index")
+        os.makedirs(dump_dir)
+        write_dump(dump_dir)
+        with mock.patch.object(geonames_offline, "CHUNK_SIZE", 2):  # record offsets carried across chunks
+            build_offline_index(dump_dir, cls.index_dir)
+        cls.index = GeonamesOfflineIndex(cls.index_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.index  # release the memory maps before removing the files
+        cls.tmp_dir.cleanup()
+
+    def test_binary_layout(self):
+        expected_ids = sorted(feature[0] for feature in FEATURES)
+        self.assertEqual(self.index.ids.dtype, np.int32)
+        self.assertEqual(self.index.ids.tolist(), expected_ids)
+        expected_parents = {EARTH_GEONAME_ID: 0, EUROPE_GEONAME_ID: EARTH_GEONAME_ID,
+                            SWITZERLAND_GEONAME_ID: EUROPE_GEONAME_ID,
+                            GENEVA_CANTON_GEONAME_ID: SWITZERLAND_GEONAME_ID,
+                            GENEVA_GEONAME_ID: GENEVA_CANTON_GEONAME_ID}
+        self.assertEqual(self.index.parents.tolist(), [expected_parents[geo_id] for geo_id in expected_ids])
+
+        with open(os.path.join(self.index_dir, "records.bin"), "rb") as records_file:
+            records = records_file.read()
+        self.assertEqual(self.index.starts.dtype, np.int64)
+        self.assertEqual(self.index.ends.dtype, np.int64)
+        self.assertEqual(sum(self.index.ends - self.index.starts), len(records))
+        canton_position = expected_ids.index(GENEVA_CANTON_GEONAME_ID)
+        canton_record = records[self.index.starts[canton_position]:self.index.ends[canton_position]]
+        self.assertEqual(canton_record.decode("utf-8"), "Genève\tGenève\t46.19156\t6.14821\tCH")
+
+    def test_hierarchy_is_shaped_like_the_api(self):
+        self.assertEqual(self.index.hierarchy(GENEVA_GEONAME_ID), [
+            {"toponymName": "Earth", "name": "Earth", "lat": "0", "lng": "0", "countryCode": "",
+             "geonameId": str(EARTH_GEONAME_ID)},
+            {"toponymName": "Europe", "name": "Europe", "lat": "48.69096", "lng": "9.14062", "countryCode": "",
+             "geonameId": str(EUROPE_GEONAME_ID)},
+            {"toponymName": "Swiss Confederation", "name": "Switzerland", "lat": "47.00016", "lng": "8.01427",
+             "countryCode": "CH", "geonameId": str(SWITZERLAND_GEONAME_ID)},
+            {"toponymName": "Genève", "name": "Genève", "lat": "46.19156", "lng": "6.14821", "countryCode": "CH",
+             "geonameId": str(GENEVA_CANTON_GEONAME_ID)},
+            {"toponymName": "Geneva", "name": "Geneva", "lat": "46.20222", "lng": "6.14569", "countryCode": "CH",
+             "geonameId": str(GENEVA_GEONAME_ID)},
+        ])
+        self.assertEqual(self.index.hierarchy(123), [])
+
+    def test_hierarchy_resolves_like_an_api_record(self):
+        with mock.patch.object(geo2features, "GEONAMES_OFFLINE_INDEX", self.index):
+            result = geo2features.query_geonames_api(GENEVA_GEONAME_ID)
+        self.assertEqual(result, {
+            "continent": "Europe", "geoname_continent_lat": "48.69096", "geoname_continent_lon": "9.14062",
+            "geoname_countryName": "Switzerland", "geoname_countryCode": "CH",
+            "geoname_country_geoId": str(SWITZERLAND_GEONAME_ID),
+            "geoname_country_lat": "47.00016", "geoname_country_lon": "8.01427",
+            "ADM1": "Genève", "ADM2": "Geneva",
+        })
+
+
+if __name__ == "__main__":
+    unittest.main()